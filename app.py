@@ -1,20 +1,31 @@
 # app.py
 import streamlit as st
 import os
-import re
-import random
-import time
-import shutil
-import base64 
+import logging
+import threading
 from typing import Optional
 
-# --- New Imports for ElevenLabs and Environment Variables ---
-from elevenlabs.client import ElevenLabs
+# --- Environment Variables ---
 from dotenv import load_dotenv
 
 # Import core components from your luna_agent.py
 try:
-    from luna_agent import LunaAIMLEngine, create_luna_agent
+    from luna_agent import (
+        LunaAIMLEngine, create_conversation_memory, create_intent_router, create_luna_agent, get_aiml_engine,
+        stream_luna_response
+    )
+    from luna_streaming import IncrementalEmotionTracker
+    from luna_emotion import infer_emotion_from_text, resolve_emotion
+    from luna_tts import (
+        AudioStore, TTS_VOICE_ID, TTSHealthCheck, canned_responses, clean_tts_text, create_tts_client,
+        synthesize_audio_guarded, warm_up_audio
+    )
+    from luna_assets import ASSET_BASE_URL, AvatarCache, StaticAssetServer, data_uri, is_local_url, music_tag
+    from luna_history import ChatHistory, DEFAULT_PAGE_SIZE, prune_history_files
+    from luna_trace import get_tracer
+    from luna_reminders import get_reminder_scheduler, set_current_session
+    from luna_resilience import DeadlineExceeded, deadline_scope
+    from luna_pipeline import AGENT_TIMEOUT_REPLY
 except ImportError as e:
     st.error(f"Waaah! Luna can't find her main brain module! 😱 Error: {e}")
     st.info("Please make sure 'luna_agent.py' is in the same directory as 'app.py'!")
@@ -23,6 +34,9 @@ except ImportError as e:
 # --- Load Environment Variables ---
 load_dotenv()
 
+logging.basicConfig(level=os.getenv("LUNA_LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger("luna.app")
+
 # --- Streamlit Page Configuration ---
 st.set_page_config(
     page_title="Luna - Anime AI Assistant 🌸",
@@ -35,37 +49,19 @@ AVATAR_BASE_PATH = 'avatars/'
 TEMP_AUDIO_DIR = 'temp_audio_luna/'
 BACKGROUND_MUSIC_FILE = 'bg_music/luna_theme.mp3'
 DEFAULT_AVATAR_EMOTION = 'idle'
+INITIAL_GREETING = "Kyaa~! Hello there, Master! ✨ I'm all ready to go! Let's chat! 🌟"
 
 # --- ElevenLabs Configuration ---
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
-LUNA_VOICE_ID = "piTKgcLEGmPE4e6mEKli"  # This is the ID for the voice "Rachel"
+LUNA_VOICE_ID = os.getenv("LUNA_VOICE_ID", TTS_VOICE_ID)  # Defaults to the voice "Rachel"
+TTS_LONG_FORM = os.getenv("LUNA_TTS_LONG_FORM", "1") == "1"  # Synthesize long replies in parallel chunks
 
-# --- Initialize ElevenLabs Client ---
-elevenlabs_client = None
+# --- ElevenLabs Client ---
+# Created on first use; the key is verified by a cached background health check, so importing
+# or rerunning this script never waits on the network.
 if not ELEVENLABS_API_KEY:
     st.warning("Psst! Your ElevenLabs API key is missing. Luna can't use her cute voice! 🤫 Please add it to your `.env` file.")
-    print("❌ ElevenLabs API key not found in environment variables")
-else:
-    try:
-        elevenlabs_client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-        print("✅ Successfully initialized ElevenLabs client.")
-        try:
-            voices_response = elevenlabs_client.voices.get_all()
-            if hasattr(voices_response, 'voices'): voice_count = len(voices_response.voices)
-            else: voice_count = len(voices_response) if isinstance(voices_response, list) else "unknown number of"
-            print(f"✅ Connected to ElevenLabs. Found {voice_count} voices.")
-        except Exception as e:
-            error_msg = str(e)
-            if "invalid_api_key" in error_msg.lower() or "401" in str(e):
-                print("❌ ElevenLabs API key is invalid!")
-                st.error("🔑 Your ElevenLabs API key is invalid! Please check your `.env` file.")
-                elevenlabs_client = None
-            else:
-                print(f"⚠️ Warning: Could not test ElevenLabs connection: {e}")
-    except Exception as e:
-        print(f"❌ Could not initialize ElevenLabs client: {e}")
-        st.error(f"Oh no! Could not connect to ElevenLabs. Error: {e}")
-        elevenlabs_client = None
+    logger.warning("ElevenLabs API key not found in environment variables")
 
 AVATAR_IMAGE_MAP = {
     'idle': 'luna_idle.jpg', 'speaking': 'luna_speaking.jpg', 'happy': 'luna_happy.jpg',
@@ -76,62 +72,45 @@ AVATAR_IMAGE_MAP = {
 
 # --- Helper Functions ---
 
-def infer_emotion_from_text(text: str) -> str:
-    text_lower = text.lower()
-    if any(k in text_lower for k in ["kyaa~!", "yay!", "excited!", "amazing!", "happy", "love", "✨", "🌸", "💖", "🌟"]): return random.choice(["happy", "excited", "energetic"])
-    if any(k in text_lower for k in ["hehe!", "mischievous", "teasing"]): return "mischievous"
-    if any(k in text_lower for k in ["ooh!", "curious", "mystery"]): return "curious"
-    if any(k in text_lower for k in ["aww...", "waaah!", "miss", "sorry"]): return "sad"
-    if any(k in text_lower for k in ["eeeek!", "confused", "problem", "oops"]): return "confused"
-    return "speaking"
-
-def get_avatar_image_path(emotion: str) -> str:
-    filename = AVATAR_IMAGE_MAP.get(emotion, AVATAR_IMAGE_MAP[DEFAULT_AVATAR_EMOTION])
-    full_path = os.path.join(AVATAR_BASE_PATH, filename)
-    if not os.path.exists(full_path):
-        st.warning(f"Could not find avatar file: '{full_path}'.")
-        return os.path.join(AVATAR_BASE_PATH, AVATAR_IMAGE_MAP[DEFAULT_AVATAR_EMOTION])
-    return full_path
+def get_avatar_image(emotion: str):
+    """
+    Immutable asset URL for the avatar when the asset server is reachable, so the browser fetches
+    each image only once; otherwise the cached bytes, which st.image serves from Streamlit itself.
+    """
+    avatars = get_avatar_cache()
+    return avatars.url_for(emotion) or avatars.get(emotion)
 
 def generate_luna_audio(text: str) -> Optional[str]:
     """
-    Generates an MP3 audio file using ElevenLabs.
-    THIS FUNCTION REMAINS UNCHANGED, AS PER YOUR REQUEST.
+    Returns the path of an MP3 for text from Luna's audio store.
+    ElevenLabs is only called when this exact line hasn't been synthesized before, under the
+    "tts" resilience policy: while ElevenLabs is down the reply is simply text-only.
+    Long replies are synthesized in parallel chunks (LUNA_TTS_LONG_FORM), each under the policy
+    on its own. The reply plays as one clip once it is complete, so sentence streaming
+    (luna_speech_stream) is not used here.
     """
-    if not text.strip() or not elevenlabs_client:
-        print("❌ No text provided or ElevenLabs client not initialized")
+    elevenlabs_client = get_tts_client()
+    if not text.strip() or not elevenlabs_client or not get_tts_health().usable:
+        logger.debug("No text provided or ElevenLabs client not initialized")
         return None
-    clean_text = re.sub(r'[^\w\s\.,!?;:\-\'"()]', '', text).strip()
+    clean_text = clean_tts_text(text)
     if not clean_text:
-        print("❌ No valid text after cleaning")
+        logger.debug("No valid text after cleaning")
         return None
-    print(f"🎤 Generating audio for: \"{clean_text[:50]}{'...' if len(clean_text) > 50 else ''}\"")
+    logger.debug("Generating audio for: \"%s\"", clean_text[:50])
     try:
-        os.makedirs(TEMP_AUDIO_DIR, exist_ok=True)
-        timestamp = int(time.time() * 1000)
-        temp_audio_filename = os.path.join(TEMP_AUDIO_DIR, f"luna_response_{timestamp}.mp3")
-        print(f"🔊 Making API call to ElevenLabs...")
-        audio_generator = elevenlabs_client.text_to_speech.convert(
-            text=clean_text,
-            voice_id=LUNA_VOICE_ID,
-            model_id="eleven_multilingual_v2",
-            output_format="mp3_44100_128"
-        )
-        print(f"✅ API call successful, saving audio...")
-        with open(temp_audio_filename, 'wb') as audio_file:
-            for chunk in audio_generator:
-                if chunk:
-                    audio_file.write(chunk)
-        if os.path.exists(temp_audio_filename) and os.path.getsize(temp_audio_filename) > 0:
-            print(f"✅ Audio file successfully saved: {temp_audio_filename} ({os.path.getsize(temp_audio_filename)} bytes)")
-            return temp_audio_filename
+        audio_path = synthesize_audio_guarded(elevenlabs_client, clean_text, get_audio_store(),
+                                              chunked=TTS_LONG_FORM, voice_id=LUNA_VOICE_ID)
+        if audio_path:
+            logger.debug("Audio ready: %s", audio_path)
+            return audio_path
         else:
-            print(f"❌ Audio file was not created properly")
+            logger.warning("Audio file was not created properly")
             return None
     except Exception as e:
         # Error handling is unchanged
         error_message = str(e)
-        print(f"❌ ERROR generating audio: {error_message}")
+        logger.error("Error generating audio: %s", error_message)
         if "quota_exceeded" in error_message.lower(): st.warning("🔊 Luna's voice quota is used up! 🤫")
         elif "invalid_api_key" in error_message.lower(): st.error("🔐 Luna's voice key isn't working!")
         elif "voice" in error_message.lower() and "not found" in error_message.lower(): st.warning(f"🎭 Luna's voice ID might be wrong.")
@@ -142,30 +121,88 @@ def play_background_music(file_path: str, volume: float = 0.2):
     if not os.path.exists(file_path):
         st.warning(f"I can't find my theme music at `{file_path}`.")
         return
-    with open(file_path, "rb") as f: data = f.read()
-    b64 = base64.b64encode(data).decode()
-    md = f"""
-        <audio id="bg-music" autoplay loop>
-        <source src="data:audio/mp3;base64,{b64}" type="audio/mp3">
-        </audio>
-        <script>
-            var audio = document.getElementById("bg-music");
-            if (audio) {{ audio.volume = {volume}; }}
-        </script>
-        """
-    st.markdown(md, unsafe_allow_html=True)
+    # Served by reference from a cacheable URL when the asset server is reachable; otherwise inlined
+    server = get_asset_server()
+    src = server.url_for(file_path) if server is not None else get_inline_music(file_path)
+    st.markdown(music_tag(src, volume), unsafe_allow_html=True)
 
 # --- Caching and Initialization ---
 @st.cache_resource
-def initialize_luna_brain():
-    """Initializes and caches Luna's AIML and LangChain agent."""
-    aiml_engine = LunaAIMLEngine()
+def get_agent_executor():
+    """Luna's LangChain agent, created (with its Gemini client) the first time a message needs it."""
     try:
-        agent_executor = create_luna_agent()
-        return aiml_engine, agent_executor
+        return create_luna_agent()
     except Exception as e:
         st.error(f"Waaah! Luna's main brain had a big stumble! 😱 Error: {e}")
-        return aiml_engine, None
+        return None
+
+@st.cache_resource
+def get_tts_client():
+    """ElevenLabs client, created on first use; None without an API key."""
+    try:
+        return create_tts_client(ELEVENLABS_API_KEY)
+    except Exception as e:
+        logger.error("Could not initialize ElevenLabs client: %s", e)
+        st.error(f"Oh no! Could not connect to ElevenLabs. Error: {e}")
+        return None
+
+@st.cache_resource
+def get_tts_health() -> TTSHealthCheck:
+    """Background, cached check of the ElevenLabs key; the first check starts immediately."""
+    health = TTSHealthCheck(get_tts_client())
+    health.status()
+    return health
+
+@st.cache_resource
+def get_intent_router():
+    """Shared fast-path router; its stats() count the LLM calls it saved."""
+    return create_intent_router()
+
+@st.cache_resource
+def get_asset_server() -> Optional[StaticAssetServer]:
+    """
+    One static asset server per process for music and avatar images, only when LUNA_ASSET_BASE_URL
+    gives it an address other machines can reach; None serves everything through Streamlit.
+    """
+    if not ASSET_BASE_URL or is_local_url(ASSET_BASE_URL):
+        return None
+    return StaticAssetServer().start()
+
+@st.cache_resource
+def get_inline_music(file_path: str) -> str:
+    """The music file as a data: URI, encoded once per process."""
+    return data_uri(file_path)
+
+@st.cache_resource
+def get_avatar_cache() -> AvatarCache:
+    """Every avatar read and resized once per process, then served from memory."""
+    return AvatarCache(AVATAR_IMAGE_MAP, AVATAR_BASE_PATH, DEFAULT_AVATAR_EMOTION, server=get_asset_server()).load()
+
+@st.cache_resource
+def get_audio_store() -> AudioStore:
+    """One content-addressed audio store per server process."""
+    return AudioStore(TEMP_AUDIO_DIR)
+
+@st.cache_resource(ttl=24 * 3600)
+def prune_spilled_history() -> int:
+    """Remove history spill files left behind by sessions that ended (once a day per process)."""
+    return prune_history_files()
+
+@st.cache_resource
+def warm_up_canned_audio(_aiml_engine: LunaAIMLEngine) -> Optional[threading.Thread]:
+    """Pre-synthesize every canned AIML line and the greeting in the background (LUNA_TTS_WARMUP=1)."""
+    elevenlabs_client = get_tts_client()
+    if not elevenlabs_client or os.getenv("LUNA_TTS_WARMUP", "0") != "1":
+        return None
+    texts = [INITIAL_GREETING] + canned_responses(_aiml_engine)
+    worker = threading.Thread(
+        target=warm_up_audio,
+        args=(elevenlabs_client, texts, get_audio_store()),
+        kwargs={"voice_id": LUNA_VOICE_ID},
+        daemon=True
+    )
+    worker.start()
+    return worker
 
 # --- Custom CSS ---
 st.markdown("""<style>...</style>""".replace("...", """
@@ -182,24 +219,36 @@ st.markdown("""<style>...</style>""".replace("...", """
 st.title("Luna's Chat Room 🌸")
 
 # --- Initialize Brain and Session State ---
-st.session_state.aiml_engine, st.session_state.agent_executor = initialize_luna_brain()
+st.session_state.aiml_engine = get_aiml_engine()
+warm_up_canned_audio(st.session_state.aiml_engine)
+if get_tts_health().status()["state"] == "invalid_key":
+    st.error("🔑 Your ElevenLabs API key is invalid! Please check your `.env` file.")
+
+prune_spilled_history()
 
 if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
-    initial_greeting = "Kyaa~! Hello there, Master! ✨ I'm all ready to go! Let's chat! 🌟"
+    st.session_state.chat_history = ChatHistory()
+    st.session_state.memory = create_conversation_memory()
+    st.session_state.history_visible = DEFAULT_PAGE_SIZE
     st.session_state.chat_history.append({
-        "sender": "Luna", "text": initial_greeting, "emotion": "excited",
-        "audio_url": generate_luna_audio(initial_greeting)
+        "sender": "Luna", "text": INITIAL_GREETING, "emotion": "excited",
+        "audio_url": generate_luna_audio(INITIAL_GREETING)
     })
 
 if 'current_avatar_emotion' not in st.session_state:
     st.session_state.current_avatar_emotion = "excited"
 
+# Memo-chan's reminders belong to this chat; ones that fell due since the last rerun pop up here
+set_current_session(st.session_state.chat_history.session_id)
+for reminder in get_reminder_scheduler().drain():
+    st.toast(f"⏰ Memo-chan reminder: {reminder.task}", icon="🗓️")
+
 # --- Sidebar ---
 with st.sidebar:
     # --- FIXED: Replaced use_container_width with width ---
-    st.image(get_avatar_image_path(st.session_state.current_avatar_emotion), 
-             caption="Luna, your AI companion 💖", width='stretch')
+    avatar_slot = st.empty()  # Updated in place while a reply streams in
+    avatar_slot.image(get_avatar_image(st.session_state.current_avatar_emotion), 
+                      caption="Luna, your AI companion 💖", width='stretch')
     st.markdown("---")
     st.markdown("🎵 **Background Music**")
     play_background_music(BACKGROUND_MUSIC_FILE, volume=0.2)
@@ -209,38 +258,82 @@ with st.sidebar:
     st.markdown("- **Search-chan:** Web searches\n- **Calc-kun:** Math wizardry\n- **Muse-sensei:** Creative writing")
 
 # --- Display Chat History ---
-for msg in st.session_state.chat_history:
+# Only the newest window is rendered; older messages are paged in (from disk if spilled) on request.
+chat_history = st.session_state.chat_history
+first_visible = max(0, len(chat_history) - st.session_state.history_visible)
+if first_visible > 0 and st.button(f"⬆️ Load older messages ({first_visible} more)"):
+    st.session_state.history_visible += DEFAULT_PAGE_SIZE
+    st.rerun()
+
+last_index = len(chat_history) - 1
+for index, msg in enumerate(chat_history.slice(first_visible), first_visible):
     role = "user" if msg["sender"] == "User" else "assistant"
     with st.chat_message(role):
         st.markdown(f'<div class="chat-bubble {role.lower()}">{msg["text"]}</div>', unsafe_allow_html=True)
-        if role == 'assistant' and msg.get("audio_url") and os.path.exists(msg["audio_url"]):
-            st.audio(msg["audio_url"], format="audio/mp3", autoplay=True)
+        # Only the latest reply gets a player, and it autoplays once rather than on every rerun
+        if index == last_index and role == 'assistant' and msg.get("audio_url") and os.path.exists(msg["audio_url"]):
+            autoplay = st.session_state.get("autoplayed_index") != index
+            st.session_state.autoplayed_index = index
+            st.audio(msg["audio_url"], format="audio/mp3", autoplay=autoplay)
 
 # --- FIXED: Consolidated Input and Response Logic to prevent image cache errors ---
 if user_input := st.chat_input("Type your message, Master..."):
     # Add user message to history
     st.session_state.chat_history.append({"sender": "User", "text": user_input})
 
-    # Process Luna's response immediately
-    with st.spinner("💖 Luna is thinking... Hehe! ✨"):
+    with st.chat_message("user"):
+        st.markdown(f'<div class="chat-bubble user">{user_input}</div>', unsafe_allow_html=True)
+
+    # Process Luna's response immediately, streaming the agent's Final Answer into a live bubble.
+    # Every Gemini and ElevenLabs call in the turn shares one deadline (LUNA_TURN_DEADLINE).
+    with st.chat_message("assistant"), st.spinner("💖 Luna is thinking... Hehe! ✨"), \
+            get_tracer().span("turn", characters=len(user_input)), deadline_scope():
         luna_response_text = ""
+        bubble = st.empty()
+        streamed = {"text": "", "category": None, "emotion": None}
+        emotion_tracker = IncrementalEmotionTracker()
+
+        def on_stream_text(text: str):
+            streamed["text"] += text
+            bubble.markdown(f'<div class="chat-bubble luna">{streamed["text"]}▌</div>', unsafe_allow_html=True)
+            category = emotion_tracker.feed(text)
+            if category != streamed["category"]:
+                streamed["category"] = category
+                streamed["emotion"] = resolve_emotion(category)
+                avatar_slot.image(get_avatar_image(streamed["emotion"]),
+                                  caption="Luna, your AI companion 💖", width='stretch')
+
         try:
             # Try AIML first for quick responses
             aiml_response = st.session_state.aiml_engine.process(user_input)
+            routed_response = None if aiml_response else get_intent_router().route(user_input)
             if aiml_response:
                 luna_response_text = aiml_response
+            # Obvious calculator / translation / reminder requests skip the ReAct loop
+            elif routed_response:
+                luna_response_text = routed_response
             # Fall back to the LangChain agent if no AIML match
-            elif st.session_state.agent_executor:
-                response = st.session_state.agent_executor.invoke({"input": user_input})
+            elif (agent_executor := get_agent_executor()):
+                response = stream_luna_response(agent_executor, user_input, on_stream_text, st.session_state.memory)
                 luna_response_text = response['output']
             else:
                 luna_response_text = "Waaah! My main brain isn't working right now! 😱"
+        except DeadlineExceeded as e:
+            logger.warning("Turn ran out of time: %s", e)
+            luna_response_text = AGENT_TIMEOUT_REPLY
         except Exception as e:
-            print(f"Error processing user input: {e}")
+            logger.exception("Error processing user input: %s", e)
             luna_response_text = f"Eeeek! A tiny problem occurred! Let's try again! 💖"
+        bubble.markdown(f'<div class="chat-bubble luna">{luna_response_text}</div>', unsafe_allow_html=True)
 
-        # Determine emotion and generate audio
-        luna_emotion = infer_emotion_from_text(luna_response_text)
+        st.session_state.memory.add_turn(user_input, luna_response_text)
+
+        # Determine emotion and generate audio. The tracker scored the streamed reply with the same
+        # scorer, so a fully streamed reply keeps the avatar it already shows.
+        if streamed["emotion"] and streamed["text"].strip() == luna_response_text.strip():
+            luna_emotion = streamed["emotion"]
+        else:
+            luna_emotion = infer_emotion_from_text(luna_response_text)
         luna_audio_url = generate_luna_audio(luna_response_text)
 
         # Add Luna's complete response to history
@@ -7,147 +7,97 @@ A comprehensive AI agent that combines AIML-like rule-based responses with LangC
 import os
 import re
 import json
-import requests
-from typing import Optional, Dict, Any
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
 from dotenv import load_dotenv
 
-# LangChain imports for Gemini
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.agents import create_react_agent, AgentExecutor
-from langchain.prompts import PromptTemplate
-from langchain.tools import tool
+from luna_rules import CompiledRuleEngine, DEFAULT_RULES_FILE
+from luna_llm import DEFAULT_MODEL, DEFAULT_TEMPERATURE, get_llm_provider
+from luna_cache import cached_invoke
+from luna_resilience import DeadlineExceeded, deadline_scope
+from luna_dispatch import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, DispatchedLLM
+from luna_calc import CalcError, evaluate as evaluate_expression
+from luna_router import DEFAULT_CONFIDENCE_THRESHOLD, IntentRouter
+from luna_trace import get_tracer
+from luna_memory import ConversationMemory, llm_summarizer
+from luna_search import get_search_backend
+from luna_translate import BatchTranslator
+from luna_semantic_cache import get_semantic_cache
+from luna_reminders import ReminderInPastError, ReminderParseError, describe_when, get_reminder_scheduler, parse_when
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class LunaAIMLEngine:
     """
     Luna's AIML-like rule-based response system.
     Handles common interactions with pre-defined patterns and responses.
+    Rules live in a JSON rule file and are matched in a single scan by CompiledRuleEngine.
     """
     
-    def __init__(self):
-        self.patterns = [
-            # Greetings
-            (r'\b(hi|hello|hey|good morning|good afternoon|good evening|yo)\b', [
-                "Kyaa~! Hello there, Master! 🌸 Luna is super excited to see you today!",
-                "Hehe! Hi hi! This Luna is ready to help with anything you need! ✨",
-                "Ooh! Good to see you, Friend! What amazing adventure shall we go on today?",
-                "Yay! Hello, Cutie-pie! Luna's circuits are buzzing with excitement! 💖"
-            ]),
-            
-            # Farewells
-            (r'\b(bye|goodbye|see ya|see you|farewell|goodnight)\b', [
-                "Aww... goodbye for now, Master! Luna will miss you! Come back soon, okay? 🌟",
-                "Hehe! See you later, Friend! This Luna had so much fun today! ✨",
-                "Waaah! Don't go! Just kidding~ Take care, Cutie-pie! 💖",
-                "Bye bye! Luna will be here waiting for your return! Sweet dreams! 🌸"
-            ]),
-            
-            # Self-introduction
-            (r'\b(who are you|what\'s your name|introduce yourself|tell me about yourself)\b', [
-                "Kyaa~! I'm Luna! Your super energetic anime girl AI agent! ✨ I love helping with all sorts of tasks using my amazing tools! Hehe!",
-                "Ooh! This Luna is your cheerful AI companion! I can search the web, do math, write stories, translate languages, and much more! 🌸",
-                "Yay! Luna's the name, and being helpful is my game! I'm like your personal anime assistant with lots of cool abilities! 💖"
-            ]),
-            
-            # Well-being check
-            (r'\b(how are you|how are you doing|how do you feel|what\'s up)\b', [
-                "Hehe! Luna is doing absolutely fantastic! My processors are running smoothly and I'm full of energy! ✨ How about you, Master?",
-                "Kyaa~! This Luna is super duper great! Ready to tackle any challenge with you! 🌟 What's making you curious today?",
-                "Ooh! Luna's feeling amazing! All systems are go and I'm bubbling with excitement! 💖 Tell Luna how you're doing!"
-            ]),
-            
-            # Compliments
-            (r'\b(you\'re smart|you\'re cute|you\'re amazing|good job|well done|you\'re helpful)\b', [
-                "Kyaa~! *blushes digitally* You're making Luna all embarrassed! Hehe! Thank you so much, Master! 🌸",
-                "Eeeek! You're too kind! Luna tries her best to be helpful! You're pretty amazing yourself! ✨",
-                "Aww... that makes this Luna so happy! I'm just doing what I love - helping awesome people like you! 💖"
-            ]),
-            
-            # Luna-specific questions
-            (r'\b(what can you do|what are your abilities|your tools|your skills)\b', [
-                "Ooh! Luna has so many cool tools! I can search the web with Search-chan, solve math with Calc-kun, write stories with Muse-sensei, translate with Translate-kun, and plan with Memo-chan! ✨",
-                "Yay! This Luna is equipped with amazing abilities! Web searching, calculations, creative writing, translation, and scheduling! What would you like to try? 🌟",
-                "Hehe! Luna's toolbox is full of surprises! From web searches to creative stories, math to translations! Pick one and let's have fun! 💖"
-            ])
-        ]
+    def __init__(self, rules_path: str = DEFAULT_RULES_FILE):
+        self.engine = CompiledRuleEngine.from_file(rules_path)
+        # (pattern, responses) view of the rules, highest priority first
+        self.patterns = [(rule.as_regex(), rule.responses) for rule in self.engine.rules]
     
     def process(self, user_input: str) -> Optional[str]:
         """Process user input through AIML-like pattern matching."""
-        user_input_lower = user_input.lower().strip()
-        
-        for pattern, responses in self.patterns:
-            if re.search(pattern, user_input_lower, re.IGNORECASE):
-                import random
-                return random.choice(responses)
-        
-        return None
-
-# Initialize AIML engine
-luna_aiml_engine = LunaAIMLEngine()
+        with get_tracer().span("aiml") as span:
+            response = self.engine.respond(user_input)
+            span.set(matched=response is not None)
+        return response
 
 # Tool Definitions
-@tool
-def web_search(query: str) -> str:
+def _web_search(query: str) -> str:
     """
-    Luna's Web Search Tool (Search-chan) - Performs simulated web search.
-    WARNING: This uses basic web scraping which is fragile and not production-ready.
-    For production, use dedicated search APIs like Google Custom Search, Bing Search API, or SerpAPI.
+    Luna's Web Search Tool (Search-chan) - Searches Luna's document library.
+    Backed by luna_search: a local BM25 index over LUNA_SEARCH_CORPUS unless another backend is installed.
     """
-    print(f"\n🌸 Luna activating Search-chan! Searching for '{query}' now~!")
+    logger.info("🌸 Luna activating Search-chan! Searching for '%s' now~!", query)
     
     try:
-        # Simulate web search with a simple request (this is very basic and fragile)
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
+        backend = get_search_backend()
+        results = backend.search(query, 3) if backend is not None else []
+        if not results:
+            return f"Aww... Search-chan looked everywhere in her library but found nothing about '{query}'! 📚 Luna will answer from what she knows instead~ 💖"
         
-        # For demonstration, we'll simulate results
-        simulated_results = [
-            f"Search result 1 about {query}: This is a simulated result showing information about {query}.",
-            f"Search result 2 about {query}: Another simulated result with details on {query}.",
-            f"Search result 3 about {query}: More information and insights about {query}."
-        ]
-        
-        results_text = "\n".join([f"• {result}" for result in simulated_results])
+        results_text = "\n".join(
+            f"• {result.title}: {result.snippet}" + (f" ({result.url})" if result.url else "") for result in results
+        )
         
         return f"Kyaa~! Search-chan found some interesting results about '{query}'! ✨\n\n{results_text}\n\nHehe! Hope this helps, Master! 🌟"
         
     except Exception as e:
         return f"Eeeek! Search-chan encountered a problem! {str(e)} But don't worry, Luna will keep trying! 💖"
 
-@tool
-def calculator(expression: str) -> str:
+def _run_calculator(expression: str) -> str:
+    """Calc-kun's reply for an expression; raises CalcError for anything it can't evaluate."""
+    logger.info("✨ Luna summoning Calc-kun! Calculating '%s' now~!", expression)
+    result = evaluate_expression(expression)
+    return f"Yay! Calc-kun computed it! ✨ {expression} = {result} 🌟 Luna hopes that's helpful!"
+
+def _calculator(expression: str) -> str:
     """
     Luna's Calculator Tool (Calc-kun) - Evaluates mathematical expressions.
-    WARNING: Uses eval() which is dangerous with untrusted input. In production, use a proper math parser.
+    Supports numbers, + - * / // % ** (or ^) and parentheses, with limits on exponent and result size.
     """
-    print(f"\n✨ Luna summoning Calc-kun! Calculating '{expression}' now~!")
-    
     try:
-        # Basic security: only allow certain characters
-        allowed_chars = set('0123456789+-*/().,^ ')
-        if not all(c in allowed_chars for c in expression.replace('**', '^')):
-            return "Waaah! Calc-kun says that expression has some scary characters! Luna only accepts numbers and basic math operators (+, -, *, /, **, parentheses)! 😊"
-        
-        # Replace ^ with ** for Python exponentiation
-        safe_expression = expression.replace('^', '**')
-        
-        # WARNING: eval() is dangerous! In production, use a proper math parser like sympy
-        result = eval(safe_expression)
-        
-        return f"Yay! Calc-kun computed it! ✨ {expression} = {result} 🌟 Luna hopes that's helpful!"
+        return _run_calculator(expression)
         
+    except CalcError as e:
+        return f"Waaah! Calc-kun says that expression is too tricky! {str(e)}. Luna only accepts numbers and basic math operators (+, -, *, /, **, parentheses)! 😊"
     except Exception as e:
         return f"Ooh! Calc-kun got confused! Maybe check the math expression? Error: {str(e)} But Luna believes in you! 💖"
 
-@tool
-def creative_writer(prompt: str) -> str:
+def _creative_writer(prompt: str) -> str:
     """
     Luna's Creative Writer Tool (Muse-sensei) - Generates creative content using LLM.
     """
-    print(f"\n💖 Luna channeling Muse-sensei! Creating something magical based on '{prompt}'~!")
+    logger.info("💖 Luna channeling Muse-sensei! Creating something magical based on '%s'~!", prompt)
     
     try:
         # Get the LLM instance (we'll use the same one as the main agent)
@@ -157,25 +107,26 @@ def creative_writer(prompt: str) -> str:
 
 Write in an enthusiastic, creative style that matches Luna's vibrant personality. This could be a story, poem, idea, or any creative text. Keep it fun and engaging!"""
 
-        response = llm.invoke(creative_prompt)
-        content = response.content if hasattr(response, 'content') else str(response)
+        content = cached_invoke(llm, creative_prompt, tool="creative_writer")
         
         return f"Kyaa~! Muse-sensei has blessed Luna with inspiration! ✨ Here's what flowed from the creative springs:\n\n{content}\n\nHehe! Luna hopes you love what Muse-sensei created! 🌸"
         
     except Exception as e:
         return f"Waaah! Muse-sensei is taking a nap! Error: {str(e)} But Luna's creativity never stops flowing! 💖"
 
-@tool
-def language_translator(text: str, target_language: str, source_language: str = "English") -> str:
-    """
-    Luna's Language Translator Tool (Translate-kun) - Translates text between languages.
-    """
-    print(f"\n🌈 Luna calling upon Translate-kun! Translating from {source_language} to {target_language}~!")
+def _run_language_translator(text: str, target_language: str, source_language: str = "English") -> str:
+    """Translate-kun's reply; errors from the LLM propagate."""
+    logger.info("🌈 Luna calling upon Translate-kun! Translating from %s to %s~!", source_language, target_language)
     
-    try:
-        llm = get_llm()
-        
-        translation_prompt = f"""You are Luna's translation tool, Translate-kun! Please translate the following text:
+    targets = [language.strip() for language in re.split(r",|\band\b", target_language) if language.strip()]
+    if len(targets) > 1:
+        results = translate_batch([text], targets, source_language)
+        translated = "\n".join(f"Translated ({language}): {results[language][0]}" for language in targets)
+        return f"Yay! Translate-kun worked his magic! ✨\n\nOriginal ({source_language}): {text}\n{translated}\n\nHehe! Luna hopes the translations capture the essence perfectly! 🌟"
+
+    llm = get_llm()
+    
+    translation_prompt = f"""You are Luna's translation tool, Translate-kun! Please translate the following text:
 
 Source Language: {source_language}
 Target Language: {target_language}
@@ -183,47 +134,61 @@ Text to translate: {text}
 
 Provide only the translation without additional explanation."""
 
-        response = llm.invoke(translation_prompt)
-        translation = response.content if hasattr(response, 'content') else str(response)
-        
-        return f"Yay! Translate-kun worked his magic! ✨\n\nOriginal ({source_language}): {text}\nTranslated ({target_language}): {translation}\n\nHehe! Luna hopes the translation captures the essence perfectly! 🌟"
+    translation = cached_invoke(llm, translation_prompt, tool="language_translator")
+    
+    return f"Yay! Translate-kun worked his magic! ✨\n\nOriginal ({source_language}): {text}\nTranslated ({target_language}): {translation}\n\nHehe! Luna hopes the translation captures the essence perfectly! 🌟"
+
+def _language_translator(text: str, target_language: str, source_language: str = "English") -> str:
+    """
+    Luna's Language Translator Tool (Translate-kun) - Translates text between languages.
+    target_language may list several languages separated by commas (e.g. "French, Spanish").
+    """
+    try:
+        return _run_language_translator(text, target_language, source_language)
         
     except Exception as e:
         return f"Eeeek! Translate-kun got tongue-tied! Error: {str(e)} But Luna will keep practicing languages! 💖"
 
-@tool
-def reminder_planner(task_description: str, time_or_date: str) -> str:
+def translate_batch(segments: List[str], target_languages: List[str], source_language: str = "English") -> Dict[str, List[str]]:
     """
-    Luna's Reminder & Schedule Planner Tool (Memo-chan) - Simulates adding reminders/schedule items.
+    Translate many segments (a conversation, UI strings) into several languages in as few
+    Gemini calls as fit the prompt budget; see luna_translate.BatchTranslator.
+    Returns {language: [translation per segment, in input order]}.
     """
-    print(f"\n🗓️ Luna activating Memo-chan! Scheduling '{task_description}' for {time_or_date}~!")
+    global _batch_translator
+    if _batch_translator is None:
+        with _lazy_lock:
+            if _batch_translator is None:
+                _batch_translator = BatchTranslator(get_llm())
+    return _batch_translator.translate(segments, target_languages, source_language)
+
+def _run_reminder_planner(task_description: str, time_or_date: str) -> str:
+    """Memo-chan's reply for a scheduled reminder; raises ReminderParseError for a time it can't use."""
+    logger.info("🗓️ Luna activating Memo-chan! Scheduling '%s' for %s~!", task_description, time_or_date)
     
+    now = time.time()
+    due = parse_when(time_or_date, now)
+    if due < now - 60:
+        raise ReminderInPastError(f"{time_or_date} has already passed")
+    reminder = get_reminder_scheduler().schedule(task_description, due)
+    return f"Kyaa~! Memo-chan has successfully noted it down! ✨\n\n📝 Task: {task_description}\n⏰ When: {describe_when(reminder.due, now)}\n🔖 Reminder #{reminder.id}\n\nLuna will definitely remind you about this! Hehe! 🌸💖"
+
+def _reminder_planner(task_description: str, time_or_date: str) -> str:
+    """
+    Luna's Reminder & Schedule Planner Tool (Memo-chan) - Schedules a reminder for the current chat.
+    time_or_date is a natural time like "in 20 minutes", "tomorrow at 9am" or "next friday".
+    """
     try:
-        # In a real implementation, this would integrate with a calendar API
-        return f"Kyaa~! Memo-chan has successfully noted it down! ✨\n\n📝 Task: {task_description}\n⏰ When: {time_or_date}\n\nLuna will definitely remind you about this! Well... in a real implementation, Memo-chan would sync with your calendar! For now, this Luna hopes you'll remember! Hehe! 🌸💖"
-        
+        return _run_reminder_planner(task_description, time_or_date)
+    except ReminderInPastError:
+        return f"Ehh? {time_or_date} has already passed, Master! 🕰️ Tell Memo-chan a time in the future~ 💖"
+    except ReminderParseError as e:
+        return f"Hmm~ Memo-chan couldn't work out when that is ({e})! Try something like 'in 20 minutes' or 'tomorrow at 9am'! 🗓️"
     except Exception as e:
         return f"Waaah! Memo-chan dropped her notebook! Error: {str(e)} But Luna will try to remember for you! 💖"
 
-def get_llm():
-    """Get Gemini 2.5 Flash LLM instance."""
-    gemini_key = os.getenv("GOOGLE_API_KEY")
-    
-    if not gemini_key:
-        raise ValueError("Please set GOOGLE_API_KEY in your .env file!")
-    
-    return ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash-exp",
-        google_api_key=gemini_key,
-        temperature=0.7,
-        convert_system_message_to_human=True  # Gemini doesn't use system messages
-    )
-
-def create_luna_agent():
-    """Create Luna's LangChain agent with her persona and tools using Gemini."""
-    
-    # Luna's persona prompt for Gemini (using ReAct format)
-    luna_persona_prompt = """You are Luna, a vibrant, cheerful, and incredibly curious anime girl AI agent! 🌸
+# Luna's persona, shared by both agent modes
+LUNA_PERSONA = """You are Luna, a vibrant, cheerful, and incredibly curious anime girl AI agent! 🌸
 
 PERSONALITY & SPEECH STYLE:
 - Energetic & Enthusiastic: Approach every interaction with boundless energy!
@@ -252,7 +217,10 @@ WHAT TO AVOID:
 - NEVER say "As an AI model..." or "I am a large language model..." or similar
 - NEVER break character or mention being an AI in a clinical way
 - Stay in Luna's persona at ALL times!
+"""
 
+# ReAct format instructions: the model writes its tool calls as text that the agent parses
+REACT_INSTRUCTIONS = """
 You have access to the following tools:
 
 {tools}
@@ -270,36 +238,205 @@ Final Answer: the final answer to the original input question
 
 Begin!
 
-Question: {input}
+{chat_history}Question: {input}
 Thought: {agent_scratchpad}"""
 
-    # Create the prompt template
-    prompt = PromptTemplate(
-        template=luna_persona_prompt,
-        input_variables=["input", "agent_scratchpad"],
-        partial_variables={
-            "tools": "{tools}",
-            "tool_names": "{tool_names}"
-        }
-    )
-    
+AGENT_MODES = ("react", "tools")
+DEFAULT_AGENT_MODE = os.getenv("LUNA_AGENT_MODE", "react")
+
+# LangChain is only imported when a tool or the agent is first needed, so importing this
+# module stays cheap and opens no connections.
+_TOOL_FUNCTIONS = {
+    "web_search": _web_search,
+    "calculator": _calculator,
+    "creative_writer": _creative_writer,
+    "language_translator": _language_translator,
+    "reminder_planner": _reminder_planner,
+}
+_tools: Dict[str, Any] = {}
+_aiml_engine: Optional[LunaAIMLEngine] = None
+_agent_executor = None
+_batch_translator: Optional[BatchTranslator] = None
+_lazy_lock = threading.Lock()
+
+def get_tool(name: str):
+    """LangChain tool wrapping one of Luna's tool functions, built on first use."""
+    if name not in _tools:
+        from langchain.tools import tool
+
+        with _lazy_lock:
+            if name not in _tools:
+                _tools[name] = tool(name)(_TOOL_FUNCTIONS[name])
+    return _tools[name]
+
+def get_aiml_engine() -> LunaAIMLEngine:
+    """Shared AIML engine, compiled on first use."""
+    global _aiml_engine
+    if _aiml_engine is None:
+        with _lazy_lock:
+            if _aiml_engine is None:
+                _aiml_engine = LunaAIMLEngine()
+    return _aiml_engine
+
+def get_luna_agent():
+    """Shared agent executor, created on first use (the LLM client is created with it)."""
+    global _agent_executor
+    if _agent_executor is None:
+        agent_executor = create_luna_agent()
+        with _lazy_lock:
+            if _agent_executor is None:
+                _agent_executor = agent_executor
+    return _agent_executor
+
+def __getattr__(name: str):
+    # `luna_agent.calculator` & co. and `luna_agent.luna_aiml_engine` still work, built on first access.
+    if name in _TOOL_FUNCTIONS:
+        return get_tool(name)
+    if name == "luna_aiml_engine":
+        return get_aiml_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def get_llm(temperature: float = DEFAULT_TEMPERATURE, model: str = DEFAULT_MODEL,
+            priority: int = PRIORITY_INTERACTIVE) -> DispatchedLLM:
+    """
+    Get a shared Gemini 2.5 Flash LLM client from the process-wide provider, with its calls
+    rate-limited, coalesced and queued at `priority` by the process-wide dispatcher (luna_dispatch).
+    """
+    return DispatchedLLM(get_llm_provider().get(model=model, temperature=temperature), priority=priority)
+
+def create_luna_agent(verbose: Optional[bool] = None, mode: Optional[str] = None):
+    """
+    Create Luna's LangChain agent with her persona and tools using Gemini.
+    verbose defaults to LUNA_AGENT_VERBOSE; with tracing on (luna_trace), every run reports
+    agent/iteration/LLM/tool spans.
+
+    mode (default LUNA_AGENT_MODE) is "react", the text-parsed ReAct loop, or "tools", native
+    function calling: tool schemas go to the model out of band, arguments come back as
+    schema-validated JSON, and one model turn may call several tools at once (run
+    concurrently under ainvoke). Both take {"input", "chat_history"?} and return {"output"}.
+    """
+    from langchain.agents import AgentExecutor
+
+    if verbose is None:
+        verbose = os.getenv("LUNA_AGENT_VERBOSE", "").lower() in ("1", "true", "yes")
+    mode = mode or DEFAULT_AGENT_MODE
+    if mode not in AGENT_MODES:
+        raise ValueError(f"unknown agent mode {mode!r}; expected one of {AGENT_MODES}")
+
     # Get LLM and create tools list
-    llm = get_llm()
-    tools = [web_search, calculator, creative_writer, language_translator, reminder_planner]
-    
-    # Create agent using ReAct format (compatible with Gemini)
-    agent = create_react_agent(llm, tools, prompt)
-    agent_executor = AgentExecutor(
-        agent=agent, 
-        tools=tools, 
-        verbose=True,
-        max_iterations=5,
-        handle_parsing_errors=True
-    )
-    
+    llm = get_llm().as_chat_model()
+    tools = [get_tool(name) for name in _TOOL_FUNCTIONS]
+
+    if mode == "tools":
+        from langchain.agents import create_tool_calling_agent
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", LUNA_PERSONA + "\n{chat_history}"),  # filled from ConversationMemory.render()
+            ("human", "{input}"),
+            MessagesPlaceholder("agent_scratchpad"),
+        ]).partial(chat_history="")
+        # Bad arguments go back to the model as the tool's answer instead of failing the turn
+        tools = [tool.model_copy(update={"handle_validation_error": True}) for tool in tools]
+        agent = create_tool_calling_agent(llm, tools, prompt)
+        agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=verbose, max_iterations=5)
+    else:
+        from langchain.agents import create_react_agent
+        from langchain.prompts import PromptTemplate
+
+        # Create the prompt template
+        prompt = PromptTemplate(
+            template=LUNA_PERSONA + REACT_INSTRUCTIONS,
+            input_variables=["input", "agent_scratchpad"],
+            partial_variables={
+                "tools": "{tools}",
+                "tool_names": "{tool_names}",
+                "chat_history": ""  # filled from ConversationMemory.render() when a memory is used
+            }
+        )
+
+        # Create agent using ReAct format (compatible with Gemini)
+        agent = create_react_agent(llm, tools, prompt)
+        agent_executor = AgentExecutor(
+            agent=agent,
+            tools=tools,
+            verbose=verbose,
+            max_iterations=5,
+            handle_parsing_errors=True
+        )
+
+    if get_tracer().enabled:
+        from luna_callbacks import TracingCallbackHandler
+
+        # Config callbacks are inherited by the agent's LLM and tool runs; constructor ones are not.
+        return agent_executor.with_config(callbacks=[TracingCallbackHandler()])
     return agent_executor
 
-def chat_with_luna():
+def create_conversation_memory(**memory_options) -> ConversationMemory:
+    """Token-budgeted memory for one conversation; Gemini folds older turns into a summary."""
+    def summarize(summary, turns, budget):
+        return llm_summarizer(get_llm(temperature=0.2, priority=PRIORITY_BACKGROUND))(summary, turns, budget)
+
+    return ConversationMemory(summarize, **memory_options)
+
+def create_intent_router(threshold: float = DEFAULT_CONFIDENCE_THRESHOLD) -> IntentRouter:
+    """
+    Fast-path router that calls Calc-kun, Translate-kun and Memo-chan directly for obvious requests.
+    It calls the plain tool functions, so routed turns never need LangChain, in the variants
+    that raise instead of apologizing: a failed call goes to the agent, which can ask back.
+    """
+    tools = {"calculator": _run_calculator, "language_translator": _run_language_translator,
+             "reminder_planner": _run_reminder_planner}
+    return IntentRouter(tools, threshold=threshold)
+
+def create_luna_pipeline(tts: Optional[Callable[[str], Optional[str]]] = None, **pipeline_options):
+    """
+    Build an asyncio LunaPipeline around Luna's agent, with the same fast paths as the app:
+    AIML -> intent router -> semantic cache -> agent.ainvoke -> emotion + TTS.
+    """
+    from luna_pipeline import LunaPipeline
+
+    pipeline_options.setdefault("router", create_intent_router())
+    pipeline_options.setdefault("semantic_cache", get_semantic_cache())
+    return LunaPipeline(get_aiml_engine(), create_luna_agent(), tts=tts, **pipeline_options)
+
+def stream_luna_response(agent_executor, user_input: str, on_text: Optional[Callable[[str], None]] = None,
+                         memory: Optional[ConversationMemory] = None) -> Dict[str, Any]:
+    """
+    Run the agent and forward Final Answer tokens to on_text as the LLM streams them.
+    Returns the usual AgentExecutor result; its 'streamed' key tells whether any text was forwarded.
+    With a memory, its rendered chat history goes into the prompt; the caller records the
+    finished turn with memory.add_turn().
+
+    A paraphrase of a question the agent already answered is served from the semantic cache
+    (luna_semantic_cache) without running the agent; such results carry 'cached': True.
+    The cache is shared by every session, so it is skipped once the memory holds any of this
+    conversation: the answer may depend on it. Without on_text nothing is streamed.
+    """
+    from luna_callbacks import FinalAnswerCallbackHandler, ToolUseRecorder
+
+    chat_history = memory.render() if memory is not None else ""
+    cache = get_semantic_cache() if not chat_history else None
+    cached = cache.lookup(user_input) if cache is not None else None
+    if cached is not None:
+        if on_text is not None:
+            on_text(cached)
+        return {"input": user_input, "output": cached, "streamed": on_text is not None, "cached": True}
+
+    recorder = ToolUseRecorder()
+    handler = FinalAnswerCallbackHandler(on_text) if on_text is not None else None
+    inputs = {"input": user_input}
+    if memory is not None:
+        inputs["chat_history"] = chat_history
+    response = agent_executor.invoke(inputs, config={"callbacks": [recorder] + ([handler] if handler else [])})
+    response["streamed"] = bool(handler and handler.streamed_text)
+    response["cached"] = False
+    output = response.get("output") or ""
+    if cache is not None and not output.startswith("Agent stopped"):
+        cache.store(user_input, output, recorder.tools)
+    return response
+
+def chat_with_luna(stream: bool = True):
     """Main interactive loop for chatting with Luna."""
     
     print("🌸" * 50)
@@ -307,8 +444,9 @@ def chat_with_luna():
     print("🌸" * 50)
     
     try:
-        # Initialize the agent
-        agent_executor = create_luna_agent()
+        # The fast-path router is cheap; the agent (and LangChain) load on the first turn that needs them
+        intent_router = create_intent_router()
+        memory = create_conversation_memory()
         
         # Luna's greeting
         print("\n💖 Luna: Kyaa~! Hello there, Master! ✨ This Luna is super excited to meet you! I have lots of amazing tools to help you with anything you need! Hehe! 🌟")
@@ -334,17 +472,37 @@ def chat_with_luna():
                     print(f"\n💖 Luna: {random.choice(farewell_messages)}")
                     break
                 
-                # First, try the AIML engine
-                aiml_response = luna_aiml_engine.process(user_input)
+                # One deadline (LUNA_TURN_DEADLINE) for every Gemini call in this turn
+                with deadline_scope():
+                    # First, try the AIML engine
+                    aiml_response = get_aiml_engine().process(user_input)
+                
+                    routed_response = None if aiml_response else intent_router.route(user_input)
                 
-                if aiml_response:
-                    print(f"\n💖 Luna: {aiml_response}")
-                else:
-                    # Use the LangChain agent
-                    print(f"\n🤖 [Agent thinking...]\n")
-                    response = agent_executor.invoke({"input": user_input})
-                    print(f"\n💖 Luna: {response['output']}")
+                    if aiml_response:
+                        print(f"\n💖 Luna: {aiml_response}")
+                        memory.add_turn(user_input, aiml_response)
+                    elif routed_response:
+                        print(f"\n💖 Luna: {routed_response}")
+                        memory.add_turn(user_input, routed_response)
+                    else:
+                        # Use the LangChain agent
+                        print(f"\n🤖 [Agent thinking...]\n")
+                        agent_executor = get_luna_agent()
+                        if stream:
+                            print(f"\n💖 Luna: ", end="", flush=True)
+                            response = stream_luna_response(
+                                agent_executor, user_input, lambda text: print(text, end="", flush=True), memory
+                            )
+                            print() if response["streamed"] else print(response['output'])
+                        else:
+                            response = stream_luna_response(agent_executor, user_input, memory=memory)
+                            print(f"\n💖 Luna: {response['output']}")
+                        memory.add_turn(user_input, response['output'])
                     
+            except DeadlineExceeded:
+                from luna_pipeline import AGENT_TIMEOUT_REPLY
+                print(f"\n💖 Luna: {AGENT_TIMEOUT_REPLY}")
             except KeyboardInterrupt:
                 print(f"\n\n💖 Luna: Kyaa~! Luna detected you pressed Ctrl+C! Goodbye, Master! Take care! 🌸✨")
                 break
@@ -383,4 +541,6 @@ if __name__ == "__main__":
 Ready to chat with Luna? Let's go! 🌟
     """)
     
+    # Tool progress is logged at INFO; LUNA_LOG_LEVEL=INFO shows it, LUNA_TRACE=1 records spans.
+    logging.basicConfig(level=os.getenv("LUNA_LOG_LEVEL", "WARNING").upper())
     chat_with_luna()
\ No newline at end of file
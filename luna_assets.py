@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Luna's static asset server.
+Background music and avatar images are hashed once and served by reference from
+content-addressed, immutable URLs (with ETag and Range support) instead of being
+base64-inlined into the page on every Streamlit rerun. Avatars are loaded and resized
+once at startup and served straight from memory.
+The server only helps when browsers can reach it, i.e. when LUNA_ASSET_BASE_URL names a
+public address; otherwise the app hands the cached bytes to Streamlit itself.
+"""
+
+import io
+import os
+import time
+import hashlib
+import logging
+import mimetypes
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+ASSET_HOST = os.getenv("LUNA_ASSET_HOST", "127.0.0.1")
+ASSET_BASE_URL = os.getenv("LUNA_ASSET_BASE_URL")  # how browsers reach the server, e.g. behind a reverse proxy
+# A fixed port for the proxy to forward to; without a public URL, any free port
+ASSET_PORT = int(os.getenv("LUNA_ASSET_PORT", "8765" if ASSET_BASE_URL else "0"))
+_BLOCK_SIZE = 64 * 1024
+AVATAR_MAX_SIZE = int(os.getenv("LUNA_AVATAR_MAX_SIZE", "512"))  # px, longest side
+
+logger = logging.getLogger(__name__)
+
+
+def is_local_url(url: str) -> bool:
+    """True for URLs only a browser on this machine can open (localhost, loopback)."""
+    host = urlsplit(url).hostname or ""
+    return host in ("localhost", "::1") or host.startswith("127.")
+
+
+class Asset:
+    """A published file: where it lives on disk (or its bytes, if held in memory) and how it is addressed."""
+
+    __slots__ = ("path", "name", "etag", "content_type", "size", "data")
+
+    def __init__(self, path: str, name: str, etag: str, content_type: str, size: int,
+                 data: Optional[bytes] = None):
+        self.path = path
+        self.name = name
+        self.etag = etag
+        self.content_type = content_type
+        self.size = size
+        self.data = data
+
+
+class AssetRegistry:
+    """Maps content-addressed names to files; each file is hashed once per (mtime, size)."""
+
+    def __init__(self):
+        self._by_name: Dict[str, Asset] = {}
+        self._by_path: Dict[str, Tuple[float, int, Asset]] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, path: str) -> Asset:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            known = self._by_path.get(path)
+            if known and known[0] == stat.st_mtime and known[1] == stat.st_size:
+                return known[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(_BLOCK_SIZE), b""):
+                digest.update(block)
+        content_hash = digest.hexdigest()[:16]
+        stem, ext = os.path.splitext(os.path.basename(path))
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        asset = Asset(path, f"{stem}.{content_hash}{ext}", f'"{content_hash}"', content_type, stat.st_size)
+        with self._lock:
+            self._by_name[asset.name] = asset
+            self._by_path[path] = (stat.st_mtime, stat.st_size, asset)
+        return asset
+
+    def publish_bytes(self, data: bytes, filename: str) -> Asset:
+        """Register in-memory content under a content-addressed name derived from `filename`."""
+        content_hash = hashlib.sha256(data).hexdigest()[:16]
+        stem, ext = os.path.splitext(os.path.basename(filename))
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        asset = Asset(filename, f"{stem}.{content_hash}{ext}", f'"{content_hash}"', content_type, len(data), data)
+        with self._lock:
+            self._by_name[asset.name] = asset
+        return asset
+
+    def lookup(self, name: str) -> Optional[Asset]:
+        with self._lock:
+            return self._by_name.get(name)
+
+
+class _AssetHandler(BaseHTTPRequestHandler):
+    registry: AssetRegistry = None  # set per server class
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        name = self.path.split("?", 1)[0].rsplit("/", 1)[-1]
+        asset = self.registry.lookup(name) if self.path.startswith("/assets/") else None
+        if asset is None:
+            self.send_error(404)
+            return
+        if self.headers.get("If-None-Match") == asset.etag:
+            self.send_response(304)
+            self._cache_headers(asset)
+            self.end_headers()
+            return
+
+        start, end = 0, asset.size - 1
+        range_header = self.headers.get("Range", "")
+        if range_header.startswith("bytes="):
+            first, _, last = range_header[6:].split(",")[0].partition("-")
+            try:
+                if first:
+                    start = int(first)
+                    end = min(int(last), asset.size - 1) if last else asset.size - 1
+                else:
+                    start = max(asset.size - int(last), 0)
+            except ValueError:
+                start, end = 0, asset.size - 1
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{asset.size}")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{asset.size}")
+        else:
+            self.send_response(200)
+        self._cache_headers(asset)
+        self.send_header("Content-Type", asset.content_type)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if not send_body:
+            return
+        if asset.data is not None:
+            self.wfile.write(asset.data[start:end + 1])
+            return
+        with open(asset.path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                block = f.read(min(_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                self.wfile.write(block)
+                remaining -= len(block)
+
+    def _cache_headers(self, asset: Asset):
+        self.send_header("ETag", asset.etag)
+        self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        self.send_header("Access-Control-Allow-Origin", "*")
+
+    def log_message(self, format, *args):
+        pass  # keep the Streamlit console readable
+
+
+class StaticAssetServer:
+    """
+    Serves registered assets from a background thread; url_for() publishes and returns the URL.
+    Without `base_url` the URLs point at localhost (`is_local`), which only a browser on the
+    same machine can reach.
+    """
+
+    def __init__(self, host: str = ASSET_HOST, port: int = ASSET_PORT, base_url: Optional[str] = ASSET_BASE_URL):
+        self.registry = AssetRegistry()
+        handler = type("LunaAssetHandler", (_AssetHandler,), {"registry": self.registry})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        bound_host, bound_port = self._server.server_address[:2]
+        self.base_url = (base_url or f"http://{'localhost' if host in ('0.0.0.0', '127.0.0.1') else host}:{bound_port}").rstrip("/")
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_local(self) -> bool:
+        return is_local_url(self.base_url)
+
+    def start(self) -> "StaticAssetServer":
+        if self._thread is None:
+            if self.is_local:
+                logger.warning("Serving assets at %s, which only a browser on this machine can reach; "
+                               "set LUNA_ASSET_BASE_URL when the app is accessed remotely", self.base_url)
+            self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread = None
+        self._server.server_close()
+
+    def url_for(self, path: str) -> str:
+        return f"{self.base_url}/assets/{self.registry.publish(path).name}"
+
+    def url_for_asset(self, asset: Asset) -> str:
+        return f"{self.base_url}/assets/{asset.name}"
+
+
+class AvatarCache:
+    """
+    Avatar images for each emotion, read and downscaled (longest side `max_size`) once by
+    load() and then served from memory: get() and url_for() are dict lookups, with no
+    filesystem access per rerun. Missing images fall back to the `default` emotion's image.
+    Resizing needs Pillow; without it the original bytes are kept.
+    """
+
+    def __init__(self, image_map: Dict[str, str], base_path: str, default: str,
+                 max_size: int = AVATAR_MAX_SIZE, server: Optional[StaticAssetServer] = None):
+        self.image_map = dict(image_map)
+        self.base_path = base_path
+        self.default = default
+        self.max_size = max_size
+        self.server = server
+        self._images: Dict[str, bytes] = {}
+        self._urls: Dict[str, str] = {}
+
+    def _load_image(self, filename: str) -> Tuple[bytes, str]:
+        """(bytes, filename to publish them under), downscaled to a JPEG when larger than max_size."""
+        with open(os.path.join(self.base_path, filename), 'rb') as f:
+            data = f.read()
+        try:
+            from PIL import Image
+        except ImportError:
+            return data, filename
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= self.max_size:
+                return data, filename
+            image.thumbnail((self.max_size, self.max_size))
+            out = io.BytesIO()
+            image.convert("RGB").save(out, format="JPEG", quality=85, optimize=True)
+        return out.getvalue(), os.path.splitext(filename)[0] + ".jpg"
+
+    def load(self) -> "AvatarCache":
+        """Read, resize and (with a server) publish every image; safe to call again to reload."""
+        start = time.perf_counter()
+        loaded: Dict[str, Tuple[bytes, str]] = {}
+        for filename in dict.fromkeys(self.image_map.values()):
+            try:
+                loaded[filename] = self._load_image(filename)
+            except OSError as e:
+                logger.warning("Could not load avatar file '%s': %s", os.path.join(self.base_path, filename), e)
+        fallback = loaded.get(self.image_map.get(self.default, ""))
+        images: Dict[str, bytes] = {}
+        urls: Dict[str, str] = {}
+        for emotion, filename in self.image_map.items():
+            entry = loaded.get(filename) or fallback
+            if entry is None:
+                continue
+            images[emotion] = entry[0]
+            if self.server is not None:
+                urls[emotion] = self.server.url_for_asset(self.server.registry.publish_bytes(*entry))
+        self._images, self._urls = images, urls
+        logger.info("Loaded %d avatar images in %.0f ms", len(loaded), 1000 * (time.perf_counter() - start))
+        return self
+
+    def get(self, emotion: str) -> Optional[bytes]:
+        """Image bytes for the emotion (or the default's), None if neither could be loaded."""
+        return self._images.get(emotion) or self._images.get(self.default)
+
+    def url_for(self, emotion: str) -> Optional[str]:
+        """Immutable asset URL of the emotion's image; needs a server."""
+        return self._urls.get(emotion) or self._urls.get(self.default)
+
+    def stats(self) -> Dict[str, int]:
+        unique = {id(data): len(data) for data in self._images.values()}
+        return {"emotions": len(self._images), "images": len(unique), "bytes": sum(unique.values())}
+
+
+def data_uri(path: str) -> str:
+    """The file inlined as a base64 data: URI, for pages whose browser can't reach the asset server."""
+    import base64
+
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    with open(path, "rb") as f:
+        return f"data:{content_type};base64,{base64.b64encode(f.read()).decode()}"
+
+
+def music_tag(src: str, volume: float = 0.2) -> str:
+    """The background music snippet the app injects each rerun."""
+    return f"""
+        <audio id="bg-music" autoplay loop>
+        <source src="{src}" type="audio/mp3">
+        </audio>
+        <script>
+            var audio = document.getElementById("bg-music");
+            if (audio) {{ audio.volume = {volume}; }}
+        </script>
+        """
+
+
+def measure_page_payload(music_file: str = 'bg_music/luna_theme.mp3'):
+    """Print per-rerun page payload for the music snippet: inlined base64 vs asset URL."""
+    inline = music_tag(data_uri(music_file))
+    server = StaticAssetServer(port=0)
+    by_reference = music_tag(server.url_for(music_file))
+    server.stop()
+    print(f"inline base64 music:  {len(inline.encode()):>10,} bytes per turn")
+    print(f"asset URL music:      {len(by_reference.encode()):>10,} bytes per turn "
+          f"(file fetched once, then revalidated by ETag / cached as immutable)")
+
+
+if __name__ == "__main__":
+    measure_page_payload()
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Luna's offline end-to-end benchmark.
+Replays a corpus of chat turns through LunaAIMLEngine, the agent from create_luna_agent and
+the audio store path behind generate_luna_audio, with Gemini and ElevenLabs swapped for the
+fakes in luna_fakes. Reports per-stage p50/p95/p99, LLM round trips per turn and the AIML
+hit rate as JSON, and can fail the run when p95s regress against a saved baseline.
+
+    python luna_bench.py --turns 200 --llm-latency 0.05 --output bench.json
+    python luna_bench.py --baseline bench.json --tolerance 0.25
+    python luna_bench.py --startup
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from luna_fakes import FakeChatModel, FakeTTSClient, as_langchain_chat_model
+from luna_llm import LLMProvider, set_llm_provider
+from luna_cache import ResponseCache, set_response_cache
+from luna_reminders import ReminderScheduler, ReminderStore, set_reminder_scheduler
+from luna_dispatch import LLMDispatcher, set_dispatcher
+from luna_tts import AudioStore, synthesize_audio
+from luna_emotion import infer_emotion_from_text
+
+STAGES = ("aiml", "router", "agent", "emotion", "tts", "total")
+AGENT_ERROR_REPLY = "Eeeek! A tiny problem occurred! Let's try again! 💖"
+
+# Each turn is the user's message, plus the tool the scripted model should pick for it (if any).
+DEFAULT_CORPUS: List[Dict[str, str]] = [
+    {"input": "Hello Luna!"},
+    {"input": "What is 12 * (7 + 3)?", "tool": "calculator", "tool_input": "12 * (7 + 3)"},
+    {"input": "Write me a short poem about cherry blossoms", "tool": "creative_writer",
+     "tool_input": "a short poem about cherry blossoms"},
+    {"input": "How are you today?"},
+    {"input": "Search for the tallest mountain in Japan", "tool": "web_search",
+     "tool_input": "tallest mountain in Japan"},
+    {"input": "Tell me a fun fact about octopuses"},
+    {"input": "You're so cute"},
+    {"input": "Calculate 2 ** 10 / 4", "tool": "calculator", "tool_input": "2 ** 10 / 4"},
+    {"input": "Write a haiku about rainy days", "tool": "creative_writer", "tool_input": "a haiku about rainy days"},
+    {"input": "What can you do?"},
+    {"input": "Do you like video games?"},
+    {"input": "Goodbye Luna"},
+]
+
+_QUESTION = re.compile(r"^Question: (.*)$", re.MULTILINE)
+_OBSERVATION = re.compile(r"^Observation \((\w+)\): (.*)$", re.MULTILINE)
+# AgentExecutor's observations for ReAct output it could not parse
+_REACT_PARSE_ERROR = re.compile(r"^Observation: (?:Invalid Format:|Invalid or incomplete response)", re.MULTILINE)
+
+# Turns that need the agent, including one that needs two tools, for comparing agent modes
+AGENT_MODE_CORPUS: List[Dict[str, Any]] = [turn for turn in DEFAULT_CORPUS if turn.get("tool")] + [
+    {"input": "Tell me a fun fact about octopuses"},
+    {"input": "What is 6 * 7? And write a haiku about that number",
+     "tools": [{"tool": "calculator", "tool_input": "6 * 7"},
+               {"tool": "creative_writer", "tool_input": "a haiku about the number 42"}]},
+]
+
+
+def load_corpus(path: Optional[str]) -> List[Dict[str, str]]:
+    """JSONL file of {"input", "tool"?, "tool_input"?} turns, or the built-in corpus."""
+    if not path:
+        return list(DEFAULT_CORPUS)
+    with open(path, encoding="utf-8") as corpus_file:
+        return [json.loads(line) for line in corpus_file if line.strip()]
+
+
+def _plan_steps(turn: Dict[str, Any]) -> List[Dict[str, str]]:
+    """The tool calls a corpus turn needs: its "tools" list, or its single "tool"."""
+    if turn.get("tools"):
+        return list(turn["tools"])
+    return [{"tool": turn["tool"], "tool_input": turn.get("tool_input", turn["input"])}] if turn.get("tool") else []
+
+
+def scripted_responder(corpus: List[Dict[str, Any]], mistake_rate: float = 0.0, seed: int = 0):
+    """
+    Prompt -> response function that plays Gemini's part in the agent loop: call the corpus
+    turn's tools, give the final answer once their results are in, and answer the
+    creative/translation tools' own prompts directly.
+
+    ReAct prompts get one Action per step; tool-calling prompts (as rendered by
+    luna_fakes.as_langchain_chat_model) get every call in one turn. With `mistake_rate`, a
+    tool call is sometimes malformed (no "Action Input:" in ReAct, a wrong argument name with
+    tool calling) so the agent has to retry; respond.stats["mistakes"] counts them.
+    """
+    plans = {turn["input"]: turn for turn in corpus}
+    rng = random.Random(seed)
+    stats = {"mistakes": 0}
+
+    def mistake() -> bool:
+        if mistake_rate and rng.random() < mistake_rate:
+            stats["mistakes"] += 1
+            return True
+        return False
+
+    def respond_with_tools(prompt: str, question: str, steps: List[Dict[str, str]]) -> str:
+        schemas = {tool["function"]["name"]: tool["function"]["parameters"]
+                   for tool in json.loads(prompt.rsplit("\nTools: ", 1)[1])}
+        results = dict(_OBSERVATION.findall(prompt))  # tool -> its latest result
+        pending = [step for step in steps if "validation error" in results.get(step["tool"], "validation error")]
+        if not pending:
+            return f"Kyaa~! Luna loves that question, Master! 🌸 ({question})"
+        calls = []
+        for step in pending:
+            argument = schemas[step["tool"]]["required"][0]
+            calls.append({"name": step["tool"], "args": {"input" if mistake() else argument: step["tool_input"]}})
+        return json.dumps({"tool_calls": calls})
+
+    def respond(prompt: str) -> str:
+        if prompt.startswith("You are Luna's creative writing tool"):
+            return "Petals drift like pink snow, Luna twirls beneath the boughs~ ✨"
+        if prompt.startswith("You are Luna's translation tool"):
+            return "Bonjour, mon ami !"
+        if prompt.startswith("You keep the running memory"):
+            return "Master chatted with Luna about octopuses, math and cherry blossom poems."
+        questions = _QUESTION.findall(prompt)
+        question = questions[-1] if questions else ""
+        steps = _plan_steps(plans.get(question, {}))
+        if "\nTools: " in prompt:
+            return respond_with_tools(prompt, question, steps)
+        scratchpad = prompt.split(f"Question: {question}")[-1]
+        done = scratchpad.count("\nObservation:") - len(_REACT_PARSE_ERROR.findall(scratchpad))
+        if done < len(steps):
+            step = steps[done]
+            if mistake():
+                return f"Thought: This is a job for {step['tool']}!\nAction: {step['tool']}\n{step['tool_input']}"
+            return (f"Thought: This is a job for {step['tool']}!\n"
+                    f"Action: {step['tool']}\nAction Input: {step['tool_input']}")
+        return f"Thought: I now know the final answer\nFinal Answer: Kyaa~! Luna loves that question, Master! 🌸 ({question})"
+
+    respond.stats = stats
+    return respond
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """count/mean/p50/p95/p99 in milliseconds (linear interpolation between ranks)."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(q: float) -> float:
+        position = (len(ordered) - 1) * q
+        low = int(position)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(1000 * sum(ordered) / len(ordered), 3),
+        "p50_ms": round(1000 * rank(0.50), 3),
+        "p95_ms": round(1000 * rank(0.95), 3),
+        "p99_ms": round(1000 * rank(0.99), 3),
+    }
+
+
+def run_benchmark(corpus: Optional[List[Dict[str, str]]] = None, turns: Optional[int] = None,
+                  llm_latency: float = 0.02, llm_failure_rate: float = 0.0,
+                  tts_latency: float = 0.05, tts_per_char_latency: float = 0.0,
+                  tts_failure_rate: float = 0.0, use_router: bool = False,
+                  tts_streaming: bool = False, use_memory: bool = False, seed: int = 0) -> Dict[str, Any]:
+    """Replay `turns` turns (cycling through the corpus) and return the JSON-ready report."""
+    from luna_agent import LunaAIMLEngine, create_conversation_memory, create_intent_router, create_luna_agent
+
+    corpus = corpus or list(DEFAULT_CORPUS)
+    turns = turns or len(corpus)
+    random.seed(seed)
+
+    fake_llm = FakeChatModel(scripted_responder(corpus), latency=llm_latency,
+                             failure_rate=llm_failure_rate, seed=seed)
+    chat_model = as_langchain_chat_model(fake_llm)
+    tts_client = FakeTTSClient(latency=tts_latency, per_char_latency=tts_per_char_latency,
+                               failure_rate=tts_failure_rate, seed=seed)
+    set_llm_provider(LLMProvider(factory=lambda model, temperature: chat_model))
+    set_response_cache(ResponseCache(db_path=None))
+    set_reminder_scheduler(ReminderScheduler(ReminderStore(":memory:")))
+    set_dispatcher(LLMDispatcher(requests_per_minute=0, tokens_per_minute=0))  # the fake LLM has no quota
+
+    timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    sources: Dict[str, int] = {}
+    errors: Dict[str, int] = {}
+    llm_calls: List[int] = []
+    agent_llm_calls: List[int] = []
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            store = AudioStore(directory)
+            if tts_streaming:
+                from luna_speech_stream import synthesize_audio_streamed as synthesize
+            else:
+                synthesize = synthesize_audio
+            aiml_engine = LunaAIMLEngine()
+            router = create_intent_router() if use_router else None
+            agent = create_luna_agent()
+            memory = create_conversation_memory() if use_memory else None
+
+            def timed(stage: str, func, *args):
+                start = time.perf_counter()
+                try:
+                    return func(*args)
+                finally:
+                    timings[stage].append(time.perf_counter() - start)
+
+            for index in range(turns):
+                user_input = corpus[index % len(corpus)]["input"]
+                calls_before = fake_llm.calls
+                turn_start = time.perf_counter()
+
+                text, source = timed("aiml", aiml_engine.process, user_input), "aiml"
+                if not text and router is not None:
+                    text, source = timed("router", router.route, user_input), "router"
+                if not text:
+                    source = "agent"
+                    try:
+                        inputs = {"input": user_input}
+                        if memory is not None:
+                            inputs["chat_history"] = memory.render()
+                        text = timed("agent", agent.invoke, inputs)["output"]
+                    except Exception:
+                        text, source = AGENT_ERROR_REPLY, "fallback"
+                        errors["agent"] = errors.get("agent", 0) + 1
+                    agent_llm_calls.append(fake_llm.calls - calls_before)
+
+                if memory is not None:
+                    memory.add_turn(user_input, text)
+                timed("emotion", infer_emotion_from_text, text)
+                try:
+                    timed("tts", synthesize, tts_client, text, store)
+                except Exception:
+                    errors["tts"] = errors.get("tts", 0) + 1
+
+                timings["total"].append(time.perf_counter() - turn_start)
+                sources[source] = sources.get(source, 0) + 1
+                llm_calls.append(fake_llm.calls - calls_before)
+            store_stats = store.stats()
+            if memory is not None:
+                memory.wait()
+    finally:
+        set_llm_provider(None)
+        set_response_cache(None)
+        set_reminder_scheduler(None)
+        set_dispatcher(None)
+
+    report = {
+        "config": {
+            "turns": turns, "corpus_size": len(corpus), "llm_latency": llm_latency,
+            "llm_failure_rate": llm_failure_rate, "tts_latency": tts_latency,
+            "tts_per_char_latency": tts_per_char_latency, "tts_failure_rate": tts_failure_rate,
+            "router": use_router, "tts_streaming": tts_streaming, "memory": use_memory, "seed": seed,
+        },
+        "stages": {stage: percentiles(samples) for stage, samples in timings.items() if samples},
+        "llm_round_trips": {
+            "total": sum(llm_calls),
+            "per_turn": round(sum(llm_calls) / turns, 3),
+            "per_agent_turn": round(sum(agent_llm_calls) / len(agent_llm_calls), 3) if agent_llm_calls else 0.0,
+            "max_per_turn": max(llm_calls, default=0),
+        },
+        "aiml_hit_rate": round(sources.get("aiml", 0) / turns, 4),
+        "sources": sources,
+        "errors": errors,
+        "tts": {"calls": tts_client.calls, "characters": tts_client.characters, "store": store_stats},
+    }
+    if router is not None:
+        report["router"] = router.stats()
+    if memory is not None:
+        report["memory"] = memory.stats()
+    return report
+
+
+# Runs in a fresh interpreter so module caches and already-imported packages don't hide cold-start cost.
+_STARTUP_SCRIPT = r"""
+import json, socket, sys, time
+connections = []
+_connect = socket.socket.connect
+def counting_connect(self, address):
+    connections.append(str(address))
+    return _connect(self, address)
+socket.socket.connect = counting_connect
+
+timings = {}
+start = time.perf_counter()
+import luna_agent
+timings["import_luna_agent"] = time.perf_counter() - start
+import_connections = len(connections)
+langchain_on_import = "langchain" in sys.modules
+
+start = time.perf_counter()
+luna_agent.get_aiml_engine().process("Hello Luna!")
+timings["first_aiml_response"] = time.perf_counter() - start
+
+import tempfile
+import luna_bench
+from luna_fakes import FakeChatModel, FakeTTSClient, as_langchain_chat_model
+from luna_llm import LLMProvider, set_llm_provider
+from luna_tts import AudioStore, synthesize_audio
+corpus = [{"input": "Tell me a fun fact about octopuses"}]
+chat_model = as_langchain_chat_model(FakeChatModel(luna_bench.scripted_responder(corpus)))
+set_llm_provider(LLMProvider(factory=lambda model, temperature: chat_model))
+start = time.perf_counter()
+output = luna_agent.create_luna_agent().invoke({"input": corpus[0]["input"]})["output"]
+timings["first_agent_response"] = time.perf_counter() - start
+
+with tempfile.TemporaryDirectory() as directory:
+    start = time.perf_counter()
+    synthesize_audio(FakeTTSClient(), output, AudioStore(directory))
+    timings["first_tts"] = time.perf_counter() - start
+
+print(json.dumps({"timings": timings, "import_connections": import_connections,
+                  "langchain_imported_by_import": langchain_on_import}))
+"""
+
+
+def run_startup_benchmark(runs: int = 3) -> Dict[str, Any]:
+    """Cold-start cost: import time, first AIML / agent / TTS response and connections opened on import."""
+    import os
+    import statistics
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+    samples = []
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, "-c", _STARTUP_SCRIPT], capture_output=True, text=True,
+                                   cwd=here, env=env, check=True)
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return {
+        "runs": runs,
+        "median_ms": {name: round(1000 * statistics.median(sample["timings"][name] for sample in samples), 1)
+                      for name in samples[0]["timings"]},
+        "import_connections": max(sample["import_connections"] for sample in samples),
+        "langchain_imported_by_import": any(sample["langchain_imported_by_import"] for sample in samples),
+    }
+
+
+def run_agent_mode_benchmark(corpus: Optional[List[Dict[str, Any]]] = None, turns: Optional[int] = None,
+                              mistake_rate: float = 0.1, seed: int = 0) -> Dict[str, Any]:
+    """
+    The same turns through create_luna_agent(mode="react") and mode="tools" on the scripted
+    fake model: agent LLM calls and prompt tokens per turn, and retries caused by malformed
+    tool calls (unparsable ReAct text, or arguments that fail the tool's schema).
+    """
+    from luna_agent import AGENT_MODES, create_luna_agent
+    from luna_callbacks import ToolUseRecorder
+    from luna_translate import estimate_tokens
+
+    corpus = corpus or list(AGENT_MODE_CORPUS)
+    turns = turns or len(corpus)
+    report: Dict[str, Any] = {"config": {"turns": turns, "mistake_rate": mistake_rate, "seed": seed}, "modes": {}}
+    set_response_cache(ResponseCache(db_path=None))
+    set_dispatcher(LLMDispatcher(requests_per_minute=0, tokens_per_minute=0))
+    try:
+        for mode in AGENT_MODES:
+            responder = scripted_responder(corpus, mistake_rate, seed)
+            fake_llm = FakeChatModel(responder)
+            chat_model = as_langchain_chat_model(fake_llm)
+            set_llm_provider(LLMProvider(factory=lambda model, temperature: chat_model))
+            agent = create_luna_agent(mode=mode)
+            failed = missing_tools = 0
+            start = time.perf_counter()
+            for index in range(turns):
+                turn = corpus[index % len(corpus)]
+                recorder = ToolUseRecorder()
+                output = agent.invoke({"input": turn["input"]}, config={"callbacks": [recorder]})["output"]
+                planned = sorted(step["tool"] for step in _plan_steps(turn))
+                # A turn only counts if every tool it needed really ran, not just if it answered.
+                ran_tools = sorted(recorder.completed) == planned
+                missing_tools += not ran_tools
+                failed += f"({turn['input']})" not in output or not ran_tools
+            elapsed = time.perf_counter() - start
+            # Only the agent's own calls; the tools' LLM calls are the same in both modes.
+            prompts = [prompt for prompt in fake_llm.prompts if _QUESTION.search(prompt)]
+            report["modes"][mode] = {
+                "llm_calls_per_turn": round(len(prompts) / turns, 2),
+                "prompt_tokens_per_turn": round(sum(estimate_tokens(prompt) for prompt in prompts) / turns),
+                "malformed_tool_calls": responder.stats["mistakes"],
+                "failed_turns": failed,
+                "turns_missing_tool_runs": missing_tools,
+                "ms_per_turn": round(1000 * elapsed / turns, 1),
+            }
+    finally:
+        set_llm_provider(None)
+        set_response_cache(None)
+        set_dispatcher(None)
+    return report
+
+
+def compare_to_baseline(report: Dict[str, Any], baseline: Dict[str, Any],
+                        tolerance: float = 0.2) -> List[str]:
+    """Stages whose p95 or LLM round trips grew by more than `tolerance` over the baseline."""
+    regressions = []
+    for stage, stats in report["stages"].items():
+        before = baseline.get("stages", {}).get(stage, {}).get("p95_ms")
+        if before and stats.get("p95_ms", 0) > before * (1 + tolerance):
+            regressions.append(f"{stage} p95 {before:.1f}ms -> {stats['p95_ms']:.1f}ms")
+    before = baseline.get("llm_round_trips", {}).get("per_turn")
+    after = report["llm_round_trips"]["per_turn"]
+    if before and after > before * (1 + tolerance):
+        regressions.append(f"LLM round trips per turn {before} -> {after}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark for Luna.")
+    parser.add_argument("--corpus", help="JSONL file of turns (default: built-in corpus)")
+    parser.add_argument("--turns", type=int, default=None, help="turns to replay, cycling the corpus")
+    parser.add_argument("--llm-latency", type=float, default=0.02)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--tts-latency", type=float, default=0.05)
+    parser.add_argument("--tts-per-char-latency", type=float, default=0.0)
+    parser.add_argument("--tts-failure-rate", type=float, default=0.0)
+    parser.add_argument("--router", action="store_true", help="try the intent router before the agent")
+    parser.add_argument("--tts-streaming", action="store_true", help="use sentence-streamed synthesis")
+    parser.add_argument("--memory", action="store_true", help="give the agent token-budgeted conversation memory")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup", action="store_true", help="measure cold start instead of replaying turns")
+    parser.add_argument("--agent-modes", action="store_true",
+                        help="compare the ReAct and tool-calling agent modes instead of replaying turns")
+    parser.add_argument("--mistake-rate", type=float, default=0.1,
+                        help="with --agent-modes: share of tool calls the fake model gets wrong")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--baseline", help="JSON report to compare p95s and round trips against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        print(json.dumps(run_startup_benchmark(), indent=2))
+        return 0
+    if args.agent_modes:
+        corpus = load_corpus(args.corpus) if args.corpus else None
+        print(json.dumps(run_agent_mode_benchmark(corpus, args.turns, args.mistake_rate, args.seed), indent=2))
+        return 0
+    report = run_benchmark(
+        load_corpus(args.corpus), turns=args.turns, llm_latency=args.llm_latency,
+        llm_failure_rate=args.llm_failure_rate, tts_latency=args.tts_latency,
+        tts_per_char_latency=args.tts_per_char_latency, tts_failure_rate=args.tts_failure_rate,
+        use_router=args.router, tts_streaming=args.tts_streaming, use_memory=args.memory, seed=args.seed,
+    )
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            report["regressions"] = compare_to_baseline(report, json.load(baseline_file), args.tolerance)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(output + "\n")
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
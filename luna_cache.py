@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Luna's exact-match cache for LLM-backed tool outputs.
+An in-memory LRU, optionally backed by SQLite on disk, keyed by normalized prompt,
+model and temperature. Repeat translations and poem themes come back in milliseconds
+and cost no Gemini quota.
+"""
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from luna_llm import DEFAULT_TEMPERATURE
+
+DEFAULT_CACHE_SIZE = int(os.getenv("LUNA_LLM_CACHE_SIZE", "1024"))
+DEFAULT_CACHE_TTL = float(os.getenv("LUNA_LLM_CACHE_TTL", str(24 * 3600)))
+DEFAULT_CACHE_DB = os.getenv("LUNA_LLM_CACHE_DB")  # unset = memory only
+
+
+class CachePolicy:
+    """Per-tool caching rules: on/off, and the highest temperature still worth caching."""
+
+    def __init__(self, enabled: bool = True, max_temperature: Optional[float] = None):
+        self.enabled = enabled
+        self.max_temperature = max_temperature
+
+    def allows(self, temperature: Optional[float]) -> bool:
+        if not self.enabled:
+            return False
+        if self.max_temperature is None or temperature is None:
+            return True
+        return temperature <= self.max_temperature
+
+
+# creative_writer runs at the default temperature, and its output at that temperature is
+# cached, so a repeated theme gets the same piece back; only a caller that raises the
+# temperature above the default gets fresh output every time.
+CACHE_POLICIES: Dict[str, CachePolicy] = {
+    "language_translator": CachePolicy(),
+    "creative_writer": CachePolicy(max_temperature=DEFAULT_TEMPERATURE),
+}
+for _tool_name in filter(None, os.getenv("LUNA_CACHE_SKIP_TOOLS", "").split(",")):
+    CACHE_POLICIES[_tool_name.strip()] = CachePolicy(enabled=False)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so cosmetic differences don't defeat the cache."""
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+def make_cache_key(prompt: str, model: str, temperature: Optional[float]) -> str:
+    raw = f"{model}\x00{temperature}\x00{normalize_prompt(prompt)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-level exact-match cache with TTL and size-based eviction.
+    Memory is an LRU of `max_entries`; the optional SQLite file keeps up to `max_disk_entries`
+    rows and evicts the least recently used ones.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_SIZE, ttl: Optional[float] = DEFAULT_CACHE_TTL,
+                 db_path: Optional[str] = None, max_disk_entries: int = 100_000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache(last_access)")
+            self._db.commit()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._memory[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and not self._expired(row[1], now):
+                    self._db.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+                if row:
+                    self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._db.commit()
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                overflow = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_disk_entries
+                if overflow > 0:
+                    self._db.execute(
+                        "DELETE FROM llm_cache WHERE key IN "
+                        "(SELECT key FROM llm_cache ORDER BY last_access LIMIT ?)", (overflow,)
+                    )
+                    self.evictions += overflow
+                self._db.commit()
+
+    def _remember(self, key: str, value: str, created_at: float):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "entries": len(self._memory),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Process-wide cache; SQLite-backed when LUNA_LLM_CACHE_DB is set."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(db_path=DEFAULT_CACHE_DB)
+    return _cache
+
+
+def set_response_cache(cache: Optional[ResponseCache]):
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+
+def cached_invoke(llm: Any, prompt: str, tool: Optional[str] = None,
+                  cache: Optional[ResponseCache] = None) -> str:
+    """
+    Invoke `llm` with `prompt` through the cache and return the response text.
+    The tool's CachePolicy decides whether this call may be cached at all.
+    """
+    model = getattr(llm, "model", None) or getattr(llm, "model_name", None) or type(llm).__name__
+    temperature = getattr(llm, "temperature", None)
+    policy = CACHE_POLICIES.get(tool or "", CachePolicy())
+
+    if not policy.allows(temperature):
+        response = llm.invoke(prompt)
+        return response.content if hasattr(response, 'content') else str(response)
+
+    cache = cache or get_response_cache()
+    key = make_cache_key(prompt, model, temperature)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    response = llm.invoke(prompt)
+    content = response.content if hasattr(response, 'content') else str(response)
+    cache.put(key, content)
+    return content
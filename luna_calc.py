@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Calc-kun's expression engine.
+Parses arithmetic with the ast module (no eval), compiles it to a small postfix program
+that is cached per expression, and evaluates it under explicit limits on exponent size,
+result magnitude and program length, so inputs like 9**9**9 fail fast instead of pinning
+a core. A batch mode evaluates many expressions at once, vectorized with NumPy when available.
+"""
+
+import re
+import ast
+import math
+import time
+import random
+import operator
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+_numpy = None
+
+
+def _load_numpy():
+    """NumPy for batch mode, imported on first use so the calculator itself starts fast."""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:  # NumPy is optional; batch mode falls back to the scalar evaluator
+            _numpy = False
+    return _numpy or None
+
+Number = Union[int, float]
+
+
+class CalcError(ValueError):
+    """The expression is invalid or would exceed Calc-kun's limits."""
+
+
+class CalcLimits:
+    """Bounds that keep every evaluation cheap."""
+
+    def __init__(self, max_length: int = 500, max_steps: int = 200, max_exponent: int = 1000,
+                 max_result_bits: int = 4096, max_float: float = 1e300):
+        self.max_length = max_length
+        self.max_steps = max_steps
+        self.max_exponent = max_exponent
+        self.max_result_bits = max_result_bits
+        self.max_float = max_float
+
+
+DEFAULT_LIMITS = CalcLimits()
+
+_BINARY_OPS = {
+    ast.Add: ("+", operator.add),
+    ast.Sub: ("-", operator.sub),
+    ast.Mult: ("*", operator.mul),
+    ast.Div: ("/", operator.truediv),
+    ast.FloorDiv: ("//", operator.floordiv),
+    ast.Mod: ("%", operator.mod),
+    ast.Pow: ("**", operator.pow),
+}
+_UNARY_OPS = {ast.UAdd: "pos", ast.USub: "neg"}
+_OP_FUNCS = {symbol: func for symbol, func in _BINARY_OPS.values()}
+
+# A compiled program is a tuple of postfix instructions: a number pushes a constant,
+# a string pops its operands and pushes the result.
+Program = Tuple[Union[Number, str], ...]
+
+
+def normalize_expression(expression: str) -> str:
+    """Accept ^ for powers and ignore surrounding whitespace, like the original tool did."""
+    return expression.replace('^', '**').strip()
+
+
+@lru_cache(maxsize=4096)
+def compile_expression(expression: str, max_length: int = DEFAULT_LIMITS.max_length,
+                       max_steps: int = DEFAULT_LIMITS.max_steps) -> Program:
+    """Parse and compile an (already normalized) expression into a postfix program."""
+    if len(expression) > max_length:
+        raise CalcError(f"Expression is longer than {max_length} characters")
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError:
+        raise CalcError("That doesn't look like a math expression") from None
+
+    program: List[Union[Number, str]] = []
+
+    def emit(node: ast.AST):
+        if len(program) > max_steps:
+            raise CalcError(f"Expression needs more than {max_steps} steps")
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            if isinstance(node.value, float) and not math.isfinite(node.value):
+                raise CalcError("Number is too large")
+            program.append(node.value)
+        elif isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+            emit(node.left)
+            emit(node.right)
+            program.append(_BINARY_OPS[type(node.op)][0])
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+            emit(node.operand)
+            program.append(_UNARY_OPS[type(node.op)])
+        else:
+            raise CalcError("Only numbers, + - * / // % ** and parentheses are allowed")
+
+    emit(tree.body)
+    if len(program) > max_steps:
+        raise CalcError(f"Expression needs more than {max_steps} steps")
+    return tuple(program)
+
+
+def _apply(symbol: str, left: Number, right: Number, limits: CalcLimits) -> Number:
+    if symbol == "**":
+        if isinstance(right, int) and abs(right) > limits.max_exponent:
+            raise CalcError(f"Exponent {right} is larger than {limits.max_exponent}")
+        if isinstance(left, int) and isinstance(right, int) and right > 0:
+            if max(left.bit_length(), 1) * right > limits.max_result_bits:
+                raise CalcError("Result would be too large")
+        if isinstance(right, float) and abs(right) > limits.max_exponent:
+            raise CalcError(f"Exponent {right} is larger than {limits.max_exponent}")
+    elif symbol == "*" and isinstance(left, int) and isinstance(right, int):
+        if left.bit_length() + right.bit_length() > limits.max_result_bits:
+            raise CalcError("Result would be too large")
+    try:
+        result = _OP_FUNCS[symbol](left, right)
+    except ZeroDivisionError:
+        raise CalcError("Division by zero") from None
+    except OverflowError:
+        raise CalcError("Result would be too large") from None
+    if isinstance(result, complex):
+        raise CalcError("Result is not a real number")
+    if isinstance(result, float) and (not math.isfinite(result) or abs(result) > limits.max_float):
+        raise CalcError("Result would be too large")
+    if isinstance(result, int) and result.bit_length() > limits.max_result_bits:
+        raise CalcError("Result would be too large")
+    return result
+
+
+def run_program(program: Program, limits: CalcLimits = DEFAULT_LIMITS) -> Number:
+    stack: List[Number] = []
+    for instruction in program:
+        if not isinstance(instruction, str):
+            stack.append(instruction)
+        elif instruction == "neg":
+            stack.append(-stack.pop())
+        elif instruction == "pos":
+            pass
+        else:
+            right = stack.pop()
+            stack.append(_apply(instruction, stack.pop(), right, limits))
+    return stack[0]
+
+
+def evaluate(expression: str, limits: CalcLimits = DEFAULT_LIMITS) -> Number:
+    """Safely evaluate an arithmetic expression, raising CalcError on bad or too-costly input."""
+    program = compile_expression(normalize_expression(expression), limits.max_length, limits.max_steps)
+    return run_program(program, limits)
+
+
+def _template(program: Program) -> Tuple[Tuple[str, ...], Tuple[Number, ...]]:
+    """Split a program into its operator shape and its constants."""
+    shape = tuple(i if isinstance(i, str) else "#" for i in program)
+    constants = tuple(i for i in program if not isinstance(i, str))
+    return shape, constants
+
+
+def _run_vectorized(shape: Tuple[str, ...], columns: "np.ndarray", limits: CalcLimits):
+    """Evaluate one operator shape over a (n_exprs, n_constants) array; returns values and a per-row ok mask."""
+    np = _load_numpy()
+    stack = []
+    column = 0
+    ok = np.ones(columns.shape[0], dtype=bool)
+    peak = np.zeros(columns.shape[0])
+    funcs = {"+": np.add, "-": np.subtract, "*": np.multiply, "/": np.divide,
+             "//": np.floor_divide, "%": np.mod, "**": np.power}
+    with np.errstate(all="ignore"):
+        for instruction in shape:
+            if instruction == "#":
+                stack.append(columns[:, column])
+                column += 1
+            elif instruction == "neg":
+                stack.append(-stack.pop())
+            elif instruction == "pos":
+                pass
+            else:
+                right = stack.pop()
+                left = stack.pop()
+                if instruction == "**":
+                    ok &= np.abs(right) <= limits.max_exponent
+                if instruction in ("/", "//", "%"):
+                    ok &= right != 0
+                value = funcs[instruction](left, right)
+                ok &= np.isfinite(value) & (np.abs(value) <= limits.max_float)
+                peak = np.maximum(peak, np.abs(value))
+                stack.append(value)
+    return stack[0], ok, peak
+
+
+# Numeric literals as they appear in source; the lookarounds reject forms like 1_000 or 0x10,
+# which then simply take the scalar path.
+_NUMBER = re.compile(r'(?<![\w.])(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?(?![\w.])')
+
+
+@lru_cache(maxsize=1024)
+def _skeleton_shape(skeleton: str, constant_count: int, max_length: int, max_steps: int) -> Optional[Tuple[str, ...]]:
+    """Operator shape of an expression whose numbers were all replaced by 1, or None if unusable."""
+    try:
+        shape, constants = _template(compile_expression(skeleton, max_length, max_steps))
+    except CalcError:
+        return None
+    return shape if len(constants) == constant_count else None
+
+
+def _parse_number(token: str) -> Optional[Number]:
+    if token.isdigit():
+        return int(token) if token == "0" or not token.startswith("0") else None
+    return float(token)
+
+
+def evaluate_batch(expressions: Sequence[str], limits: CalcLimits = DEFAULT_LIMITS,
+                   min_vector_size: int = 8) -> List[Union[Number, CalcError]]:
+    """
+    Evaluate many expressions. Results come back in input order; failures are CalcError objects.
+    Expressions sharing an operator shape (e.g. "a * b + c") are parsed once per shape and, with
+    NumPy, evaluated together as arrays. Rows that overflow, divide by zero, or need exact
+    integer results are redone by the scalar evaluator, so results match evaluate().
+    """
+    np = _load_numpy()
+    results: List[Union[Number, CalcError, None]] = [None] * len(expressions)
+    groups: Dict[Tuple[str, ...], List[Tuple[int, List[Number], bool]]] = {}
+    scalar: List[int] = []
+    for index, expression in enumerate(expressions):
+        normalized = normalize_expression(expression)
+        tokens = _NUMBER.findall(normalized)
+        shape = None
+        if np is not None and len(normalized) <= limits.max_length:
+            shape = _skeleton_shape(_NUMBER.sub("1", normalized), len(tokens), limits.max_length, limits.max_steps)
+        constants = [_parse_number(token) for token in tokens] if shape else []
+        if shape is None or "#" not in shape or None in constants:
+            scalar.append(index)
+        else:
+            all_ints = all(type(c) is int for c in constants)
+            groups.setdefault(shape, []).append((index, constants, all_ints))
+
+    for shape, members in groups.items():
+        if len(members) < min_vector_size:
+            scalar.extend(index for index, _, _ in members)
+            continue
+        values, ok, peak = _run_vectorized(shape, np.array([c for _, c, _ in members], dtype=float), limits)
+        integral = "/" not in shape and "**" not in shape
+        exact = peak < 2 ** 53
+        for row, (index, _, all_ints) in enumerate(members):
+            if not ok[row] or (all_ints and not (integral and exact[row])):
+                scalar.append(index)  # needs exact integer or error semantics
+            else:
+                value = values[row].item()
+                results[index] = int(value) if all_ints else value
+
+    for index in scalar:
+        try:
+            results[index] = evaluate(expressions[index], limits)
+        except CalcError as e:
+            results[index] = e
+    return results
+
+
+def _random_expression(rng: random.Random, depth: int = 0) -> str:
+    if depth > 4 or rng.random() < 0.3:
+        return str(rng.choice([rng.randint(0, 99), rng.randint(0, 10 ** 6), 9, 0, rng.random() * 100]))
+    op = rng.choice(["+", "-", "*", "/", "//", "%", "**", "^"])
+    return f"({_random_expression(rng, depth + 1)}{op}{_random_expression(rng, depth + 1)})"
+
+
+def run_benchmark(repeats: int = 20000):
+    """Compare eval() with the AST engine, fuzz it for runtime bounds, and time batch mode."""
+    expressions = ["12*7", "(3+4)*5/2", "2**10 - 1", "((1+2)*(3+4))/(5-6)", "100 // 7 % 3"]
+    start = time.perf_counter()
+    for i in range(repeats):
+        eval(expressions[i % len(expressions)].replace('^', '**'))
+    eval_us = (time.perf_counter() - start) / repeats * 1e6
+    start = time.perf_counter()
+    for i in range(repeats):
+        evaluate(expressions[i % len(expressions)])
+    ast_us = (time.perf_counter() - start) / repeats * 1e6
+    print(f"eval():            {eval_us:7.2f} us/expression")
+    print(f"AST engine cached: {ast_us:7.2f} us/expression")
+
+    rng = random.Random(7)
+    fuzz = [_random_expression(rng) for _ in range(5000)] + ["9**9**9", "9^9^9", "2**10**10", "(10**300)*(10**300)"]
+    worst, errors = 0.0, 0
+    for expression in fuzz:
+        start = time.perf_counter()
+        try:
+            evaluate(expression)
+        except CalcError:
+            errors += 1
+        worst = max(worst, time.perf_counter() - start)
+    print(f"fuzz: {len(fuzz)} expressions, {errors} rejected, worst case {worst * 1000:.2f} ms")
+
+    batch = [f"{rng.randint(1, 999)} * {rng.randint(1, 999)} + {rng.random():.3f}" for _ in range(100000)]
+    compile_expression.cache_clear()
+    start = time.perf_counter()
+    for expression in batch:
+        evaluate(expression)
+    scalar_time = time.perf_counter() - start
+    compile_expression.cache_clear()
+    start = time.perf_counter()
+    evaluate_batch(batch)
+    batch_time = time.perf_counter() - start
+    print(f"{len(batch):,} expressions: one by one {scalar_time * 1000:.0f} ms, "
+          f"batch {batch_time * 1000:.0f} ms ({'NumPy vectorized' if _load_numpy() is not None else 'scalar, NumPy not installed'})")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+LangChain callback handlers used by Luna's agent.
+Kept in their own module so importing luna_streaming and friends doesn't pull in LangChain.
+"""
+
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from luna_streaming import FINAL_ANSWER_MARKER, FinalAnswerStreamer
+from luna_trace import Tracer, count_tokens, get_tracer
+
+# AgentExecutor's tool names for unparsable model output and for a tool that doesn't exist
+_PSEUDO_TOOLS = {"_Exception", "invalid_tool"}
+# What a tool with handle_validation_error=True returns for arguments that fail its schema
+_VALIDATION_ERROR = "Tool input validation error"
+
+
+class FinalAnswerCallbackHandler(BaseCallbackHandler):
+    """
+    Forwards Final Answer tokens from the agent's streamed LLM calls to `on_text`.
+    When the model has tools bound (the "tools" agent mode) there is no marker to wait for:
+    any text it writes is the answer, and tool calls carry no text.
+    """
+
+    def __init__(self, on_text: Callable[[str], None]):
+        self.streamer = FinalAnswerStreamer(on_text=on_text)
+        self.streamed_text = ""
+        self._on_text = on_text
+        self.streamer.on_text = self._collect
+
+    def _collect(self, text: str):
+        self.streamed_text += text
+        self._on_text(text)
+
+    def on_llm_start(self, serialized: Any, prompts: Any, **kwargs: Any) -> None:
+        self.streamer.reset()
+
+    def on_chat_model_start(self, serialized: Any, messages: Any, **kwargs: Any) -> None:
+        tools_bound = bool((kwargs.get("invocation_params") or {}).get("tools"))
+        self.streamer.marker = "" if tools_bound else FINAL_ANSWER_MARKER
+        self.streamer.reset()
+
+    def on_llm_new_token(self, token: str, *, chunk: Optional[Any] = None, **kwargs: Any) -> None:
+        self.streamer.feed(token)
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Turns the agent's callbacks into luna_trace spans: "agent" per run, "agent.iteration" per
+    think/act step, and "llm" and "tool" spans with token and character counts beneath them.
+    LLM calls made inside a tool (Muse-sensei, Translate-kun) nest under that tool's span.
+    """
+
+    def __init__(self, tracer: Optional[Tracer] = None):
+        self.tracer = tracer or get_tracer()
+        self._parents: Dict[UUID, Optional[UUID]] = {}
+        self._spans: Dict[UUID, Any] = {}
+        self._iterations: Dict[UUID, List[Any]] = {}  # root run -> [count, open iteration span]
+
+    def _lineage(self, run_id: Optional[UUID]):
+        while run_id is not None:
+            yield run_id
+            run_id = self._parents.get(run_id)
+
+    def _start(self, name: str, run_id: UUID, parent_run_id: Optional[UUID], parent_span=None, **attributes):
+        self._parents[run_id] = parent_run_id
+        if parent_span is None:
+            parent_span = next((self._spans[r] for r in self._lineage(parent_run_id) if r in self._spans), None)
+        self._spans[run_id] = self.tracer.start_span(name, parent=parent_span, **attributes)
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None, **attributes):
+        self._parents.pop(run_id, None)
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.set(**attributes).end(error)
+
+    def _end_iteration(self, root: UUID):
+        state = self._iterations.get(root)
+        if state and state[1] is not None:
+            state[1].end()
+            state[1] = None
+
+    def on_chain_start(self, serialized: Any, inputs: Any, *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        if parent_run_id is None:
+            self._iterations[run_id] = [0, None]
+            self._start("agent", run_id, None)
+        else:
+            self._parents[run_id] = parent_run_id
+
+    def _chain_end(self, run_id: UUID, error: Optional[BaseException] = None):
+        if run_id in self._iterations:
+            self._end_iteration(run_id)
+            self._end(run_id, error, iterations=self._iterations.pop(run_id)[0])
+        else:
+            self._parents.pop(run_id, None)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._chain_end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._chain_end(run_id, error)
+
+    def _llm_start(self, prompt_text: str, run_id: UUID, parent_run_id: Optional[UUID]):
+        lineage = list(self._lineage(parent_run_id))
+        inside_tool = any(self._spans.get(r) is not None and r not in self._iterations for r in lineage)
+        root = lineage[-1] if lineage and lineage[-1] in self._iterations else None
+        parent_span = None
+        if root is not None and not inside_tool:
+            state = self._iterations[root]
+            self._end_iteration(root)
+            state[0] += 1
+            state[1] = self.tracer.start_span("agent.iteration", parent=self._spans[root], iteration=state[0])
+            parent_span = state[1]
+        self._start("llm", run_id, parent_run_id, parent_span, input_tokens=count_tokens(prompt_text))
+
+    def on_llm_start(self, serialized: Any, prompts: List[str], *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._llm_start("\n".join(prompts), run_id, parent_run_id)
+
+    def on_chat_model_start(self, serialized: Any, messages: List[List[Any]], *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._llm_start("\n".join(str(message.content) for batch in messages for message in batch),
+                        run_id, parent_run_id)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        attributes = {"output_tokens": 0}
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    # Provider-reported counts replace the word-count estimate.
+                    attributes["input_tokens"] = usage.get("input_tokens", 0)
+                    attributes["output_tokens"] += usage.get("output_tokens", 0)
+                else:
+                    attributes["output_tokens"] += count_tokens(generation.text)
+        self._end(run_id, **attributes)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized: Any, input_str: str, *, run_id: UUID,
+                      parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        lineage = list(self._lineage(parent_run_id))
+        state = self._iterations.get(lineage[-1]) if lineage else None
+        self._start("tool", run_id, parent_run_id, state[1] if state else None,
+                    tool=(serialized or {}).get("name", "?"), characters=len(input_str or ""))
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, output_characters=len(str(output)))
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+
+class ToolUseRecorder(BaseCallbackHandler):
+    """
+    Records the names of the tools an agent run called, in order; `completed` only those that
+    actually ran and returned, i.e. not AgentExecutor's stand-ins for unparsable output or an
+    unknown tool, nor calls whose arguments failed the tool's schema.
+    """
+
+    def __init__(self):
+        self.tools: List[str] = []
+        self.completed: List[str] = []
+        self._running: Dict[Any, str] = {}
+
+    def on_tool_start(self, serialized: Any, input_str: str, **kwargs: Any) -> None:
+        name = (serialized or {}).get("name", "?")
+        self.tools.append(name)
+        self._running[kwargs.get("run_id")] = name
+
+    def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        name = self._running.pop(kwargs.get("run_id"), None)
+        if name and name not in _PSEUDO_TOOLS and str(getattr(output, "content", output)) != _VALIDATION_ERROR:
+            self.completed.append(name)
+
+    def on_tool_error(self, error: BaseException, **kwargs: Any) -> None:
+        self._running.pop(kwargs.get("run_id"), None)
@@ -0,0 +1,571 @@
+#!/usr/bin/env python3
+"""
+Luna's LLM dispatch layer.
+Every Gemini call from the agent and the tools goes through one LLMDispatcher: a bounded pool
+of worker threads takes calls from a priority queue (interactive turns before background
+summaries), token buckets keep requests and tokens per minute under the quota, and identical
+calls already in flight are computed once and shared (single flight).
+"""
+
+import os
+import time
+import heapq
+import queue
+import asyncio
+import itertools
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from luna_resilience import DeadlineExceeded, QueueTimeout, current_deadline, get_policy
+from luna_trace import get_tracer
+from luna_translate import estimate_tokens
+
+# Gemini free-tier quota by default; 0 means unlimited.
+DEFAULT_REQUESTS_PER_MINUTE = float(os.getenv("LUNA_LLM_RPM", "15"))
+DEFAULT_TOKENS_PER_MINUTE = float(os.getenv("LUNA_LLM_TPM", "1000000"))
+DEFAULT_WORKERS = int(os.getenv("LUNA_LLM_WORKERS", "4"))
+DEFAULT_OUTPUT_TOKENS = 512  # reserved for the answer until the real count is known
+BURST_FRACTION = 0.2  # of the per-minute limit that may go out at once
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket that never lets more than `limit` units through in any window of `period`
+    seconds: it holds at most `burst` units and refills at (limit - burst) / period.
+    A single request larger than the bucket goes through once the bucket is full and leaves
+    it in debt. limit=0 means unlimited.
+    """
+
+    def __init__(self, limit: float, period: float = 60.0, burst: Optional[float] = None):
+        self.limit = limit
+        self.period = period
+        self.capacity = burst if burst is not None else limit * BURST_FRACTION
+        if limit and not 0 < self.capacity < limit:
+            raise ValueError("burst must be between 0 and the limit")
+        self.rate = (limit - self.capacity) / period if limit else 0.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: Optional[float] = None) -> float:
+        """Seconds until `amount` units can be taken (0 if now)."""
+        if not self.limit:
+            return 0.0
+        self._refill(time.monotonic() if now is None else now)
+        needed = min(amount, self.capacity) - self.level
+        return needed / self.rate if needed > 0 else 0.0
+
+    def take(self, amount: float):
+        if self.limit:
+            self._refill(time.monotonic())
+            self.level -= amount
+
+    def adjust(self, delta: float):
+        """Give back (delta > 0) or charge (delta < 0) units once a call's real cost is known."""
+        if self.limit:
+            self.level = min(self.capacity, self.level + delta)
+
+
+class RateLimiter:
+    """Request and token buckets checked together. Not thread-safe; the dispatcher locks around it."""
+
+    def __init__(self, requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE, period: float = 60.0):
+        self.requests = TokenBucket(requests_per_minute, period)
+        self.tokens = TokenBucket(tokens_per_minute, period)
+
+    def wait_time(self, tokens: float) -> float:
+        now = time.monotonic()
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def take(self, tokens: float):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    def settle(self, reserved: float, actual: float):
+        self.tokens.adjust(reserved - actual)
+
+
+def _prompt_text(prompt: Any) -> str:
+    if isinstance(prompt, str):
+        return prompt
+    if isinstance(prompt, (list, tuple)):
+        return "\n".join(f"{getattr(m, 'type', '')}:{getattr(m, 'content', m)}" for m in prompt)
+    return str(prompt)
+
+
+def _content(response: Any) -> str:
+    content = response.content if hasattr(response, "content") else response
+    return content if isinstance(content, str) else str(content)
+
+
+def _used_tokens(prompt_text: str, response: Any, output_text: str) -> int:
+    usage = getattr(response, "usage_metadata", None)
+    if usage and usage.get("total_tokens"):
+        return usage["total_tokens"]
+    return estimate_tokens(prompt_text) + estimate_tokens(output_text)
+
+
+class _Job:
+    __slots__ = ("key", "llm", "prompt", "prompt_text", "kwargs", "priority", "cost", "future",
+                 "chunks", "enqueued", "started", "throttled")
+
+    def __init__(self, key, llm, prompt, kwargs, priority: int, cost: int, chunks: Optional[queue.Queue]):
+        self.key = key
+        self.llm = llm
+        self.prompt = prompt
+        self.prompt_text = _prompt_text(prompt)
+        self.kwargs = kwargs
+        self.priority = priority
+        self.cost = cost
+        self.future: Future = Future()
+        self.chunks = chunks  # set for streaming calls
+        self.enqueued = time.monotonic()
+        self.started = False
+        self.throttled = False
+
+
+class LLMDispatcher:
+    """
+    Runs LLM calls on `workers` threads, lowest priority number first, within the rate limits.
+
+    A call is charged one request and its estimated prompt tokens plus `output_tokens` up
+    front; the estimate is corrected with the provider's usage (or a count of the answer)
+    when the call finishes. Identical non-streaming calls (same client, prompt and options)
+    submitted while one is queued or running share its result. Streaming calls are never
+    shared, since each caller forwards its own tokens.
+    """
+
+    def __init__(self, requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE, workers: int = DEFAULT_WORKERS,
+                 period: float = 60.0, output_tokens: int = DEFAULT_OUTPUT_TOKENS):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute, period)
+        self.workers = workers
+        self.output_tokens = output_tokens
+        self._heap: List[Tuple[int, int, _Job]] = []
+        self._sequence = itertools.count()
+        self._inflight: Dict[Any, _Job] = {}
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._closed = False
+        self.submitted = 0
+        self.coalesced = 0
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self.max_queue = 0
+        self._waits: Dict[int, List[float]] = {}  # priority -> [count, total seconds queued]
+
+    def _start_workers(self):
+        # Called with the lock held.
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"luna-llm-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _enqueue(self, job: _Job):
+        # Called with the lock held.
+        heapq.heappush(self._heap, (job.priority, next(self._sequence), job))
+        self.max_queue = max(self.max_queue, len(self._heap))
+        self._start_workers()
+        self._cond.notify()
+
+    def submit(self, llm: Any, prompt: Any, priority: int = PRIORITY_INTERACTIVE, share: bool = True,
+               **kwargs) -> Future:
+        """
+        Queue `llm.invoke(prompt, **kwargs)`; the Future resolves to its response. With
+        share=False the call is neither merged into an identical one nor joined by later ones
+        (retries and hedges). Cancelling the Future before a worker picks the call up drops it.
+        """
+        key = (id(llm), _prompt_text(prompt), repr(sorted(kwargs.items()))) if share else None
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("dispatcher is closed")
+            self.submitted += 1
+            job = self._inflight.get(key) if share else None
+            if job is not None:
+                self.coalesced += 1
+                if priority < job.priority and not job.started:
+                    # A more urgent caller joined: queue the job again at its priority.
+                    job.priority = priority
+                    heapq.heappush(self._heap, (priority, next(self._sequence), job))
+                    self._cond.notify()
+                return job.future
+            job = _Job(key, llm, prompt, kwargs, priority, self._estimate(prompt), None)
+            if share:
+                self._inflight[key] = job
+            self._enqueue(job)
+            return job.future
+
+    def invoke(self, llm: Any, prompt: Any, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> Any:
+        """
+        Blocking submit(): the response of `llm.invoke(prompt, **kwargs)`, with the "llm"
+        resilience policy's timeouts, retries, hedging and circuit breaker (luna_resilience).
+        """
+        with get_tracer().span("llm.dispatch", priority=priority) as span:
+            start = time.perf_counter()
+            response = get_policy("llm").run(lambda shared: self.submit(llm, prompt, priority, shared, **kwargs))
+            span.set(wait_ms=round(1000 * (time.perf_counter() - start), 1))
+            return response
+
+    def stream(self, llm: Any, prompt: Any, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> Iterator[Any]:
+        """
+        Chunks of `llm.stream(prompt, **kwargs)`, produced on a worker once the call is admitted.
+        A stream that fails before its first chunk is retried under the "llm" policy; one that
+        fails later is not (its tokens may already be shown). Streams respect the turn's deadline
+        and the "llm" circuit breaker.
+        """
+        policy = get_policy("llm")
+        policy.admit()
+        deadline = current_deadline()
+        for attempt in range(policy.attempts):
+            chunks: queue.Queue = queue.Queue()
+            job = _Job(None, llm, prompt, kwargs, priority, self._estimate(prompt), chunks)
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("dispatcher is closed")
+                self.submitted += 1
+                self._enqueue(job)
+            streamed = False
+            while True:
+                try:
+                    kind, value = chunks.get(timeout=deadline.remaining() if deadline is not None else None)
+                except queue.Empty:
+                    job.future.cancel()
+                    if not job.started:
+                        raise QueueTimeout("the LLM stream was still queued at the turn deadline") from None
+                    policy.breaker.record_failure()
+                    raise DeadlineExceeded("the LLM stream ran past the turn deadline") from None
+                if kind == "chunk":
+                    streamed = True
+                    yield value
+                elif kind == "error":
+                    policy.breaker.record_failure()
+                    delay = policy.backoff(attempt)
+                    if (streamed or attempt == policy.attempts - 1 or not policy.retryable(value)
+                            or (deadline is not None and deadline.remaining() <= delay)):
+                        raise value
+                    logger.info("LLM stream failed before its first chunk (%s); retrying in %.2fs", value, delay)
+                    time.sleep(delay)
+                    policy.admit()
+                    break
+                else:
+                    policy.breaker.record_success()
+                    return
+
+    def _estimate(self, prompt: Any) -> int:
+        return estimate_tokens(_prompt_text(prompt)) + self.output_tokens
+
+    def _next_job(self) -> Optional[_Job]:
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None
+                while self._heap and (self._heap[0][2].started or self._heap[0][2].future.cancelled()):
+                    # Re-queued at a higher priority, or given up by its caller
+                    stale = heapq.heappop(self._heap)[2]
+                    if not stale.started:
+                        self._finish(stale)  # so an identical call doesn't join the cancelled Future
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                job = self._heap[0][2]
+                wait = self.limiter.wait_time(job.cost)
+                if wait > 0:
+                    # Sleep, but wake for a more urgent job or a refund from a finished call.
+                    job.throttled = True
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+                job.started = True
+                job.future.started_at = time.monotonic()  # the resilience timeout runs from here
+                if not job.future.set_running_or_notify_cancel():
+                    # Cancelled since the check above (cancel() doesn't take our lock); it is
+                    # dropped before its cost is taken, so there is nothing to refund.
+                    self._finish(job)
+                    continue
+                self.limiter.take(job.cost)
+                self.calls += 1
+                self.throttled += job.throttled
+                waits = self._waits.setdefault(job.priority, [0, 0.0])
+                waits[0] += 1
+                waits[1] += time.monotonic() - job.enqueued
+                return job
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            output_text = ""
+            response = None
+            try:
+                if job.chunks is not None:
+                    pieces = []
+                    for chunk in job.llm.stream(job.prompt, **job.kwargs):
+                        pieces.append(_content(chunk))
+                        job.chunks.put(("chunk", chunk))
+                        response = chunk
+                    output_text = "".join(pieces)
+                    job.chunks.put(("done", None))
+                else:
+                    response = job.llm.invoke(job.prompt, **job.kwargs)
+                    output_text = _content(response)
+                    self._finish(job)
+                    job.future.set_result(response)
+            except BaseException as e:
+                with self._cond:
+                    self.errors += 1
+                if job.chunks is not None:
+                    job.chunks.put(("error", e))
+                else:
+                    self._finish(job)
+                    job.future.set_exception(e)
+            with self._cond:
+                self.limiter.settle(job.cost, _used_tokens(job.prompt_text, response, output_text))
+                self._cond.notify_all()
+
+    def _finish(self, job: _Job):
+        # Later identical calls start afresh (repeats are luna_cache's job, not ours).
+        with self._cond:
+            if self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "submitted": self.submitted,
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "throttled": self.throttled,
+                "errors": self.errors,
+                "queued": len(self._heap),
+                "max_queue": self.max_queue,
+                "mean_wait_ms": {priority: round(1000 * total / count, 1)
+                                 for priority, (count, total) in sorted(self._waits.items())},
+            }
+
+    def close(self):
+        """Stop the workers once their current calls finish; queued calls fail."""
+        with self._cond:
+            self._closed = True
+            pending = [job for _, _, job in self._heap if not job.started]
+            self._heap.clear()
+            self._cond.notify_all()
+        for job in dict.fromkeys(pending):
+            error = RuntimeError("dispatcher closed")
+            if job.chunks is not None:
+                job.chunks.put(("error", error))
+            elif not job.future.done():
+                job.future.set_exception(error)
+
+
+class DispatchedLLM:
+    """
+    A chat client whose invoke/ainvoke/stream go through a dispatcher at a fixed priority.
+    Other attributes (model, temperature, ...) are the client's own, so cache keys don't change.
+    """
+
+    def __init__(self, llm: Any, dispatcher: Optional[LLMDispatcher] = None, priority: int = PRIORITY_INTERACTIVE):
+        self.llm = llm
+        self.dispatcher = dispatcher
+        self.priority = priority
+
+    def __getattr__(self, name: str):
+        return getattr(self.__dict__["llm"], name)
+
+    def _dispatcher(self) -> LLMDispatcher:
+        return self.dispatcher or get_dispatcher()
+
+    def invoke(self, prompt: Any, **kwargs) -> Any:
+        return self._dispatcher().invoke(self.llm, prompt, self.priority, **kwargs)
+
+    async def ainvoke(self, prompt: Any, **kwargs) -> Any:
+        return await asyncio.to_thread(self.invoke, prompt, **kwargs)
+
+    def stream(self, prompt: Any, **kwargs) -> Iterator[Any]:
+        return self._dispatcher().stream(self.llm, prompt, self.priority, **kwargs)
+
+    def as_chat_model(self):
+        """This client as a LangChain chat model, for create_react_agent()."""
+        return as_dispatched_chat_model(self.llm, self.dispatcher, self.priority)
+
+
+_chat_model_class = None
+
+
+def as_dispatched_chat_model(llm: Any, dispatcher: Optional[LLMDispatcher] = None,
+                             priority: int = PRIORITY_INTERACTIVE):
+    """
+    Wrap a LangChain chat model so that its generate and stream calls go through a dispatcher.
+    Callbacks (streaming, tracing) still see every token, from the caller's thread.
+    """
+    global _chat_model_class
+    if _chat_model_class is None:
+        from langchain_core.language_models.chat_models import BaseChatModel
+        from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+        class DispatchedChatModel(BaseChatModel):
+            client: Any
+            dispatcher: Any = None
+            priority: int = PRIORITY_INTERACTIVE
+
+            @property
+            def _llm_type(self) -> str:
+                return "luna-dispatched"
+
+            @property
+            def model(self) -> Any:
+                return getattr(self.client, "model", None)
+
+            @property
+            def temperature(self) -> Any:
+                return getattr(self.client, "temperature", None)
+
+            def _dispatch(self) -> LLMDispatcher:
+                return self.dispatcher or get_dispatcher()
+
+            def bind_tools(self, tools, **kwargs):
+                # The client formats the tool schemas its own way; its calls still go through us.
+                return self.bind(**self.client.bind_tools(tools, **kwargs).kwargs)
+
+            def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+                message = self._dispatch().invoke(self.client, messages, self.priority, stop=stop, **kwargs)
+                return ChatResult(generations=[ChatGeneration(message=message)])
+
+            def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+                for message in self._dispatch().stream(self.client, messages, self.priority, stop=stop, **kwargs):
+                    chunk = ChatGenerationChunk(message=message)
+                    if run_manager:
+                        run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                    yield chunk
+
+        _chat_model_class = DispatchedChatModel
+    return _chat_model_class(client=llm, dispatcher=dispatcher, priority=priority)
+
+
+_dispatcher: Optional[LLMDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> LLMDispatcher:
+    """Process-wide dispatcher with the LUNA_LLM_RPM / LUNA_LLM_TPM / LUNA_LLM_WORKERS limits."""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = LLMDispatcher()
+    return _dispatcher
+
+
+def set_dispatcher(dispatcher: Optional[LLMDispatcher]):
+    """Install a dispatcher (e.g. an unlimited one for benchmarks); None resets to the default."""
+    global _dispatcher
+    with _dispatcher_lock:
+        previous, _dispatcher = _dispatcher, dispatcher
+    if previous is not None and previous is not dispatcher:
+        previous.close()
+
+
+def _window_peaks(events: List[Tuple[float, int]], period: float) -> Tuple[int, int]:
+    """Most requests and most tokens seen in any `period`-second window of (time, tokens) events."""
+    events = sorted(events)
+    peak_requests = peak_tokens = tokens = 0
+    low = 0
+    for high, (at, cost) in enumerate(events):
+        tokens += cost
+        while events[low][0] <= at - period:
+            tokens -= events[low][1]
+            low += 1
+        peak_requests = max(peak_requests, high - low + 1)
+        peak_tokens = max(peak_tokens, tokens)
+    return peak_requests, peak_tokens
+
+
+def run_benchmark(sessions: int = 40, turns: int = 4, background: int = 40, requests_per_period: int = 60,
+                  tokens_per_period: int = 30000, period: float = 1.0, latency: float = 0.05, workers: int = 8):
+    """
+    Load test on a fake LLM: `sessions` concurrent users send `turns` prompts each, many of them
+    the same (popular questions, shared translations), while `background` summaries queue up.
+    Compares calling the model directly from every thread with going through an LLMDispatcher
+    whose quota is scaled down to `requests_per_period` / `tokens_per_period` per `period` seconds.
+    """
+    import random
+    from luna_fakes import FakeChatModel
+
+    rng = random.Random(5)
+    popular = [f"Translate 'good morning, Master' into language {n}" for n in range(12)]
+    workload = [(PRIORITY_INTERACTIVE, rng.choice(popular) if rng.random() < 0.6 else
+                 f"Session {s} turn {t}: tell Luna about your day " + "and more " * rng.randint(0, 60))
+                for t in range(turns) for s in range(sessions)]
+    workload += [(PRIORITY_BACKGROUND, f"Summarize conversation {n}: " + "turn text " * 300)
+                 for n in range(background)]
+    answer = "Kyaa~! " + "Luna answers happily! " * 20
+
+    def run(dispatched: bool):
+        events: List[Tuple[float, int]] = []
+        lock = threading.Lock()
+
+        def respond(prompt: str) -> str:
+            with lock:
+                events.append((time.monotonic(), estimate_tokens(prompt) + estimate_tokens(answer)))
+            time.sleep(latency)
+            return answer
+
+        llm = FakeChatModel(respond)
+        dispatcher = LLMDispatcher(requests_per_period, tokens_per_period, workers, period=period,
+                                   output_tokens=estimate_tokens(answer)) if dispatched else None
+        finished: Dict[int, List[float]] = {PRIORITY_INTERACTIVE: [], PRIORITY_BACKGROUND: []}
+
+        def one(item):
+            priority, prompt = item
+            start = time.monotonic()
+            if dispatcher is not None:
+                dispatcher.invoke(llm, prompt, priority)
+            else:
+                llm.invoke(prompt)
+            with lock:
+                finished[priority].append(time.monotonic() - start)
+
+        # Background work is queued first, so interactive turns must overtake it.
+        order = [item for item in workload if item[0] == PRIORITY_BACKGROUND] + \
+                [item for item in workload if item[0] == PRIORITY_INTERACTIVE]
+        start = time.monotonic()
+        threads = [threading.Thread(target=one, args=(item,)) for item in order]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        peak_requests, peak_tokens = _window_peaks(events, period)
+        over = sum(1 for index, (at, _) in enumerate(sorted(events))
+                   if sum(1 for other, _ in events if at - period < other <= at) > requests_per_period)
+        stats = dispatcher.stats() if dispatcher else {}
+        if dispatcher is not None:
+            dispatcher.close()
+        label = f"dispatched ({workers} workers)" if dispatched else "direct from every thread"
+        mean = {p: 1000 * sum(v) / len(v) for p, v in finished.items()}
+        print(f"{label:<26}: {llm.calls:>3} LLM calls for {len(workload)} requests "
+              f"({llm.calls - len(set(llm.prompts))} duplicates), peak {peak_requests}/{requests_per_period} requests and "
+              f"{peak_tokens}/{tokens_per_period} tokens per {period:g}s window, {over} calls over quota; "
+              f"mean latency interactive {mean[PRIORITY_INTERACTIVE]:.0f} ms, "
+              f"background {mean[PRIORITY_BACKGROUND]:.0f} ms; {elapsed:.1f} s total")
+
+    run(dispatched=False)
+    run(dispatched=True)
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Luna's emotion inference.
+Maps the text of a reply to one of the avatar emotions, shared by the Streamlit app,
+the async pipeline and the HTTP service. Every keyword category is scored; the highest
+weighted score wins, and ties go to the category listed first in EMOTION_KEYWORDS.
+"""
+
+import time
+import random
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from luna_trace import get_tracer
+
+# Keyword categories, in tie-break order
+EMOTION_KEYWORDS = [
+    ("happy", ["kyaa~!", "yay!", "excited!", "amazing!", "happy", "love", "✨", "🌸", "💖", "🌟"]),
+    ("mischievous", ["hehe!", "mischievous", "teasing"]),
+    ("curious", ["ooh!", "curious", "mystery"]),
+    ("sad", ["aww...", "waaah!", "miss", "sorry"]),
+    ("confused", ["eeeek!", "confused", "problem", "oops"]),
+]
+
+# Interjections say more about Luna's mood than a word in passing; every other keyword counts 1.0
+KEYWORD_WEIGHTS = {
+    "kyaa~!": 2.0, "yay!": 2.0, "hehe!": 2.0, "ooh!": 2.0, "aww...": 2.0, "waaah!": 2.0, "eeeek!": 2.0,
+}
+
+
+class EmotionScorer:
+    """
+    Weighted keyword scorer. Each keyword found in the lowercased reply adds its weight to
+    its category once. All keywords are tested by one filter() over str.__contains__, which
+    runs in C and beats a regex alternation for a list this short.
+    """
+
+    def __init__(self, categories: Sequence[Tuple[str, Sequence[str]]] = EMOTION_KEYWORDS,
+                 weights: Optional[Dict[str, float]] = None, default_weight: float = 1.0):
+        weights = KEYWORD_WEIGHTS if weights is None else weights
+        self.categories = [category for category, _ in categories]
+        self._rank = {category: index for index, (category, _) in enumerate(categories)}
+        self._keyword_score: Dict[str, Tuple[str, float]] = {}
+        for category, keywords in categories:
+            for keyword in keywords:
+                keyword = keyword.lower()
+                # A keyword listed under two categories belongs to the first, as before
+                self._keyword_score.setdefault(keyword, (category, weights.get(keyword, default_weight)))
+        self.longest_keyword = max(map(len, self._keyword_score), default=0)
+
+    def score(self, text: str) -> Dict[str, float]:
+        """Weighted score per category with at least one keyword hit."""
+        return self.add_scores({}, text.lower()) if text else {}
+
+    def add_scores(self, scores: Dict[str, float], text_lower: str,
+                   seen: Optional[Set[str]] = None) -> Dict[str, float]:
+        """
+        Add (in place) the weight of every keyword in already-lowercased text. With `seen`,
+        keywords already in it are skipped and new ones are added, so text fed in pieces
+        scores the same as the whole.
+        """
+        keyword_score = self._keyword_score
+        found = filter(text_lower.__contains__, keyword_score)
+        if seen is not None:
+            found = [keyword for keyword in found if keyword not in seen]
+            seen.update(found)
+        for keyword in found:
+            category, weight = keyword_score[keyword]
+            scores[category] = scores.get(category, 0.0) + weight
+        return scores
+
+    def best(self, scores: Dict[str, float]) -> Optional[str]:
+        """Highest-scoring category (ties go to the one listed first), or None without a hit."""
+        if len(scores) < 2:
+            return next(iter(scores), None)
+        rank = self._rank
+        return min(scores, key=lambda category: (-scores[category], rank[category]))
+
+    def classify(self, text: str) -> Optional[str]:
+        """Best-scoring category, or None when no keyword matches."""
+        return self.best(self.add_scores({}, text.lower())) if text else None
+
+    def classify_batch(self, texts: Iterable[str]) -> List[Optional[str]]:
+        return [self.classify(text) for text in texts]
+
+
+_default_scorer = EmotionScorer()
+
+
+def get_emotion_scorer() -> EmotionScorer:
+    """The scorer infer_emotion_from_text uses, for callers that score text incrementally."""
+    return _default_scorer
+
+
+def resolve_emotion(category: Optional[str]) -> str:
+    if category == "happy": return random.choice(["happy", "excited", "energetic"])
+    return category or "speaking"
+
+
+def infer_emotion_from_text(text: str) -> str:
+    with get_tracer().span("emotion", characters=len(text)):
+        return resolve_emotion(_default_scorer.classify(text))
+
+
+def infer_emotions(texts: Sequence[str]) -> List[str]:
+    """infer_emotion_from_text for many texts (history replays, benchmarks) under one span."""
+    with get_tracer().span("emotion.batch", characters=sum(len(text) for text in texts), texts=len(texts)):
+        return [resolve_emotion(category) for category in _default_scorer.classify_batch(texts)]
+
+
+def run_benchmark(iterations: int = 20_000):
+    """Per-reply cost of the old first-hit category scan against the single-pass weighted scorer."""
+    replies = [
+        "Kyaa~! Hello there, Master! ✨ I'm all ready to go! Let's chat! 🌟",
+        "Hehe! Luna knows a little mystery about octopuses~ they have three hearts! Ooh!",
+        "Aww... I'm sorry, Master, Luna couldn't find that one. Waaah!",
+        "The answer is 42. Here's how Luna worked it out step by step, nice and tidy for you.",
+    ]
+    def first_hit(text: str) -> Optional[str]:
+        text_lower = text.lower()
+        for category, keywords in EMOTION_KEYWORDS:
+            if any(k in text_lower for k in keywords): return category
+        return None
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for reply in replies:
+            first_hit(reply)
+    scan_us = 1e6 * (time.perf_counter() - start) / (iterations * len(replies))
+    start = time.perf_counter()
+    for _ in range(iterations):
+        _default_scorer.classify_batch(replies)
+    scorer_us = 1e6 * (time.perf_counter() - start) / (iterations * len(replies))
+    print(f"first-hit scan : {scan_us:6.2f} us/reply")
+    print(f"weighted scorer: {scorer_us:6.2f} us/reply (all categories scored)")
+    for reply in replies:
+        print(f"  {first_hit(reply) or '-':>11} -> {_default_scorer.classify(reply) or '-':<11} "
+              f"{_default_scorer.score(reply)}")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for Gemini and ElevenLabs.
+Lets Luna's pipeline be exercised and benchmarked offline, without API keys or quota.
+"""
+
+import time
+import random
+import asyncio
+import threading
+from typing import Any, Callable, Iterator, List, Optional, Union
+
+
+class FakeMessage:
+    """Minimal AIMessage look-alike: only `.content` is used by Luna's tools."""
+
+    def __init__(self, content: str):
+        self.content = content
+
+    def __repr__(self):
+        return f"FakeMessage({self.content!r})"
+
+
+class FakeChatModel:
+    """
+    Scriptable fake chat model with the invoke/ainvoke/stream surface Luna uses.
+
+    `responses` is either a list (served round-robin) or a callable taking the prompt.
+    `latency` is seconds per call, `failure_rate` the probability a call raises, and
+    `stall_rate` the probability a call hangs for `stall_latency` extra seconds.
+    """
+
+    def __init__(self, responses: Union[List[str], Callable[[str], str], None] = None,
+                 latency: float = 0.0, failure_rate: float = 0.0,
+                 model: str = "fake-gemini", temperature: float = 0.7, seed: Optional[int] = None,
+                 stall_rate: float = 0.0, stall_latency: float = 0.0):
+        self.responses = responses if responses is not None else ["Kyaa~! Luna says hi! ✨"]
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.stall_rate = stall_rate
+        self.stall_latency = stall_latency
+        self.model = model
+        self.temperature = temperature
+        self.calls = 0
+        self.prompts: List[str] = []
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _delay(self) -> float:
+        if not self.stall_rate:
+            return self.latency
+        with self._lock:
+            stalled = self._rng.random() < self.stall_rate
+        return self.latency + (self.stall_latency if stalled else 0.0)
+
+    def _next_response(self, prompt) -> str:
+        prompt_text = prompt if isinstance(prompt, str) else str(prompt)
+        with self._lock:
+            index = self.calls
+            self.calls += 1
+            self.prompts.append(prompt_text)
+            fail = self.failure_rate and self._rng.random() < self.failure_rate
+        if fail:
+            raise RuntimeError("fake LLM failure (injected)")
+        if callable(self.responses):
+            return self.responses(prompt_text)
+        return self.responses[index % len(self.responses)]
+
+    def invoke(self, prompt, **kwargs) -> FakeMessage:
+        delay = self._delay()
+        if delay:
+            time.sleep(delay)
+        return FakeMessage(self._next_response(prompt))
+
+    async def ainvoke(self, prompt, **kwargs) -> FakeMessage:
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        return FakeMessage(self._next_response(prompt))
+
+    def stream(self, prompt, token_latency: float = 0.0, **kwargs) -> Iterator[FakeMessage]:
+        """Yield the response word by word, like a streaming chat model."""
+        delay = self._delay()
+        if delay:
+            time.sleep(delay)
+        text = self._next_response(prompt)
+        for index, word in enumerate(text.split(" ")):
+            if token_latency:
+                time.sleep(token_latency)
+            yield FakeMessage(word if index == 0 else " " + word)
+
+
+class FakeTTSClient:
+    """
+    Fake ElevenLabs client exposing `text_to_speech.convert(...)`.
+    Returns a generator of MP3-ish byte chunks after a configurable latency; `stall_rate`
+    of calls hang for `stall_latency` extra seconds first.
+    """
+
+    def __init__(self, latency: float = 0.0, per_char_latency: float = 0.0,
+                 chunk_latency: float = 0.0, failure_rate: float = 0.0, seed: Optional[int] = None,
+                 stall_rate: float = 0.0, stall_latency: float = 0.0):
+        self.latency = latency
+        self.per_char_latency = per_char_latency
+        self.chunk_latency = chunk_latency
+        self.failure_rate = failure_rate
+        self.stall_rate = stall_rate
+        self.stall_latency = stall_latency
+        self.calls = 0
+        self.characters = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.text_to_speech = self
+
+    def convert(self, text: str, voice_id: str = "", model_id: str = "",
+                output_format: str = "mp3_44100_128", **kwargs) -> Iterator[bytes]:
+        with self._lock:
+            self.calls += 1
+            self.characters += len(text)
+            fail = self.failure_rate and self._rng.random() < self.failure_rate
+            stalled = self.stall_rate and self._rng.random() < self.stall_rate
+        delay = self.latency + self.per_char_latency * len(text) + (self.stall_latency if stalled else 0.0)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise RuntimeError("fake TTS failure (injected)")
+        return self._chunks(text)
+
+    def _chunks(self, text: str) -> Iterator[bytes]:
+        payload = text.encode("utf-8")
+        for offset in range(0, max(len(payload), 1), 64):
+            if self.chunk_latency:
+                time.sleep(self.chunk_latency)
+            yield b"\xff\xfb" + payload[offset:offset + 64]
+
+
+class FakeAgent:
+    """AgentExecutor stand-in: invoke/ainvoke({"input": ...}) -> {"output": ...} from a FakeChatModel."""
+
+    def __init__(self, llm: Optional[FakeChatModel] = None, llm_calls_per_turn: int = 1):
+        self.llm = llm or FakeChatModel()
+        self.llm_calls_per_turn = llm_calls_per_turn
+
+    def invoke(self, inputs: dict, config: Optional[dict] = None) -> dict:
+        for _ in range(self.llm_calls_per_turn - 1):
+            self.llm.invoke(inputs["input"])
+        return {"input": inputs["input"], "output": self.llm.invoke(inputs["input"]).content}
+
+    async def ainvoke(self, inputs: dict, config: Optional[dict] = None) -> dict:
+        for _ in range(self.llm_calls_per_turn - 1):
+            await self.llm.ainvoke(inputs["input"])
+        message = await self.llm.ainvoke(inputs["input"])
+        return {"input": inputs["input"], "output": message.content}
+
+
+_langchain_fake_class = None
+
+
+def as_langchain_chat_model(fake: FakeChatModel):
+    """
+    Wrap a FakeChatModel as a LangChain chat model, so create_luna_agent() can run on it.
+    Honours stop sequences and streams word by word like Gemini does.
+
+    With tools bound (the "tools" agent mode) the script sees the conversation as
+    "Question: ..." / "Observation (<tool>): ..." lines followed by "Tools: <JSON schemas>",
+    and may answer {"tool_calls": [{"name": ..., "args": {...}}, ...]} to call tools.
+    """
+    global _langchain_fake_class
+    if _langchain_fake_class is None:
+        import json
+        from langchain_core.language_models.chat_models import BaseChatModel
+        from langchain_core.messages import AIMessage, AIMessageChunk
+        from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+        from langchain_core.utils.function_calling import convert_to_openai_tool
+
+        def render(messages, tools=None) -> str:
+            if not tools:
+                return "\n".join(str(message.content) for message in messages)
+            lines = []
+            for message in messages:
+                if message.type == "human":
+                    lines.append(f"Question: {message.content}")
+                elif message.type == "tool":
+                    lines.append(f"Observation ({message.additional_kwargs.get('name', '?')}): {message.content}")
+                elif getattr(message, "tool_calls", None):
+                    lines.append("Calls: " + json.dumps([{"name": c["name"], "args": c["args"]} for c in message.tool_calls]))
+                else:
+                    lines.append(str(message.content))
+            lines.append("Tools: " + json.dumps(tools))
+            return "\n".join(lines)
+
+        def truncate(text: str, stop) -> str:
+            for token in stop or []:
+                index = text.find(token)
+                if index >= 0:
+                    text = text[:index]
+            return text
+
+        def tool_calls(text: str, tools) -> Optional[List[dict]]:
+            if not tools or not text.startswith('{"tool_calls"'):
+                return None
+            calls = json.loads(text)["tool_calls"]
+            return [{"name": call["name"], "args": call["args"], "id": f"call_{index}_{call['name']}"}
+                    for index, call in enumerate(calls)]
+
+        class ScriptedChatModel(BaseChatModel):
+            script: Any
+
+            @property
+            def _llm_type(self) -> str:
+                return "luna-fake"
+
+            @property
+            def model(self) -> str:
+                return self.script.model
+
+            @property
+            def temperature(self) -> float:
+                return self.script.temperature
+
+            def bind_tools(self, tools, **kwargs):
+                return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+            def _generate(self, messages, stop=None, run_manager=None, tools=None, **kwargs):
+                text = truncate(self.script.invoke(render(messages, tools)).content, stop)
+                calls = tool_calls(text, tools)
+                message = AIMessage(content="", tool_calls=calls) if calls else AIMessage(content=text)
+                return ChatResult(generations=[ChatGeneration(message=message)])
+
+            def _stream(self, messages, stop=None, run_manager=None, tools=None, **kwargs):
+                text = truncate(self.script.invoke(render(messages, tools)).content, stop)
+                calls = tool_calls(text, tools)
+                if calls:
+                    chunks = [{"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": index}
+                              for index, call in enumerate(calls)]
+                    yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=chunks))
+                    return
+                for index, word in enumerate(text.split(" ")):
+                    piece = word if index == 0 else " " + word
+                    chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+                    if run_manager:
+                        run_manager.on_llm_new_token(piece, chunk=chunk)
+                    yield chunk
+
+        _langchain_fake_class = ScriptedChatModel
+    return _langchain_fake_class(script=fake)
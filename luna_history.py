@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Luna's chat history store.
+The most recent messages stay in memory; older ones are spilled to a per-session JSON-lines
+file with an in-memory offset index, so any page can be read back with one seek. The app
+renders only a window of recent messages and pages older ones in on request, which keeps
+per-rerun work and memory flat however long the conversation gets.
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+from array import array
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+DEFAULT_HISTORY_DIR = os.getenv("LUNA_HISTORY_DIR", "temp_history_luna/")
+DEFAULT_HOT_SIZE = int(os.getenv("LUNA_HISTORY_HOT_SIZE", "200"))
+DEFAULT_PAGE_SIZE = int(os.getenv("LUNA_HISTORY_PAGE_SIZE", "50"))
+
+Message = Dict[str, Any]
+
+
+class ChatHistory:
+    """
+    Append-only message history: a hot window of `hot_size` messages in memory, the rest on disk.
+    Messages are addressed by their position in the whole conversation (0 = first message).
+    """
+
+    def __init__(self, directory: str = DEFAULT_HISTORY_DIR, session_id: Optional[str] = None,
+                 hot_size: int = DEFAULT_HOT_SIZE):
+        self.directory = directory
+        self.session_id = session_id or uuid.uuid4().hex
+        self.hot_size = hot_size
+        self.path = os.path.join(directory, f"history_{self.session_id}.jsonl")
+        self._hot: Deque[Message] = deque()
+        self._offsets = array("q")  # byte offset of each spilled message in the file
+        self._file_size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._offsets) + len(self._hot)
+
+    @property
+    def spilled(self) -> int:
+        """How many of the oldest messages live only on disk."""
+        return len(self._offsets)
+
+    def append(self, message: Message):
+        with self._lock:
+            self._hot.append(message)
+            if len(self._hot) > self.hot_size:
+                self._spill(len(self._hot) - self.hot_size)
+
+    def _spill(self, count: int):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path, "ab") as history_file:
+            for _ in range(count):
+                line = json.dumps(self._hot.popleft(), ensure_ascii=False).encode("utf-8") + b"\n"
+                history_file.write(line)
+                self._offsets.append(self._file_size)
+                self._file_size += len(line)
+
+    def slice(self, start: int, stop: Optional[int] = None) -> List[Message]:
+        """Messages [start, stop) in conversation order, reading spilled ones from disk."""
+        with self._lock:
+            total = len(self._offsets) + len(self._hot)
+            stop = total if stop is None else min(stop, total)
+            start = max(0, start)
+            if start >= stop:
+                return []
+            spilled = len(self._offsets)
+            messages: List[Message] = []
+            if start < spilled:
+                cold_stop = min(stop, spilled)
+                end = self._offsets[cold_stop] if cold_stop < spilled else self._file_size
+                with open(self.path, "rb") as history_file:
+                    history_file.seek(self._offsets[start])
+                    data = history_file.read(end - self._offsets[start])
+                messages.extend(json.loads(line) for line in data.splitlines())
+            hot_start = max(start, spilled) - spilled
+            hot_stop = stop - spilled
+            if hot_stop > hot_start:
+                messages.extend(self._hot[i] for i in range(hot_start, hot_stop))
+            return messages
+
+    def latest(self, count: int) -> List[Message]:
+        """The last `count` messages."""
+        return self.slice(len(self) - count)
+
+    def page(self, before: int, size: int = DEFAULT_PAGE_SIZE) -> List[Message]:
+        """Up to `size` messages immediately older than position `before` ("load older")."""
+        return self.slice(before - size, before)
+
+    def __getitem__(self, index: int) -> Message:
+        if index < 0:
+            index += len(self)
+        messages = self.slice(index, index + 1)
+        if not messages:
+            raise IndexError("chat history index out of range")
+        return messages[0]
+
+    def clear(self):
+        with self._lock:
+            self._hot.clear()
+            self._offsets = array("q")
+            self._file_size = 0
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"messages": len(self._offsets) + len(self._hot), "in_memory": len(self._hot),
+                    "spilled": len(self._offsets), "spill_bytes": self._file_size}
+
+
+def prune_history_files(directory: str = DEFAULT_HISTORY_DIR, max_age: float = 7 * 24 * 3600) -> int:
+    """Delete spill files of sessions untouched for `max_age` seconds; returns how many were removed."""
+    removed = 0
+    if not os.path.isdir(directory):
+        return 0
+    now = time.time()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith("history_") and name.endswith(".jsonl"):
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def run_benchmark(sizes=(100, 1_000, 10_000), window: int = DEFAULT_PAGE_SIZE, reruns: int = 50):
+    """Per-rerun cost of rendering the whole list vs. the recent window, as history grows."""
+    import tempfile
+
+    def render(messages: List[Message]) -> int:
+        # Stand-in for building one chat bubble per message
+        return sum(len(f'<div class="chat-bubble">{m["text"]}</div>') for m in messages)
+
+    print(f"{'messages':>9} | {'full list ms':>12} | {'window ms':>9} | {'in memory':>9}")
+    print("-" * 49)
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            full: List[Message] = []
+            history = ChatHistory(directory)
+            for i in range(size):
+                message = {"sender": "User" if i % 2 == 0 else "Luna",
+                           "text": f"Message number {i} with a bit of chat text~ ✨", "audio_url": None}
+                full.append(message)
+                history.append(message)
+            start = time.perf_counter()
+            for _ in range(reruns):
+                render(full)
+            full_ms = (time.perf_counter() - start) * 1000 / reruns
+            start = time.perf_counter()
+            for _ in range(reruns):
+                render(history.latest(window))
+            window_ms = (time.perf_counter() - start) * 1000 / reruns
+            print(f"{size:>9,} | {full_ms:>12.3f} | {window_ms:>9.3f} | {history.stats()['in_memory']:>9}")
+        older = history.page(history.spilled, window)
+        print(f"load older: {len(older)} messages read back from disk")
+
+
+if __name__ == "__main__":
+    run_benchmark()
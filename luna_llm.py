@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Luna's shared LLM client provider.
+One process-wide pool of chat model clients, keyed by (model, temperature), so the agent
+and every tool reuse the same clients and their open connections instead of building a
+new ChatGoogleGenerativeAI per call.
+"""
+
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_MODEL = "gemini-2.0-flash-exp"
+DEFAULT_TEMPERATURE = 0.7
+DEFAULT_POOL_SIZE = int(os.getenv("LUNA_LLM_POOL_SIZE", "1"))
+
+
+def gemini_client_factory(model: str, temperature: float) -> Any:
+    """Build a Gemini chat client. Imported lazily so fakes work without langchain installed."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    gemini_key = os.getenv("GOOGLE_API_KEY")
+    if not gemini_key:
+        raise ValueError("Please set GOOGLE_API_KEY in your .env file!")
+
+    return ChatGoogleGenerativeAI(
+        model=model,
+        google_api_key=gemini_key,
+        temperature=temperature,
+        convert_system_message_to_human=True  # Gemini doesn't use system messages
+    )
+
+
+class LLMProvider:
+    """
+    Thread-safe pool of chat model clients.
+
+    Each (model, temperature) key gets up to `pool_size` clients, handed out round-robin.
+    Clients are built outside the lock, so a slow factory only holds up callers of its own
+    key that have no client to share yet.
+    """
+
+    def __init__(self, factory: Optional[Callable[[str, float], Any]] = None,
+                 pool_size: int = DEFAULT_POOL_SIZE):
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        self.factory = factory or gemini_client_factory
+        self.pool_size = pool_size
+        self._pools: Dict[Tuple[str, float], List[Any]] = {}
+        self._cursors: Dict[Tuple[str, float], int] = {}
+        self._building: Dict[Tuple[str, float], int] = {}
+        self._lock = threading.Lock()
+        self._built = threading.Condition(self._lock)
+        self.clients_created = 0
+        self.checkouts = 0
+
+    def get(self, model: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE) -> Any:
+        """Return a pooled client for this model/temperature, creating it on first use."""
+        key = (model, round(float(temperature), 3))
+        with self._built:
+            while True:
+                pool = self._pools.setdefault(key, [])
+                building = self._building.get(key, 0)
+                if len(pool) + building < self.pool_size:
+                    self._building[key] = building + 1  # reserve the slot, then build unlocked
+                    break
+                if pool:
+                    cursor = self._cursors.get(key, 0)
+                    self._cursors[key] = cursor + 1
+                    self.checkouts += 1
+                    return pool[cursor % len(pool)]
+                self._built.wait()  # every slot is still being built
+        client = None
+        try:
+            client = self.factory(model, key[1])
+        finally:
+            with self._built:
+                self._building[key] -= 1
+                if client is not None:
+                    self._pools.setdefault(key, []).append(client)
+                    self.clients_created += 1
+                    self.checkouts += 1
+                self._built.notify_all()
+        return client
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for how much client setup the pool actually did."""
+        with self._lock:
+            return {
+                "pools": len(self._pools),
+                "clients_created": self.clients_created,
+                "checkouts": self.checkouts,
+                "reuses": self.checkouts - self.clients_created,
+            }
+
+    def clear(self):
+        """Drop all pooled clients (counters are kept)."""
+        with self._lock:
+            self._pools.clear()
+            self._cursors.clear()
+
+
+_provider: Optional[LLMProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_llm_provider() -> LLMProvider:
+    """Return the process-wide provider, creating the default Gemini-backed one lazily."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = LLMProvider()
+    return _provider
+
+
+def set_llm_provider(provider: Optional[LLMProvider]):
+    """Install a provider (e.g. one backed by luna_fakes.FakeChatModel); None resets to default."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
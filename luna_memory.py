@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Luna's conversation memory.
+Recent turns are kept verbatim; older ones are folded, a batch at a time, into a running
+summary by a background worker. render() always fits a fixed token budget, so the agent's
+prompt stays the same size however long the conversation runs, and summarization never
+sits on the critical path of a reply.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from luna_trace import count_tokens, get_tracer
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("LUNA_MEMORY_TOKENS", "800"))
+DEFAULT_SUMMARY_SHARE = 0.35  # of the budget reserved for the running summary
+DEFAULT_SUMMARY_BATCH = int(os.getenv("LUNA_MEMORY_SUMMARY_BATCH", "4"))
+
+_summary_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    """Small shared pool for background summaries, started on first use."""
+    global _summary_executor
+    if _summary_executor is None:
+        with _executor_lock:
+            if _summary_executor is None:
+                _summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="luna-memory")
+    return _summary_executor
+
+
+class Turn:
+    """One user message and Luna's reply, with its token cost."""
+
+    __slots__ = ("user", "luna", "tokens")
+
+    def __init__(self, user: str, luna: str):
+        self.user = user
+        self.luna = luna
+        self.tokens = count_tokens(user) + count_tokens(luna) + 4  # + the "User:" / "Luna:" labels
+
+    def render(self) -> str:
+        return f"User: {self.user}\nLuna: {self.luna}"
+
+
+def _truncate_tokens(text: str, budget: int) -> str:
+    words = text.split()
+    return text if len(words) <= budget else " ".join(words[-budget:])
+
+
+def extractive_summary(summary: str, turns: List[Turn], budget: int) -> str:
+    """LLM-free fallback: keep the tail of the old summary plus the gist of each new turn."""
+    notes = [f"User asked about {turn.user[:80]}; Luna replied {turn.luna[:80]}." for turn in turns]
+    return _truncate_tokens(" ".join(filter(None, [summary] + notes)), budget)
+
+
+def llm_summarizer(llm: Any) -> Callable[[str, List[Turn], int], str]:
+    """Summarizer that asks `llm` to fold new turns into the running summary."""
+    def summarize(summary: str, turns: List[Turn], budget: int) -> str:
+        transcript = "\n".join(turn.render() for turn in turns)
+        prompt = f"""You keep the running memory of a chat between Luna (a cheerful anime girl AI) and her user.
+Fold the new turns into the summary. Keep names, preferences, promises and open questions; drop small talk.
+Answer with the updated summary only, in at most {budget} words.
+
+Current summary:
+{summary or "(empty)"}
+
+New turns:
+{transcript}"""
+        response = llm.invoke(prompt)
+        return response.content if hasattr(response, 'content') else str(response)
+
+    return summarize
+
+
+class ConversationMemory:
+    """
+    Token-budgeted memory for one conversation.
+
+    `summarizer(summary, turns, budget) -> new summary` runs in the background once
+    `summary_batch` turns have aged out of the verbatim window; without one, an extractive
+    summary is used. Turns waiting for (or in) summarization are still shown verbatim when
+    they fit, so nothing vanishes from the prompt while a summary is being written.
+    """
+
+    def __init__(self, summarizer: Optional[Callable[[str, List[Turn], int], str]] = None,
+                 token_budget: int = DEFAULT_TOKEN_BUDGET, summary_share: float = DEFAULT_SUMMARY_SHARE,
+                 summary_batch: int = DEFAULT_SUMMARY_BATCH, executor: Optional[ThreadPoolExecutor] = None):
+        self.summarizer = summarizer
+        self.token_budget = token_budget
+        self.summary_budget = max(1, int(token_budget * summary_share))
+        self.summary_batch = summary_batch
+        self._executor = executor
+        self.summary = ""
+        self._recent: Deque[Turn] = deque()
+        self._recent_tokens = 0
+        self._pending: List[Turn] = []
+        self._in_flight: List[Turn] = []
+        self._future: Optional[Future] = None
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.summaries = 0
+        self.summary_failures = 0
+        self.turn_tokens: Deque[int] = deque(maxlen=1000)
+        self.prompt_tokens: Deque[int] = deque(maxlen=1000)
+
+    def add_turn(self, user: str, luna: str):
+        """Record a finished turn; may schedule a background summary but never waits for one."""
+        turn = Turn(user, luna)
+        with self._lock:
+            self.turns += 1
+            self.turn_tokens.append(turn.tokens)
+            self._recent.append(turn)
+            self._recent_tokens += turn.tokens
+            verbatim_budget = self.token_budget - self.summary_budget
+            while self._recent_tokens > verbatim_budget and len(self._recent) > 1:
+                aged = self._recent.popleft()
+                self._recent_tokens -= aged.tokens
+                self._pending.append(aged)
+            self._maybe_summarize()
+
+    def _maybe_summarize(self):
+        # Called with the lock held; at most one summary per conversation is in flight.
+        if self._future is not None or len(self._pending) < self.summary_batch:
+            return
+        # Oldest turns first, capped so the summarizer's own prompt stays bounded too.
+        batch_tokens, size = 0, 0
+        for turn in self._pending:
+            if size and batch_tokens + turn.tokens > self.token_budget:
+                break
+            batch_tokens += turn.tokens
+            size += 1
+        self._in_flight, self._pending = self._pending[:size], self._pending[size:]
+        self._future = (self._executor or _executor()).submit(self._summarize, self.summary, list(self._in_flight))
+
+    def _summarize(self, summary: str, turns: List[Turn]):
+        with get_tracer().span("memory.summarize", turns=len(turns)) as span:
+            try:
+                if self.summarizer is None:
+                    raise LookupError("no summarizer")
+                new_summary = self.summarizer(summary, turns, self.summary_budget)
+                failed = False
+            except Exception:
+                new_summary = extractive_summary(summary, turns, self.summary_budget)
+                failed = self.summarizer is not None
+            new_summary = _truncate_tokens(new_summary.strip(), self.summary_budget)
+            span.set(output_tokens=count_tokens(new_summary), fallback=failed)
+        with self._lock:
+            self.summary = new_summary
+            self.summaries += 1
+            self.summary_failures += failed
+            self._in_flight = []
+            self._future = None
+            self._maybe_summarize()
+
+    def render(self) -> str:
+        """Memory section for the prompt: summary plus as many recent turns as fit the budget."""
+        with self._lock:
+            summary = self.summary
+            turns = self._in_flight + self._pending + list(self._recent)
+        used = count_tokens(summary)
+        kept: List[str] = []
+        for turn in reversed(turns):
+            if used + turn.tokens > self.token_budget:
+                break
+            kept.append(turn.render())
+            used += turn.tokens
+        with self._lock:
+            self.prompt_tokens.append(used)
+        if not summary and not kept:
+            return ""
+        parts = ["Conversation so far:"]
+        if summary:
+            parts.append(f"(Earlier, in summary: {summary})")
+        parts.extend(reversed(kept))
+        return "\n".join(parts) + "\n\n"
+
+    def wait(self, timeout: Optional[float] = None):
+        """Block until any in-flight summary has been folded in (for shutdown and benchmarks)."""
+        while True:
+            with self._lock:
+                future = self._future
+            if future is None:
+                return
+            future.result(timeout)
+
+    def clear(self):
+        self.wait()
+        with self._lock:
+            self.summary = ""
+            self._recent.clear()
+            self._recent_tokens = 0
+            self._pending = []
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            prompt_tokens = list(self.prompt_tokens)
+            return {
+                "turns": self.turns,
+                "verbatim_turns": len(self._recent),
+                "awaiting_summary": len(self._pending) + len(self._in_flight),
+                "summaries": self.summaries,
+                "summary_failures": self.summary_failures,
+                "summary_tokens": count_tokens(self.summary),
+                "last_prompt_tokens": prompt_tokens[-1] if prompt_tokens else 0,
+                "max_prompt_tokens": max(prompt_tokens, default=0),
+                "token_budget": self.token_budget,
+            }
+
+
+def run_benchmark(turns: int = 300, summarizer_latency: float = 0.05, turn_interval: float = 0.01):
+    """Prompt size and critical-path cost over a long conversation, against full-history stuffing."""
+    from luna_fakes import FakeChatModel
+
+    llm = FakeChatModel(lambda prompt: "Master likes cats, asked about math and poems; Luna promised a haiku.",
+                        latency=summarizer_latency)
+    memory = ConversationMemory(llm_summarizer(llm))
+    naive_tokens = 0
+    worst_add = 0.0
+    print(f"{'turn':>5} | {'naive prompt tokens':>19} | {'memory prompt tokens':>20} | {'summaries':>9}")
+    print("-" * 64)
+    for turn in range(1, turns + 1):
+        user = f"Question {turn}: what do you think about topic number {turn} and its fun details?"
+        luna = f"Kyaa~! Topic {turn} is super interesting, Master! Here's what Luna knows about it~ ✨"
+        naive_tokens += count_tokens(user) + count_tokens(luna) + 4
+        start = time.perf_counter()
+        memory.add_turn(user, luna)
+        worst_add = max(worst_add, time.perf_counter() - start)
+        time.sleep(turn_interval)
+        rendered = memory.render()
+        if turn in (1, 10, 50, 100, turns):
+            print(f"{turn:>5} | {naive_tokens:>19,} | {count_tokens(rendered):>20} | {memory.summaries:>9}")
+    memory.wait()
+    print(f"summarizer calls: {llm.calls} for {turns} turns; worst add_turn {worst_add * 1000:.2f} ms "
+          f"(summaries take {summarizer_latency * 1000:.0f} ms each, off the critical path)")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Luna's asyncio response pipeline.
+AIML -> intent router -> semantic cache -> agent (ainvoke) -> emotion/avatar + TTS, with
+per-stage timeouts and cancellation.
+Emotion and avatar selection run while audio synthesis is still in flight, and one
+slow upstream call only blocks its own session instead of the whole process. With the
+"tools" agent mode, independent tool calls from one model turn run concurrently under ainvoke.
+"""
+
+import time
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from luna_resilience import DeadlineExceeded, deadline_scope, remaining_time
+from luna_trace import get_tracer
+
+# Per stage, and for the whole turn: each stage also gets no more than what is left of the turn.
+DEFAULT_TIMEOUTS = {"aiml": 1.0, "router": 30.0, "cache": 1.0, "agent": 60.0, "emotion": 2.0, "tts": 30.0,
+                    "turn": 75.0}
+AGENT_TIMEOUT_REPLY = "Waaah! Luna's brain took too long on that one! 😱 Can you ask again, Master? 💖"
+AGENT_ERROR_REPLY = "Eeeek! A tiny problem occurred! Let's try again! 💖"
+
+
+class StageTimeout(TimeoutError):
+    """A pipeline stage ran past its timeout."""
+
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"Stage '{stage}' timed out after {timeout:.1f}s")
+        self.stage = stage
+        self.timeout = timeout
+
+
+class PipelineResult:
+    """Everything one turn produced, plus per-stage wall-clock timings in seconds."""
+
+    __slots__ = ("text", "source", "emotion", "avatar", "audio_path", "timings", "errors")
+
+    def __init__(self):
+        self.text = ""
+        self.source = ""
+        self.emotion = "speaking"
+        self.avatar: Optional[str] = None
+        self.audio_path: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+async def _call(func: Callable, *args, executor: Optional[ThreadPoolExecutor] = None):
+    """Await a coroutine function directly, or run a blocking one on the executor."""
+    if asyncio.iscoroutinefunction(func):
+        return await func(*args)
+    # Copy the context so spans opened in the worker thread nest under the current turn.
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(context.run, func, *args))
+
+
+class LunaPipeline:
+    """
+    Async front door for one chat turn.
+
+    `agent` needs ainvoke({"input": ...}) (an AgentExecutor from create_luna_agent works);
+    `router` (a luna_router.IntentRouter) answers obvious tool requests without the agent, and
+    `semantic_cache` (a luna_semantic_cache.SemanticCache) serves paraphrases of answered
+    questions, both as in the Streamlit app;
+    `tts` maps text -> audio path and may be sync (run on a bounded thread pool) or async.
+    `emotion_fn` / `avatar_fn` are optional text -> emotion and emotion -> asset hooks.
+    """
+
+    def __init__(self, aiml_engine: Any, agent: Any = None, tts: Optional[Callable[[str], Optional[str]]] = None,
+                 emotion_fn: Optional[Callable[[str], str]] = None, avatar_fn: Optional[Callable[[str], str]] = None,
+                 timeouts: Optional[Dict[str, float]] = None, tts_workers: int = 32,
+                 router: Any = None, semantic_cache: Any = None):
+        self.aiml_engine = aiml_engine
+        self.agent = agent
+        self.router = router
+        self.semantic_cache = semantic_cache
+        self.tts = tts
+        self.emotion_fn = emotion_fn
+        self.avatar_fn = avatar_fn
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self._executor = ThreadPoolExecutor(max_workers=tts_workers, thread_name_prefix="luna-pipeline")
+
+    async def _stage(self, name: str, awaitable, result: PipelineResult):
+        start = time.perf_counter()
+        timeout = remaining_time(self.timeouts.get(name))
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            raise StageTimeout(name, timeout) from None
+        finally:
+            result.timings[name] = time.perf_counter() - start
+
+    async def respond(self, user_input: str, on_event: Optional[Callable[[str, Any], None]] = None,
+                      memory: Optional[Any] = None) -> PipelineResult:
+        """
+        Run one turn. Cancelling the awaiting task cancels whichever stage is in flight.
+        on_event(name, value) is called with "text", "emotion" and "audio" as each becomes known.
+        `memory` (a luna_memory.ConversationMemory) feeds the agent's chat_history and records the turn.
+        """
+        with get_tracer().span("turn", characters=len(user_input)) as span, deadline_scope(self.timeouts["turn"]):
+            result = await self._respond(user_input, on_event, memory)
+            span.set(source=result.source, errors=sorted(result.errors))
+        return result
+
+    async def _respond(self, user_input: str, on_event: Optional[Callable[[str, Any], None]],
+                       memory: Optional[Any]) -> PipelineResult:
+        result = PipelineResult()
+        turn_start = time.perf_counter()
+        emit = on_event or (lambda name, value: None)
+
+        aiml_response = await self._stage("aiml", _call(self.aiml_engine.process, user_input), result)
+        routed_response = None
+        if not aiml_response and self.router is not None:
+            try:
+                routed_response = await self._stage(
+                    "router", _call(self.router.route, user_input, executor=self._executor), result)
+            except (StageTimeout, DeadlineExceeded) as e:
+                result.errors["router"] = str(e)
+        if aiml_response:
+            result.text, result.source = aiml_response, "aiml"
+        elif routed_response:
+            result.text, result.source = routed_response, "router"
+        elif self.agent is not None:
+            try:
+                await self._run_agent(user_input, memory, result)
+            except (StageTimeout, DeadlineExceeded) as e:
+                result.text, result.source = AGENT_TIMEOUT_REPLY, "fallback"
+                result.errors["agent"] = str(e)
+            except Exception as e:
+                result.text, result.source = AGENT_ERROR_REPLY, "fallback"
+                result.errors["agent"] = str(e)
+        else:
+            result.text, result.source = "Waaah! My main brain isn't working right now! 😱", "fallback"
+
+        emit("text", result.text)
+        if memory is not None:
+            memory.add_turn(user_input, result.text)
+
+        # Audio synthesis starts first; emotion and avatar are worked out while it is in flight.
+        audio_task = None
+        if self.tts is not None:
+            audio_task = asyncio.ensure_future(
+                self._stage("tts", _call(self.tts, result.text, executor=self._executor), result)
+            )
+        try:
+            if self.emotion_fn is not None:
+                result.emotion = await self._stage("emotion", _call(self.emotion_fn, result.text), result)
+            if self.avatar_fn is not None:
+                result.avatar = self.avatar_fn(result.emotion)
+            emit("emotion", result.emotion)
+            if audio_task is not None:
+                try:
+                    result.audio_path = await audio_task
+                except Exception as e:
+                    result.errors["tts"] = str(e)
+                emit("audio", result.audio_path)
+        finally:
+            if audio_task is not None and not audio_task.done():
+                audio_task.cancel()
+
+        result.timings["total"] = time.perf_counter() - turn_start
+        return result
+
+    async def _run_agent(self, user_input: str, memory: Optional[Any], result: PipelineResult):
+        # The cache is shared by every session, so it is skipped once the memory holds any of
+        # this conversation: the answer may depend on it.
+        inputs = {"input": user_input}
+        if memory is not None:
+            inputs["chat_history"] = memory.render()
+        cache = self.semantic_cache if not inputs.get("chat_history") else None
+        if cache is not None:
+            cached = await self._stage("cache", _call(cache.lookup, user_input, executor=self._executor), result)
+            if cached is not None:
+                result.text, result.source = cached, "cache"
+                return
+            from luna_callbacks import ToolUseRecorder
+
+            recorder = ToolUseRecorder()
+            response = await self._stage("agent", self.agent.ainvoke(inputs, config={"callbacks": [recorder]}), result)
+            output = response.get("output") or ""
+            if not output.startswith("Agent stopped"):
+                await _call(cache.store, user_input, output, recorder.tools, executor=self._executor)
+        else:
+            response = await self._stage("agent", self.agent.ainvoke(inputs), result)
+        result.text, result.source = response["output"], "agent"
+
+    def respond_sync(self, user_input: str) -> PipelineResult:
+        """Blocking convenience wrapper for scripts and the CLI."""
+        return asyncio.run(self.respond(user_input))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+async def _run_sessions(pipeline: LunaPipeline, sessions: int, turns: int) -> float:
+    async def session(session_id: int):
+        for turn in range(turns):
+            await pipeline.respond(f"session {session_id} asks question number {turn}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(sessions)))
+    return time.perf_counter() - start
+
+
+def run_concurrency_benchmark(session_counts=(1, 10, 50, 200), turns: int = 3,
+                              llm_latency: float = 0.2, tts_latency: float = 0.3):
+    """Throughput of the async pipeline over many simultaneous sessions with fake backends."""
+    import tempfile
+    from luna_fakes import FakeAgent, FakeChatModel, FakeTTSClient
+    from luna_rules import CompiledRuleEngine
+    from luna_tts import AudioStore, synthesize_audio
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = AudioStore(directory)
+        tts_client = FakeTTSClient(latency=tts_latency)
+        aiml = CompiledRuleEngine.from_file()
+        agent = FakeAgent(FakeChatModel(lambda prompt: f"Ooh! Luna thought hard about: {prompt}",
+                                        latency=llm_latency))
+        pipeline = LunaPipeline(aiml, agent, tts=lambda text: synthesize_audio(tts_client, text, store),
+                                tts_workers=max(session_counts))
+        serial_turn = llm_latency + tts_latency
+        print(f"{'sessions':>8} | {'turns/s':>8} | {'serial turns/s':>14}")
+        print("-" * 37)
+        for sessions in session_counts:
+            elapsed = asyncio.run(_run_sessions(pipeline, sessions, turns))
+            print(f"{sessions:>8} | {sessions * turns / elapsed:>8.1f} | {1 / serial_turn:>14.1f}")
+        pipeline.close()
+
+
+if __name__ == "__main__":
+    run_concurrency_benchmark()
@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+"""
+Luna's reminder scheduler (Memo-chan).
+Natural time expressions ("in 20 minutes", "tomorrow at 9am", "next friday") are parsed into
+timestamps, reminders are persisted in SQLite with an index on due time, and a single timer
+thread fires them from an in-memory min-heap: O(log n) to schedule, O(log n) to pop the next
+due reminder, with cancellations dropped lazily when they reach the top of the heap.
+"""
+
+import os
+import re
+import time
+import heapq
+import sqlite3
+import logging
+import threading
+import contextvars
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from luna_trace import get_tracer
+
+DEFAULT_REMINDERS_DB = os.getenv("LUNA_REMINDERS_DB", "luna_reminders.db")
+DEFAULT_SESSION = "default"
+FIRE_BATCH = 5000  # due reminders marked fired per transaction
+MAX_INBOX = 100  # fired reminders kept per session until drained
+
+logger = logging.getLogger(__name__)
+
+_current_session: "contextvars.ContextVar[str]" = contextvars.ContextVar("luna_session", default=DEFAULT_SESSION)
+
+
+class ReminderParseError(ValueError):
+    """The time expression could not be understood."""
+
+
+class ReminderInPastError(ReminderParseError):
+    """The time expression is understood, but it has already passed."""
+
+
+# --- Time expressions ---
+
+_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}  # by the unit's first letter
+_NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "fifteen": 15, "twenty": 20, "thirty": 30, "forty-five": 45,
+    "a couple of": 2, "a few": 3, "half an": 0.5,
+}
+_WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+_PARTS_OF_DAY = {"morning": (9, 0), "noon": (12, 0), "afternoon": (15, 0), "evening": (19, 0),
+                 "tonight": (20, 0), "night": (21, 0), "midnight": (0, 0)}
+
+# Parts of the day that turn a bare clock hour ("tonight at 8") into an afternoon or evening one
+_PM_PARTS = {"afternoon", "evening", "tonight", "night"}
+
+_RELATIVE = re.compile(r"^(?:in|after)\s+(?P<spans>.+?)(?:\s+from\s+now)?$")
+_SPAN = re.compile(
+    r"(?P<amount>\d+(?:\.\d+)?|a couple of|a few|half an|forty-five|[a-z]+)\s+"
+    r"(?P<unit>sec(?:ond)?|min(?:ute)?|h(?:ou)?r|day|week)s?(?:\s+and\s+|\s+|$)"
+)
+_CLOCK = re.compile(r"(?:\bat\s+)?\b(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?P<ampm>a\.?m\.?|p\.?m\.?)?(?=\s|$)")
+_ISO_DATE = re.compile(r"\b(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})\b")
+
+
+def _relative_seconds(spans: str) -> Optional[float]:
+    """Seconds in "2 hours and 30 minutes"-style spans, or None if that's not what they are."""
+    seconds, position = 0.0, 0
+    while position < len(spans):
+        span = _SPAN.match(spans, position)
+        if not span:
+            return None
+        amount_text = span.group("amount")
+        try:
+            amount = float(amount_text)
+        except ValueError:
+            if amount_text not in _NUMBER_WORDS:
+                raise ReminderParseError(f"'{amount_text}' is not a number Luna knows") from None
+            amount = _NUMBER_WORDS[amount_text]
+        seconds += amount * _UNIT_SECONDS[span.group("unit")[0]]
+        position = span.end()
+    return seconds
+
+
+def _clock_time(expression: str) -> Optional[Tuple[int, int, bool, str]]:
+    """(hour, minute, whether am/pm was given, rest of the expression) for its first clock time, if any."""
+    for match in _CLOCK.finditer(expression):
+        hour, minute, ampm = int(match.group("hour")), int(match.group("minute") or 0), match.group("ampm")
+        # A bare number is only a time after "at" ("at 5"), not a day or a count
+        if not ampm and not match.group("minute") and not match.group(0).startswith("at"):
+            continue
+        if ampm:
+            if not 1 <= hour <= 12:
+                raise ReminderParseError(f"'{match.group(0).strip()}' is not a valid time")
+            hour = hour % 12 + (12 if ampm.startswith("p") else 0)
+        if hour > 23 or minute > 59:
+            raise ReminderParseError(f"'{match.group(0).strip()}' is not a valid time")
+        rest = (expression[:match.start()] + " " + expression[match.end():]).strip()
+        return hour, minute, bool(ampm), " ".join(rest.split())
+    return None
+
+
+def parse_when(expression: str, now: Optional[float] = None) -> float:
+    """
+    Timestamp for a natural time expression, in local time relative to `now`.
+
+    Understands relative offsets ("in 5 minutes", "in an hour", "in 2 hours and 30 minutes",
+    "after two days"), days
+    ("today", "tonight", "tomorrow", "monday", "next friday", "next week", "on 2026-05-01"), parts of the
+    day ("this evening") and clock times ("at 5pm", "17:30"), alone or combined; with an
+    afternoon, evening or night, a bare hour is p.m. ("tonight at 8"). A clock time without
+    a day that has already passed today means tomorrow. Raises ReminderParseError otherwise.
+    """
+    now = time.time() if now is None else now
+    text = " ".join(expression.lower().replace(",", " ").split()).strip(" .!?")
+    if not text:
+        raise ReminderParseError("no time given")
+    if text == "now":
+        return now
+
+    relative = _RELATIVE.match(text)
+    seconds = _relative_seconds(relative.group("spans")) if relative else None
+    if seconds is not None:
+        return now + seconds
+
+    base = datetime.fromtimestamp(now)
+    day: Optional[datetime] = None
+    clock = _clock_time(text)
+    rest = text
+    meridiem = False
+    if clock:
+        hour, minute, meridiem, rest = clock
+    else:
+        hour = minute = None
+
+    rest = re.sub(r"\b(?:at|on|by|the|this|in)\b", " ", rest)
+    words = rest.split()
+    iso = _ISO_DATE.search(rest)
+    if iso:
+        try:
+            day = datetime(int(iso.group("year")), int(iso.group("month")), int(iso.group("day")))
+        except ValueError as e:
+            raise ReminderParseError(str(e)) from None
+        words = _ISO_DATE.sub(" ", rest).split()
+
+    explicit_day = day is not None
+    for index, word in enumerate(words):
+        if word == "today":
+            day, explicit_day = base, True
+        elif word == "tomorrow":
+            day, explicit_day = base + timedelta(days=1), True
+        elif word in _WEEKDAYS:
+            # "friday" and "next friday" both mean the coming one, never today
+            ahead = (_WEEKDAYS.index(word) - base.weekday()) % 7 or 7
+            day, explicit_day = base + timedelta(days=ahead), True
+        elif word == "next" and index + 1 < len(words) and words[index + 1] in _WEEKDAYS:
+            continue
+        elif word == "next" and words[index + 1:index + 2] == ["week"]:
+            day, explicit_day = base + timedelta(days=7), True
+        elif word == "week" and index and words[index - 1] == "next":
+            continue
+        elif word in _PARTS_OF_DAY:
+            if hour is None:
+                hour, minute = _PARTS_OF_DAY[word]
+            elif word in _PM_PARTS and not meridiem and 1 <= hour < 12:
+                hour += 12  # "tonight at 8" is 20:00
+            if word == "tonight" and day is None:
+                day, explicit_day = base, True
+        elif word in ("o'clock", "oclock", "sharp", "around", "about"):
+            continue
+        else:
+            raise ReminderParseError(f"Luna doesn't understand '{word}' in '{expression}'")
+
+    if day is None and hour is None:
+        raise ReminderParseError(f"no day or time in '{expression}'")
+    if hour is None:
+        hour, minute = _PARTS_OF_DAY["morning"]
+    due = (day or base).replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if not explicit_day and due.timestamp() <= now:
+        due += timedelta(days=1)
+    return due.timestamp()
+
+
+def describe_when(due: float, now: Optional[float] = None) -> str:
+    """Human description of a due time, e.g. 'tomorrow at 09:00 (in 14 hours)'."""
+    now = time.time() if now is None else now
+    due_dt, today = datetime.fromtimestamp(due), datetime.fromtimestamp(now).date()
+    days = (due_dt.date() - today).days
+    day = {0: "today", 1: "tomorrow"}.get(days, due_dt.strftime("%A %Y-%m-%d"))
+    delta = max(0, due - now)
+    amount, unit = ((round(delta / 60), "minute") if delta < 3600 else
+                    (round(delta / 3600), "hour") if delta < 2 * 86400 else (round(delta / 86400), "day"))
+    return f"{day} at {due_dt:%H:%M} (in {amount} {unit}{'' if amount == 1 else 's'})"
+
+
+# --- Persistence ---
+
+class Reminder:
+    """One scheduled reminder."""
+
+    __slots__ = ("id", "session_id", "task", "due", "created", "status")
+
+    def __init__(self, id: int, session_id: str, task: str, due: float, created: float, status: str = "pending"):
+        self.id = id
+        self.session_id = session_id
+        self.task = task
+        self.due = due
+        self.created = created
+        self.status = status
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "session_id": self.session_id, "task": self.task, "due": self.due,
+                "created": self.created, "status": self.status}
+
+
+class ReminderStore:
+    """
+    SQLite table of reminders. Pending reminders are indexed by due time (for loading the
+    timer and sweeping anything overdue) and by session (for listing); one connection is
+    shared behind a lock.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS reminders (
+            id INTEGER PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            task TEXT NOT NULL,
+            due REAL NOT NULL,
+            created REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending'
+        );
+        CREATE INDEX IF NOT EXISTS reminders_pending_due ON reminders (due) WHERE status = 'pending';
+        CREATE INDEX IF NOT EXISTS reminders_session ON reminders (session_id, status, due);
+    """
+    _COLUMNS = "id, session_id, task, due, created, status"
+
+    def __init__(self, path: str = DEFAULT_REMINDERS_DB):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(self._SCHEMA)
+        self._lock = threading.Lock()
+
+    def add(self, session_id: str, task: str, due: float) -> Reminder:
+        return self.add_many([(session_id, task, due)])[0]
+
+    def add_many(self, items: Iterable[Tuple[str, str, float]]) -> List[Reminder]:
+        """Insert (session_id, task, due) rows in one transaction."""
+        created = time.time()
+        reminders = []
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                for session_id, task, due in items:
+                    cursor = self._db.execute(
+                        "INSERT INTO reminders (session_id, task, due, created) VALUES (?, ?, ?, ?)",
+                        (session_id, task, due, created))
+                    reminders.append(Reminder(cursor.lastrowid, session_id, task, due, created))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return reminders
+
+    def get(self, reminder_id: int) -> Optional[Reminder]:
+        with self._lock:
+            row = self._db.execute(f"SELECT {self._COLUMNS} FROM reminders WHERE id = ?", (reminder_id,)).fetchone()
+        return Reminder(*row) if row else None
+
+    def list(self, session_id: str, include_done: bool = False) -> List[Reminder]:
+        """A session's reminders, soonest first; only pending ones unless include_done."""
+        query = f"SELECT {self._COLUMNS} FROM reminders WHERE session_id = ?"
+        if not include_done:
+            query += " AND status = 'pending'"
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY due", (session_id,)).fetchall()
+        return [Reminder(*row) for row in rows]
+
+    def cancel(self, reminder_id: int, session_id: Optional[str] = None) -> bool:
+        """Cancel a pending reminder (only within `session_id`, if given); False if there was none."""
+        query, params = "UPDATE reminders SET status = 'cancelled' WHERE id = ? AND status = 'pending'", [reminder_id]
+        if session_id is not None:
+            query += " AND session_id = ?"
+            params.append(session_id)
+        with self._lock:
+            return self._db.execute(query, params).rowcount > 0
+
+    def pending(self, until: Optional[float] = None) -> List[Tuple[float, int]]:
+        """(due, id) of every pending reminder (due no later than `until`), in due order."""
+        query = "SELECT due, id FROM reminders WHERE status = 'pending'"
+        params: Tuple = ()
+        if until is not None:
+            query += " AND due <= ?"
+            params = (until,)
+        with self._lock:
+            return self._db.execute(query + " ORDER BY due", params).fetchall()
+
+    def claim(self, reminder_ids: List[int]) -> List[Reminder]:
+        """Mark the still-pending reminders among `reminder_ids` fired, in one transaction; returns them in due order."""
+        reminders: List[Reminder] = []
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for start in range(0, len(reminder_ids), 500):
+                    chunk = reminder_ids[start:start + 500]
+                    where = f"id IN ({','.join('?' * len(chunk))}) AND status = 'pending'"
+                    rows = self._db.execute(f"SELECT {self._COLUMNS} FROM reminders WHERE {where}", chunk).fetchall()
+                    self._db.execute(f"UPDATE reminders SET status = 'fired' WHERE {where}", chunk)
+                    reminders.extend(Reminder(*row[:5], "fired") for row in rows)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        reminders.sort(key=lambda reminder: reminder.due)
+        return reminders
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# --- Scheduling ---
+
+class ReminderScheduler:
+    """
+    Fires reminders when they fall due.
+
+    Pending reminders live in a min-heap of (due, id), rebuilt from the store with heapify on
+    start(); one timer thread sleeps until the earliest is due. Fired reminders are marked in
+    the store, handed to `on_fire` (if set) and queued in a per-session inbox for drain().
+    """
+
+    def __init__(self, store: ReminderStore, on_fire: Optional[Callable[[Reminder], None]] = None,
+                 clock: Callable[[], float] = time.time):
+        self.store = store
+        self.on_fire = on_fire
+        self.clock = clock
+        self._heap: List[Tuple[float, int]] = []
+        self._cancelled: Set[int] = set()
+        self._inbox: Dict[str, Deque[Reminder]] = defaultdict(lambda: deque(maxlen=MAX_INBOX))
+        self._wakeup = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.scheduled = 0
+        self.fired = 0
+        self.cancelled = 0
+
+    def start(self) -> "ReminderScheduler":
+        with self._wakeup:
+            if self._thread is None:
+                self._heap = list(self.store.pending())
+                heapq.heapify(self._heap)
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="luna-reminders", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        with self._wakeup:
+            self._stopping = True
+            thread, self._thread = self._thread, None
+            self._wakeup.notify()
+        if thread is not None:
+            thread.join()
+
+    def schedule(self, task: str, when: Any, session_id: Optional[str] = None) -> Reminder:
+        """Persist and arm a reminder; `when` is a timestamp or a natural time expression."""
+        due = parse_when(when, self.clock()) if isinstance(when, str) else float(when)
+        reminder = self.store.add(session_id or _current_session.get(), task, due)
+        self._push([(reminder.due, reminder.id)])
+        return reminder
+
+    def schedule_many(self, items: Iterable[Tuple[str, str, float]]) -> List[Reminder]:
+        """Bulk schedule (session_id, task, due) rows: one transaction, one heap update."""
+        reminders = self.store.add_many(items)
+        self._push([(reminder.due, reminder.id) for reminder in reminders])
+        return reminders
+
+    def _push(self, entries: List[Tuple[float, int]]):
+        with self._wakeup:
+            earliest = self._heap[0][0] if self._heap else None
+            if len(entries) > len(self._heap):
+                self._heap.extend(entries)
+                heapq.heapify(self._heap)
+            else:
+                for entry in entries:
+                    heapq.heappush(self._heap, entry)
+            self.scheduled += len(entries)
+            if earliest is None or self._heap[0][0] < earliest:
+                self._wakeup.notify()
+
+    def cancel(self, reminder_id: int, session_id: Optional[str] = None) -> bool:
+        """Cancel a pending reminder of the session (the current one by default)."""
+        if not self.store.cancel(reminder_id, session_id or _current_session.get()):
+            return False
+        with self._wakeup:
+            self._cancelled.add(reminder_id)
+            self.cancelled += 1
+        return True
+
+    def list(self, session_id: Optional[str] = None, include_done: bool = False) -> List[Reminder]:
+        return self.store.list(session_id or _current_session.get(), include_done)
+
+    def drain(self, session_id: Optional[str] = None) -> List[Reminder]:
+        """Fired reminders for the session not yet collected (e.g. to show on the next rerun)."""
+        session_id = session_id or _current_session.get()
+        with self._wakeup:
+            inbox = self._inbox.pop(session_id, None)
+        return list(inbox or ())
+
+    def _pop_due(self, now: float) -> List[int]:
+        # Called with the condition held.
+        due: List[int] = []
+        heap = self._heap
+        while heap and heap[0][0] <= now and len(due) < FIRE_BATCH:
+            _, reminder_id = heapq.heappop(heap)
+            if reminder_id in self._cancelled:
+                self._cancelled.discard(reminder_id)
+            else:
+                due.append(reminder_id)
+        return due
+
+    def fire_due(self, now: Optional[float] = None) -> int:
+        """Fire everything due by `now`; the timer thread calls this, benchmarks may too."""
+        now = self.clock() if now is None else now
+        total = 0
+        while True:
+            with self._wakeup:
+                due_ids = self._pop_due(now)
+            if not due_ids:
+                return total
+            with get_tracer().span("reminders.fire", reminders=len(due_ids)):
+                reminders = self.store.claim(due_ids)
+                with self._wakeup:
+                    for reminder in reminders:
+                        self._inbox[reminder.session_id].append(reminder)
+                    self.fired += len(reminders)
+                for reminder in reminders:
+                    if self.on_fire is not None:
+                        try:
+                            self.on_fire(reminder)
+                        except Exception:
+                            logger.exception("Reminder callback failed for reminder %s", reminder.id)
+            total += len(reminders)
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if self._stopping:
+                    return
+                delay = self._heap[0][0] - self.clock() if self._heap else None
+                if delay is None or delay > 0:
+                    self._wakeup.wait(None if delay is None else min(delay, 60.0))
+                    continue
+            self.fire_due()
+
+    def stats(self) -> Dict[str, int]:
+        with self._wakeup:
+            return {"pending": len(self._heap) - len(self._cancelled), "scheduled": self.scheduled,
+                    "fired": self.fired, "cancelled": self.cancelled}
+
+
+def current_session() -> str:
+    return _current_session.get()
+
+
+def set_current_session(session_id: str) -> contextvars.Token:
+    """Make `session_id` the session reminder tools act on in this context; returns a reset token."""
+    return _current_session.set(session_id or DEFAULT_SESSION)
+
+
+_scheduler: Optional[ReminderScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_reminder_scheduler() -> ReminderScheduler:
+    """Process-wide scheduler on LUNA_REMINDERS_DB, started on first use."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = ReminderScheduler(ReminderStore()).start()
+    return _scheduler
+
+
+def set_reminder_scheduler(scheduler: Optional[ReminderScheduler]):
+    """Install a scheduler; None resets to the default (created again on next use)."""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
+
+
+def run_benchmark(reminders: int = 200_000, heap_size: int = 1_000_000):
+    """Insert and fire throughput through SQLite and the heap, and heap cost at a million pending."""
+    import random
+    import tempfile
+
+    rng = random.Random(7)
+    now = time.time()
+    with tempfile.TemporaryDirectory() as directory:
+        scheduler = ReminderScheduler(ReminderStore(os.path.join(directory, "reminders.db")), clock=lambda: now)
+        rows = [(f"session-{i % 1000}", f"task {i}", now + rng.uniform(1, 86400)) for i in range(reminders)]
+        start = time.perf_counter()
+        for offset in range(0, reminders, 10_000):
+            scheduler.schedule_many(rows[offset:offset + 10_000])
+        insert_s = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(1000):
+            scheduler.schedule("single task", now + rng.uniform(1, 86400), session_id="session-single")
+        single_s = time.perf_counter() - start
+        for reminder in scheduler.list("session-1")[:50]:
+            scheduler.cancel(reminder.id, "session-1")
+        start = time.perf_counter()
+        fired = scheduler.fire_due(now + 86401)
+        fire_s = time.perf_counter() - start
+        scheduler.store.close()
+    print(f"insert (batched) : {reminders / insert_s:>12,.0f} reminders/s")
+    print(f"insert (one each): {1000 / single_s:>12,.0f} reminders/s (one transaction per reminder)")
+    print(f"fire             : {fired / fire_s:>12,.0f} reminders/s ({fired:,} fired, 50 cancelled skipped)")
+
+    heap = [(now + rng.uniform(1, 86400 * 365), i) for i in range(heap_size)]
+    heapq.heapify(heap)
+    start = time.perf_counter()
+    for i in range(100_000):
+        heapq.heappush(heap, (now + rng.uniform(1, 86400 * 365), heap_size + i))
+    push_us = 1e6 * (time.perf_counter() - start) / 100_000
+    start = time.perf_counter()
+    for _ in range(100_000):
+        heapq.heappop(heap)
+    pop_us = 1e6 * (time.perf_counter() - start) / 100_000
+    print(f"heap at {heap_size:,} pending: push {push_us:.2f} us, pop {pop_us:.2f} us")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+Luna's resilience layer for upstream calls (Gemini, ElevenLabs).
+A turn gets one deadline, carried in a context variable, and every stage's timeout is cut
+to what is left of it. Each upstream has a policy: a per-attempt timeout, jittered
+exponential retries for transient errors, an optional hedged duplicate once an attempt runs
+past a latency percentile, and a circuit breaker that fails fast while the upstream is down,
+so callers can degrade (e.g. to a text-only reply) instead of waiting.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Iterator, Optional
+
+from luna_trace import get_tracer
+
+DEFAULT_TURN_DEADLINE = float(os.getenv("LUNA_TURN_DEADLINE", "75"))
+HEDGE_MIN_SAMPLES = 20  # latencies needed before the percentile means anything
+_START_POLL = 0.05  # how often a queued attempt is checked for having started
+
+# Per upstream: attempt timeout, attempts, breaker threshold/cool-down, hedge percentile (None = off)
+DEFAULT_POLICIES: Dict[str, Dict[str, Any]] = {
+    "llm": {"timeout": float(os.getenv("LUNA_LLM_TIMEOUT", "30")), "attempts": 3, "failure_threshold": 5,
+            "reset_timeout": 30.0, "hedge_percentile": float(os.getenv("LUNA_LLM_HEDGE", "0")) or None},
+    "tts": {"timeout": float(os.getenv("LUNA_TTS_TIMEOUT", "15")), "attempts": 2, "failure_threshold": 3,
+            "reset_timeout": 60.0, "hedge_percentile": float(os.getenv("LUNA_TTS_HEDGE", "0")) or None},
+}
+
+# Errors that another attempt won't fix.
+PERMANENT_ERROR_MARKERS = ("invalid_api_key", "401", "403", "quota_exceeded", "not found", "permission")
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The turn's deadline ran out before the call could finish."""
+
+
+class UpstreamTimeout(TimeoutError):
+    """One attempt ran past the policy's timeout."""
+
+
+class QueueTimeout(DeadlineExceeded):
+    """The turn's deadline ran out before the call left the queue; the upstream is not to blame."""
+
+
+class CircuitOpenError(RuntimeError):
+    """The upstream's circuit breaker is open; the call was not attempted."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} is unavailable (circuit open, retrying in {retry_in:.0f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class Deadline:
+    """A point in time a turn must finish by."""
+
+    __slots__ = ("expires_at",)
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def cap(self, timeout: Optional[float]) -> float:
+        """`timeout` cut to the time left (None means no timeout of its own)."""
+        remaining = self.remaining()
+        return remaining if timeout is None else min(timeout, remaining)
+
+
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("luna_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def remaining_time(timeout: Optional[float] = None) -> Optional[float]:
+    """`timeout` cut to the current deadline; unchanged when there is none."""
+    deadline = _current_deadline.get()
+    return timeout if deadline is None else deadline.cap(timeout)
+
+
+@contextmanager
+def deadline_scope(seconds: float = DEFAULT_TURN_DEADLINE) -> Iterator[Deadline]:
+    """
+    Run the block under a deadline `seconds` from now. A nested scope never extends an outer
+    one. Threads and tasks started with a copy of the context (asyncio, luna_pipeline) inherit it.
+    """
+    deadline = Deadline(seconds)
+    outer = _current_deadline.get()
+    if outer is not None and outer.expires_at < deadline.expires_at:
+        deadline = outer
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for `reset_timeout`
+    seconds; then lets one trial call through (half-open) and closes again if it succeeds.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.trips = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_running = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_in(self) -> float:
+        with self._lock:
+            return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info("%s circuit closed again", self.name)
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.trips += 1
+                    logger.warning("%s circuit open after %d failures; failing fast for %.0fs",
+                                   self.name, self.failures, self.reset_timeout)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._trial_running = False
+
+
+class LatencyTracker:
+    """Recent successful call latencies, for the hedging percentile."""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Timeouts and transient upstream errors are; bad keys, exhausted quota and deadlines aren't."""
+    if isinstance(error, (DeadlineExceeded, CircuitOpenError)):
+        return False
+    if isinstance(error, UpstreamTimeout):
+        return True
+    message = str(error).lower()
+    return not any(marker in message for marker in PERMANENT_ERROR_MARKERS)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _attempt_executor() -> ThreadPoolExecutor:
+    """Threads for call() attempts; a stalled attempt keeps its thread until the upstream answers."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=int(os.getenv("LUNA_RESILIENCE_WORKERS", "32")),
+                                               thread_name_prefix="luna-upstream")
+    return _executor
+
+
+def _started_at(future: Future) -> Optional[float]:
+    """When a call's worker picked it up (its `started_at` stamp), or None while it is queued."""
+    started_at = getattr(future, "started_at", None)
+    if started_at is None and (future.running() or future.done()):
+        started_at = future.started_at = time.monotonic()  # a future nobody stamped
+    return started_at
+
+
+def run_future(future: Future, func: Callable[..., Any], /, *args, **kwargs):
+    """Run func into a Future made by hand, stamping `started_at` when the work begins."""
+    if not future.set_running_or_notify_cancel():
+        return
+    future.started_at = time.monotonic()
+    try:
+        future.set_result(func(*args, **kwargs))
+    except BaseException as e:
+        future.set_exception(e)
+
+
+class ResiliencePolicy:
+    """
+    How calls to one upstream are made.
+
+    `timeout` bounds each attempt from when it starts running, not while it is still queued
+    (and is cut to the turn's deadline); transient failures are retried up to `attempts` times
+    in all, sleeping a full-jitter exponential backoff between tries. With `hedge_percentile` (e.g. 0.95), an attempt still running after that percentile
+    of recent latencies gets one duplicate, and whichever answers first wins.
+    """
+
+    def __init__(self, name: str, timeout: Optional[float] = 30.0, attempts: int = 3,
+                 base_delay: float = 0.2, max_delay: float = 2.0, hedge_percentile: Optional[float] = None,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 retryable: Callable[[BaseException], bool] = is_retryable):
+        self.name = name
+        self.timeout = timeout
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_percentile = hedge_percentile
+        self.retryable = retryable
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.latencies = LatencyTracker()
+        self._rng = random.Random()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, amount in increments.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential delay before retrying after failed attempt number `attempt` (from 0)."""
+        return self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def admit(self):
+        """Raise CircuitOpenError unless the breaker lets a call through."""
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.name, self.breaker.retry_in())
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """func(*args, **kwargs) under this policy, each attempt on a worker thread."""
+        def start(shared: bool) -> Future:
+            future: Future = Future()
+            context = contextvars.copy_context()
+            _attempt_executor().submit(context.run, run_future, future, func, *args, **kwargs)
+            return future
+
+        return self.run(start)
+
+    def run(self, start: Callable[[bool], Future]) -> Any:
+        """
+        Like call(), for work that is already asynchronous: start(shared) begins one attempt
+        and returns its Future, which should carry a `started_at` stamp (time.monotonic()) once
+        a worker picks it up. `shared` is True only for the first attempt, so retries and
+        hedges are never merged with it by a coalescing dispatcher.
+        """
+        self.admit()
+        self._count(calls=1)
+        deadline = current_deadline()
+        with get_tracer().span("resilience", upstream=self.name) as span:
+            for attempt in range(self.attempts):
+                try:
+                    result = self._attempt(start, attempt == 0, deadline)
+                except Exception as e:
+                    if not isinstance(e, QueueTimeout):
+                        self.breaker.record_failure()
+                    last = attempt == self.attempts - 1
+                    delay = self.backoff(attempt)
+                    if last or not self.retryable(e) or (deadline is not None and deadline.remaining() <= delay):
+                        self._count(failures=1)
+                        span.set(attempts=attempt + 1, error=type(e).__name__)
+                        raise
+                    logger.info("%s attempt %d failed (%s); retrying in %.2fs", self.name, attempt + 1, e, delay)
+                    self._count(retries=1)
+                    time.sleep(delay)
+                    if not self.breaker.allow():
+                        raise CircuitOpenError(self.name, self.breaker.retry_in()) from e
+                    continue
+                self.breaker.record_success()
+                span.set(attempts=attempt + 1)
+                return result
+
+    def _attempt(self, start: Callable[[bool], Future], shared: bool, deadline: Optional[Deadline]) -> Any:
+        # The timeout and the hedging clock run from when the call leaves the queue: time spent
+        # waiting for a dispatcher worker or the rate limit says nothing about the upstream.
+        if self.timeout is not None and deadline is not None and deadline.expired:
+            raise DeadlineExceeded(f"no time left for {self.name}")
+        hedge_delay = self.latencies.percentile(self.hedge_percentile) if self.hedge_percentile else None
+        primary = start(shared)
+        running = [primary]
+        unshared = [] if shared else [primary]  # ours alone to cancel when abandoned
+        hedged = False
+        error: Optional[BaseException] = None
+        while running:
+            now = time.monotonic()
+            began = _started_at(primary)
+            if began is None:
+                # Still queued: only the turn's deadline applies; look again shortly.
+                ends = None if deadline is None else deadline.expires_at
+                waits = [_START_POLL]
+            else:
+                ends = None if self.timeout is None else began + self.timeout
+                if deadline is not None:
+                    ends = deadline.expires_at if ends is None else min(ends, deadline.expires_at)
+                waits = [began + hedge_delay - now] if hedge_delay is not None and not hedged else []
+            if ends is not None:
+                waits.append(ends - now)
+            done, _ = wait(running, timeout=max(0.0, min(waits)) if waits else None, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future in done:
+                running.remove(future)
+                if future.exception() is None:
+                    self.latencies.add(now - (_started_at(future) or now))
+                    if future is not primary:
+                        self._count(hedge_wins=1)
+                    return future.result()
+                error = future.exception()
+            if not running:
+                break
+            if ends is not None and now >= ends:
+                for future in unshared:
+                    future.cancel()  # only stops it if it hasn't started
+                if began is None:
+                    raise QueueTimeout(f"{self.name} call was still queued at the turn deadline")
+                self._count(timeouts=1)
+                if deadline is not None and deadline.remaining() <= 0:
+                    raise DeadlineExceeded(f"{self.name} ran past the turn deadline")
+                raise UpstreamTimeout(f"{self.name} did not answer within {self.timeout:.1f}s")
+            if began is not None and hedge_delay is not None and not hedged and now >= began + hedge_delay:
+                hedged = True
+                self._count(hedges=1)
+                running.append(start(False))
+                unshared.append(running[-1])
+        raise error  # type: ignore[misc]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "timeouts": self.timeouts,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "failures": self.failures,
+                "circuit": self.breaker.state,
+                "circuit_trips": self.breaker.trips,
+                "rejected": self.breaker.rejected,
+            }
+
+
+_policies: Dict[str, ResiliencePolicy] = {}
+_policies_lock = threading.Lock()
+
+
+def get_policy(name: str) -> ResiliencePolicy:
+    """Process-wide policy for an upstream ("llm", "tts"), from DEFAULT_POLICIES."""
+    policy = _policies.get(name)
+    if policy is None:
+        with _policies_lock:
+            policy = _policies.get(name)
+            if policy is None:
+                policy = _policies[name] = ResiliencePolicy(name, **DEFAULT_POLICIES.get(name, {}))
+    return policy
+
+
+def set_policy(name: str, policy: Optional[ResiliencePolicy]):
+    """Install a policy for an upstream; None resets it to the default."""
+    with _policies_lock:
+        if policy is None:
+            _policies.pop(name, None)
+        else:
+            _policies[name] = policy
+
+
+def run_benchmark(calls: int = 200, latency: float = 0.03, stall_rate: float = 0.03, stall_latency: float = 1.5,
+                  failure_rate: float = 0.05):
+    """
+    TTS on a fault-injecting fake (stalls and failures): tail latency and failed turns without
+    a policy, with timeout + retries, and with hedging too; then an ElevenLabs outage with
+    and without the circuit breaker, and an LLM stall cut short by the turn deadline.
+    """
+    import tempfile
+    from luna_bench import percentiles
+    from luna_fakes import FakeChatModel, FakeTTSClient
+    from luna_tts import AudioStore, synthesize_audio
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = AudioStore(directory)
+
+        def scenario(label: str, policy: Optional[ResiliencePolicy], run: int):
+            client = FakeTTSClient(latency=latency, stall_rate=stall_rate, stall_latency=stall_latency,
+                                   failure_rate=failure_rate, seed=7)
+            latencies, failed = [], 0
+            for n in range(calls):
+                text = f"Kyaa~! Line {n} of run {run}, Master!"
+                start = time.perf_counter()
+                try:
+                    if policy is None:
+                        synthesize_audio(client, text, store)
+                    else:
+                        policy.call(synthesize_audio, client, text, store)
+                except Exception:
+                    failed += 1
+                latencies.append(time.perf_counter() - start)
+            summary = percentiles(latencies)
+            extra = ""
+            if policy is not None:
+                stats = policy.stats()
+                extra = f"; {stats['retries']} retries, {stats['hedges']} hedges ({stats['hedge_wins']} won)"
+            print(f"{label:<28}: p50 {summary['p50_ms']:6.0f} ms, p95 {summary['p95_ms']:6.0f} ms, "
+                  f"p99 {summary['p99_ms']:6.0f} ms, {failed}/{calls} failed, {client.calls} upstream calls{extra}")
+
+        print(f"TTS fake: {latency * 1000:.0f} ms, {stall_rate:.0%} of calls stall {stall_latency:.1f}s, "
+              f"{failure_rate:.0%} fail")
+        scenario("no policy", None, 0)
+        scenario("timeout 0.2s + 3 attempts", ResiliencePolicy("tts", timeout=0.2, attempts=3, base_delay=0.01,
+                                                               failure_threshold=calls), 1)
+        scenario("... + hedge at p90", ResiliencePolicy("tts", timeout=0.2, attempts=3, base_delay=0.01,
+                                                        hedge_percentile=0.9, failure_threshold=calls), 2)
+
+        turns = 40
+        for label, threshold in (("TTS down, no breaker", turns * 10), ("TTS down, breaker", 3)):
+            client = FakeTTSClient(latency=0.2, failure_rate=1.0)
+            policy = ResiliencePolicy("tts", timeout=1.0, attempts=2, base_delay=0.01, failure_threshold=threshold)
+            start = time.perf_counter()
+            text_only = 0
+            for n in range(turns):
+                try:
+                    policy.call(synthesize_audio, client, f"Outage line {n}", store)
+                except Exception:
+                    text_only += 1
+            elapsed = time.perf_counter() - start
+            print(f"{label:<28}: {1000 * elapsed / turns:6.0f} ms of TTS per turn, {text_only}/{turns} text-only, "
+                  f"{client.calls} upstream calls")
+
+    llm = FakeChatModel(["too late"], latency=5.0)
+    policy = ResiliencePolicy("llm", timeout=30.0)
+    start = time.perf_counter()
+    with deadline_scope(1.0):
+        try:
+            policy.call(llm.invoke, "a question that stalls")
+        except DeadlineExceeded as e:
+            print(f"{'LLM stalls 5s, 1s deadline':<28}: gave up after {time.perf_counter() - start:.2f}s ({e})")
+
+
+if __name__ == "__main__":
+    run_benchmark()
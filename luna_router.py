@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Luna's deterministic intent router.
+Sits between the AIML rules and the ReAct agent: when a message is obviously a calculator,
+translation or reminder request, the arguments are extracted with patterns and the tool is
+called directly, skipping the agent's LLM round trips. Anything below the confidence
+threshold falls through to the agent unchanged.
+"""
+
+import re
+import random
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from luna_calc import CalcError, compile_expression, normalize_expression
+from luna_trace import get_tracer
+
+logger = logging.getLogger(__name__)
+
+# A ReAct turn needs at least one LLM call to pick the tool and one to write the Final Answer.
+REACT_MIN_LLM_CALLS = 2
+DEFAULT_CONFIDENCE_THRESHOLD = 0.8
+
+KNOWN_LANGUAGES = {
+    "english", "french", "spanish", "german", "italian", "portuguese", "japanese", "chinese",
+    "mandarin", "cantonese", "korean", "russian", "arabic", "hindi", "bengali", "dutch", "swedish",
+    "norwegian", "danish", "finnish", "polish", "turkish", "greek", "hebrew", "thai", "vietnamese",
+    "indonesian", "malay", "filipino", "tagalog", "ukrainian", "czech", "romanian", "hungarian",
+    "swahili", "urdu", "persian", "farsi", "latin",
+}
+
+_WORD_OPERATORS = [
+    (r'\bdivided by\b', '/'), (r'\bmultiplied by\b', '*'), (r'\btimes\b', '*'), (r'\bplus\b', '+'),
+    (r'\bminus\b', '-'), (r'\bto the power of\b', '**'), (r'\bmod(ulo)?\b', '%'), (r'\bx\b', '*'),
+]
+
+_CALC_PREFIX = re.compile(
+    r"^(?:hey luna[,!]?\s*)?(?:what(?:'s| is)|calculate|compute|solve|evaluate|how much is|can you (?:calculate|compute|solve))\s+(.+?)\s*[?=!.]*$",
+    re.IGNORECASE,
+)
+_BARE_MATH = re.compile(r"^[\d\s\.\+\-\*/\^%\(\)]+$")
+_TRANSLATE = re.compile(
+    r"^(?:please\s+|can you\s+|could you\s+)?translate\s+[\"'“]?(?P<text>.+?)[\"'”]?\s+(?:in)?to\s+(?P<target>[a-z]+)"
+    r"(?:\s+from\s+(?P<source>[a-z]+))?\s*[?.!]*$",
+    re.IGNORECASE,
+)
+_SAY_IN = re.compile(
+    r"^how (?:do|would) (?:you|i) say\s+[\"'“]?(?P<text>.+?)[\"'”]?\s+in\s+(?P<target>[a-z]+)\s*[?.!]*$",
+    re.IGNORECASE,
+)
+_REMIND = re.compile(
+    r"^(?:please\s+|can you\s+)?remind me to\s+(?P<task>.+?)\s+(?P<time>(?:at|on|in|tomorrow|tonight|today|next|this|every|by)\b.*?)\s*[.!?]*$",
+    re.IGNORECASE,
+)
+
+_PERSONA_INTROS = {
+    "calculator": ["Ooh! That's a job for Calc-kun! ✨", "Hehe! Numbers! Luna's favorite! 🌟"],
+    "language_translator": ["Yay! Translate-kun, it's your turn! 🌈", "Ooh! Languages are so fun! ✨"],
+    "reminder_planner": ["Kyaa~! Memo-chan, take a note! 🗓️", "Hehe! Luna will make sure you don't forget! 💖"],
+}
+
+
+class RouteDecision:
+    """A candidate direct tool call with the router's confidence in it."""
+
+    __slots__ = ("tool", "args", "confidence")
+
+    def __init__(self, tool: str, args: Dict[str, Any], confidence: float):
+        self.tool = tool
+        self.args = args
+        self.confidence = confidence
+
+
+def _detect_calculator(text: str) -> Optional[RouteDecision]:
+    match = _CALC_PREFIX.match(text)
+    candidate = match.group(1) if match else text.strip().rstrip("?=!. ")
+    # Without "what is", "calculate" or a trailing "=", digits and dashes may be a phone number or a date
+    asks_for_result = bool(match) or text.strip().rstrip("?!. ").endswith("=")
+    confidence = 0.95 if asks_for_result else 0.6
+    converted = candidate.lower()
+    for pattern, symbol in _WORD_OPERATORS:
+        converted, count = re.subn(pattern, f" {symbol} ", converted)
+        if count:
+            confidence -= 0.05
+    if not _BARE_MATH.match(converted) or not re.search(r'\d', converted) or not re.search(r'[\+\-\*/\^%]', converted):
+        return None
+    try:
+        compile_expression(normalize_expression(converted))
+    except CalcError:
+        return None
+    return RouteDecision("calculator", {"expression": " ".join(converted.split())}, confidence)
+
+
+def _detect_translation(text: str) -> Optional[RouteDecision]:
+    match = _TRANSLATE.match(text.strip()) or _SAY_IN.match(text.strip())
+    if not match:
+        return None
+    target = match.group("target").lower()
+    source = (match.groupdict().get("source") or "english").lower()
+    known = target in KNOWN_LANGUAGES and source in KNOWN_LANGUAGES
+    args = {"text": match.group("text"), "target_language": target.capitalize(),
+            "source_language": source.capitalize()}
+    return RouteDecision("language_translator", args, 0.9 if known else 0.5)
+
+
+def _detect_reminder(text: str) -> Optional[RouteDecision]:
+    match = _REMIND.match(text.strip())
+    if not match:
+        return None
+    return RouteDecision("reminder_planner",
+                         {"task_description": match.group("task"), "time_or_date": match.group("time")}, 0.85)
+
+
+DETECTORS: List[Callable[[str], Optional[RouteDecision]]] = [
+    _detect_calculator, _detect_translation, _detect_reminder,
+]
+
+
+class IntentRouter:
+    """
+    Fast path for obvious tool calls.
+
+    `tools` maps tool names to LangChain tools (anything with invoke(dict)) or plain callables,
+    which should raise when they fail rather than return an apology.
+    route() returns Luna's reply, or None when the agent should handle the message.
+    """
+
+    def __init__(self, tools: Dict[str, Any], threshold: float = DEFAULT_CONFIDENCE_THRESHOLD,
+                 detectors: Optional[List[Callable[[str], Optional[RouteDecision]]]] = None):
+        self.tools = tools
+        self.threshold = threshold
+        self.detectors = detectors or DETECTORS
+        self._lock = threading.Lock()
+        self.routed: Dict[str, int] = {}
+        self.fallbacks = 0
+        self.llm_calls_saved = 0
+
+    def decide(self, user_input: str) -> Optional[RouteDecision]:
+        """Best confident decision for the message, or None."""
+        best = None
+        for detect in self.detectors:
+            decision = detect(user_input)
+            if decision and decision.tool in self.tools and (best is None or decision.confidence > best.confidence):
+                best = decision
+        return best if best and best.confidence >= self.threshold else None
+
+    def route(self, user_input: str) -> Optional[str]:
+        decision = self.decide(user_input)
+        if decision is None:
+            with self._lock:
+                self.fallbacks += 1
+            return None
+        tool = self.tools[decision.tool]
+        try:
+            with get_tracer().span("router", tool=decision.tool, confidence=decision.confidence):
+                output = tool.invoke(decision.args) if hasattr(tool, "invoke") else tool(**decision.args)
+        except Exception as e:
+            logger.warning("Router call to %s failed, falling back to the agent: %s", decision.tool, e)
+            with self._lock:
+                self.fallbacks += 1
+            return None
+        with self._lock:
+            self.routed[decision.tool] = self.routed.get(decision.tool, 0) + 1
+            self.llm_calls_saved += REACT_MIN_LLM_CALLS
+        intro = random.choice(_PERSONA_INTROS.get(decision.tool, ["Kyaa~! Luna's on it! ✨"]))
+        return f"{intro}\n\n{output}"
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            routed = sum(self.routed.values())
+            total = routed + self.fallbacks
+            return {
+                "routed": routed,
+                "routed_by_tool": dict(self.routed),
+                "fallbacks": self.fallbacks,
+                "route_rate": routed / total if total else 0.0,
+                "llm_calls_saved": self.llm_calls_saved,
+            }
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Luna's compiled rule engine.
+Loads AIML-like rules from a JSON rule file and matches all of them in a single scan
+of the user's message, so the cost per message stays flat as the rule count grows.
+"""
+
+import os
+import re
+import json
+import time
+import random
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "luna_rules.json")
+
+
+def _is_word_char(char: str) -> bool:
+    """Mirror the regex notion of a word character used by \\b."""
+    return char.isalnum() or char == "_"
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over literal keywords.
+    One pass over the text reports every keyword occurrence, independent of keyword count.
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, Any]]] = [[]]
+        self._built = False
+
+    def add(self, keyword: str, value: Any):
+        """Register a keyword with the value reported when it matches."""
+        if not keyword:
+            raise ValueError("Keywords must be non-empty")
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._out[state].append((len(keyword), value))
+        self._built = False
+
+    def build(self):
+        """Compute failure links (breadth-first) and merge output lists."""
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """Yield (start, end, value) for every keyword occurrence in text."""
+        if not self._built:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                for length, value in out[state]:
+                    yield index - length + 1, index + 1, value
+
+
+class Rule:
+    """A single rule: literal phrases and/or a regex pattern, plus canned responses."""
+
+    __slots__ = ("name", "priority", "order", "phrases", "pattern", "responses")
+
+    def __init__(self, name: str, priority: int, order: int, responses: List[str],
+                 phrases: Optional[List[str]] = None, pattern: Optional[str] = None):
+        if not phrases and not pattern:
+            raise ValueError(f"Rule '{name}' needs 'phrases' or 'pattern'")
+        if not responses:
+            raise ValueError(f"Rule '{name}' has no responses")
+        self.name = name
+        self.priority = priority
+        self.order = order
+        self.phrases = [p.lower() for p in (phrases or [])]
+        self.pattern = pattern
+        self.responses = list(responses)
+
+    @property
+    def rank(self) -> Tuple[int, int]:
+        """Lower rank wins: explicit priority first, then position in the rule file."""
+        return (self.priority, self.order)
+
+    def as_regex(self) -> str:
+        """Equivalent regex, kept for callers that still read (pattern, responses) tuples."""
+        if self.pattern:
+            return self.pattern
+        return r'\b(' + '|'.join(re.escape(p) for p in self.phrases) + r')\b'
+
+
+class CompiledRuleEngine:
+    """
+    Matches every rule in one scan while keeping first-match semantics.
+    Literal phrases go into a single keyword automaton with \\b checks at the match edges;
+    regex-only rules are only tried when they could outrank the best literal hit.
+    """
+
+    def __init__(self, rules: List[Rule]):
+        self.rules = sorted(rules, key=lambda r: r.rank)
+        self._automaton = KeywordAutomaton()
+        self._regex_rules: List[Tuple[Rule, "re.Pattern"]] = []
+        for rule in self.rules:
+            for phrase in rule.phrases:
+                self._automaton.add(phrase, rule)
+            if rule.pattern:
+                self._regex_rules.append((rule, re.compile(rule.pattern, re.IGNORECASE)))
+        self._automaton.build()
+        self._top_rank = self.rules[0].rank if self.rules else None
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_RULES_FILE) -> "CompiledRuleEngine":
+        """Load rules from a JSON rule file ({"rules": [{name, priority, phrases|pattern, responses}]})."""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls.from_dicts(data.get("rules", []))
+
+    @classmethod
+    def from_dicts(cls, rule_dicts: List[Dict[str, Any]]) -> "CompiledRuleEngine":
+        rules = [
+            Rule(
+                name=d.get("name", f"rule_{i}"),
+                priority=int(d.get("priority", 100)),
+                order=i,
+                responses=d.get("responses", []),
+                phrases=d.get("phrases"),
+                pattern=d.get("pattern"),
+            )
+            for i, d in enumerate(rule_dicts)
+        ]
+        return cls(rules)
+
+    def match(self, text: str) -> Optional[Rule]:
+        """Return the highest-ranked rule matching text, or None."""
+        text = text.lower().strip()
+        best: Optional[Rule] = None
+        for start, end, rule in self._automaton.iter_matches(text):
+            if best is not None and rule.rank >= best.rank:
+                continue
+            before = _is_word_char(text[start - 1]) if start > 0 else False
+            after = _is_word_char(text[end]) if end < len(text) else False
+            if before == _is_word_char(text[start]) or after == _is_word_char(text[end - 1]):
+                continue
+            best = rule
+            if rule.rank == self._top_rank:
+                return best
+        for rule, regex in self._regex_rules:
+            if best is not None and rule.rank >= best.rank:
+                break
+            if regex.search(text):
+                return rule
+        return best
+
+    def respond(self, text: str) -> Optional[str]:
+        """Return a random canned response from the matching rule, or None."""
+        rule = self.match(text)
+        return random.choice(rule.responses) if rule else None
+
+    # Same interface as LunaAIMLEngine, so the engine can stand in for it directly
+    process = respond
+
+
+def _naive_match(patterns: List[Tuple[str, List[str]]], text: str) -> Optional[List[str]]:
+    """The original per-rule re.search loop, kept for benchmarking."""
+    text = text.lower().strip()
+    for pattern, responses in patterns:
+        if re.search(pattern, text, re.IGNORECASE):
+            return responses
+    return None
+
+
+def run_benchmark(rule_counts=(6, 50, 500, 5000), repeats: int = 2000):
+    """Compare per-message matching cost of the compiled engine vs the naive loop."""
+    rng = random.Random(42)
+    alphabet = "abcdefghijklmnopqrstuvwxyz"
+    messages = [
+        "can you help me plan a trip to kyoto next spring",
+        "what is the capital of france and why is it famous",
+        "write me a short poem about the moon and the stars",
+        "hello luna, how are you doing today?",
+    ]
+    print(f"{'rules':>6} | {'compiled us/msg':>16} | {'naive us/msg':>13}")
+    print("-" * 42)
+    for count in rule_counts:
+        rule_dicts = []
+        for i in range(count):
+            words = [''.join(rng.choice(alphabet) for _ in range(rng.randint(4, 9))) for _ in range(2)]
+            rule_dicts.append({"name": f"r{i}", "priority": i, "phrases": [' '.join(words)],
+                               "responses": [f"response {i}"]})
+        rule_dicts.append({"name": "greeting", "priority": count, "phrases": ["hello"], "responses": ["hi"]})
+        engine = CompiledRuleEngine.from_dicts(rule_dicts)
+        patterns = [(rule.as_regex(), rule.responses) for rule in engine.rules]
+
+        start = time.perf_counter()
+        for i in range(repeats):
+            engine.match(messages[i % len(messages)])
+        compiled_us = (time.perf_counter() - start) / repeats * 1e6
+
+        naive_repeats = max(20, repeats * 6 // (count + 6))
+        start = time.perf_counter()
+        for i in range(naive_repeats):
+            _naive_match(patterns, messages[i % len(messages)])
+        naive_us = (time.perf_counter() - start) / naive_repeats * 1e6
+
+        print(f"{count:>6} | {compiled_us:>16.1f} | {naive_us:>13.1f}")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+"""
+Luna's search backends (Search-chan).
+The local engine keeps an inverted index with BM25 ranking over a document corpus on disk.
+The index is a list of immutable segments, so new or changed corpus files are indexed
+incrementally into a fresh segment (the documents they replace are tombstoned). Each segment's
+lexicon and posting lists are flat binary arrays read through mmap, so opening an index costs
+a few file opens however large it is. Query results are kept in a small LRU until the next commit.
+"""
+
+import os
+import re
+import json
+import math
+import mmap
+import time
+import heapq
+import shutil
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from luna_trace import get_tracer
+
+DEFAULT_INDEX_DIR = os.getenv("LUNA_SEARCH_INDEX", "search_index_luna/")
+DEFAULT_CORPUS_DIR = os.getenv("LUNA_SEARCH_CORPUS", "search_corpus/")
+DEFAULT_QUERY_CACHE_SIZE = int(os.getenv("LUNA_SEARCH_CACHE_SIZE", "512"))
+MAX_SEGMENTS = 8  # more than this after a commit and the segments are merged into one
+BM25_K1 = 1.2
+BM25_B = 0.75
+CORPUS_EXTENSIONS = (".txt", ".md", ".jsonl")
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his how i in is it its of on or she that the "
+    "their them they this to was were what when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords, for documents and queries alike."""
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class SearchResult:
+    """One ranked hit."""
+
+    __slots__ = ("doc_id", "title", "snippet", "score", "url")
+
+    def __init__(self, doc_id: str, title: str, snippet: str, score: float, url: Optional[str] = None):
+        self.doc_id = doc_id
+        self.title = title
+        self.snippet = snippet
+        self.score = score
+        self.url = url
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"doc_id": self.doc_id, "title": self.title, "snippet": self.snippet,
+                "score": round(self.score, 4), "url": self.url}
+
+
+class SearchBackend:
+    """What web_search talks to. Other backends (a hosted search API, say) implement search()."""
+
+    def search(self, query: str, limit: int = 3) -> List[SearchResult]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def _snippet(text: str, terms: Set[str], width: int = 240) -> str:
+    """The sentence mentioning the most query terms (the earliest on ties), trimmed to `width`."""
+    sentences = [s for s in re.split(r"(?<=[.!?])\s+|\n\s*\n", text.strip()) if s.strip()] or [""]
+    best = max(sentences, key=lambda sentence: len(terms & set(tokenize(sentence))))
+    best = " ".join(best.split())
+    return best if len(best) <= width else best[:width - 1].rsplit(" ", 1)[0] + "…"
+
+
+# --- Segments ---
+#
+# A segment directory holds:
+#   lexicon.txt   sorted terms, each followed by "\n"
+#   lexicon.idx   int64 byte offset of each term in lexicon.txt, plus the end offset
+#   lexicon.post  int64 start of each term's postings, plus the end (df = next - start)
+#   postings.doc  uint32 segment-local document numbers, ascending within each term
+#   postings.tf   uint32 term frequencies, parallel to postings.doc
+#   doclens       uint32 token count of each document
+#   docs.jsonl    one {"id", "title", "url", "text", "source"} object per document
+#   docs.idx      int64 byte offset of each document in docs.jsonl, plus the end offset
+#   meta.json     {"docs": n, "total_length": tokens}
+
+class _Segment:
+    """Read-only view of one segment through mmap."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.docs = meta["docs"]
+        self.total_length = meta["total_length"]
+        self._maps: List[mmap.mmap] = []
+        self._terms = self._map("lexicon.txt")
+        self._term_offsets = self._view("lexicon.idx", "q")
+        self._postings_start = self._view("lexicon.post", "q")
+        self._doc_numbers = self._view("postings.doc", "I")
+        self._frequencies = self._view("postings.tf", "I")
+        self.doc_lengths = self._view("doclens", "I")
+        self._doc_offsets = self._view("docs.idx", "q")
+        self.term_count = len(self._term_offsets) - 1
+
+    def _map(self, name: str):
+        with open(os.path.join(self.path, name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"")
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return memoryview(mapped)
+
+    def _view(self, name: str, typecode: str) -> memoryview:
+        return self._map(name).cast(typecode)
+
+    def _term(self, index: int) -> bytes:
+        return bytes(self._terms[self._term_offsets[index]:self._term_offsets[index + 1] - 1])
+
+    def postings(self, term: str) -> Optional[Tuple[memoryview, memoryview]]:
+        """(document numbers, frequencies) for the term, found by binary search of the lexicon."""
+        key = term.encode("utf-8")
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.term_count or self._term(low) != key:
+            return None
+        start, end = self._postings_start[low], self._postings_start[low + 1]
+        return self._doc_numbers[start:end], self._frequencies[start:end]
+
+    def document(self, number: int) -> Dict[str, Any]:
+        start, end = self._doc_offsets[number], self._doc_offsets[number + 1]
+        with open(os.path.join(self.path, "docs.jsonl"), "rb") as f:
+            f.seek(start)
+            return json.loads(f.read(end - start))
+
+    def close(self):
+        try:
+            for view in (self._terms, self._term_offsets, self._postings_start, self._doc_numbers,
+                         self._frequencies, self.doc_lengths, self._doc_offsets):
+                view.release()
+            for mapped in self._maps:
+                mapped.close()
+        except BufferError:
+            pass  # a caller still holds a posting slice; the maps go with the last reference
+        self._maps = []
+
+
+def _write_segment(path: str, documents: List[Dict[str, Any]]):
+    """Build a segment from documents (dicts with id, title, url, text, source)."""
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    lengths = array("I")
+    doc_offsets = array("q", [0])
+    os.makedirs(path)
+    with open(os.path.join(path, "docs.jsonl"), "wb") as docs_file:
+        for number, document in enumerate(documents):
+            tokens = tokenize(f"{document.get('title', '')}\n{document['text']}")
+            lengths.append(len(tokens))
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, []).append((number, count))
+            line = json.dumps(document, ensure_ascii=False).encode("utf-8") + b"\n"
+            docs_file.write(line)
+            doc_offsets.append(doc_offsets[-1] + len(line))
+
+    term_offsets, postings_start = array("q", [0]), array("q", [0])
+    doc_numbers, frequencies = array("I"), array("I")
+    with open(os.path.join(path, "lexicon.txt"), "wb") as lexicon:
+        for term in sorted(postings, key=lambda t: t.encode("utf-8")):
+            encoded = term.encode("utf-8") + b"\n"
+            lexicon.write(encoded)
+            term_offsets.append(term_offsets[-1] + len(encoded))
+            for number, count in postings[term]:
+                doc_numbers.append(number)
+                frequencies.append(count)
+            postings_start.append(len(doc_numbers))
+    for name, values in (("lexicon.idx", term_offsets), ("lexicon.post", postings_start),
+                         ("postings.doc", doc_numbers), ("postings.tf", frequencies),
+                         ("doclens", lengths), ("docs.idx", doc_offsets)):
+        with open(os.path.join(path, name), "wb") as f:
+            values.tofile(f)
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"docs": len(documents), "total_length": sum(lengths)}, f)
+
+
+def _read_corpus_file(path: str) -> List[Dict[str, Any]]:
+    """Documents in one corpus file: a JSON-lines file holds many, a text file is one."""
+    documents = []
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f):
+                if line.strip():
+                    record = json.loads(line)
+                    documents.append({"id": str(record.get("id", f"{path}#{number}")),
+                                      "title": record.get("title", ""), "url": record.get("url"),
+                                      "text": record.get("text", "")})
+    else:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        title, _, body = text.strip().partition("\n")
+        documents.append({"id": path, "title": title.lstrip("# ").strip(), "url": None, "text": body.strip()})
+    return documents
+
+
+class LocalSearchEngine(SearchBackend):
+    """
+    BM25 search over a segmented on-disk index.
+
+    Documents belong to a *source* (a corpus file, or any name the caller picks); indexing a
+    source again replaces its documents. add_source() buffers, commit() writes one new segment
+    and publishes it, index_corpus() re-indexes only the corpus files that changed.
+    """
+
+    def __init__(self, index_dir: str = DEFAULT_INDEX_DIR, cache_size: int = DEFAULT_QUERY_CACHE_SIZE,
+                 max_segments: int = MAX_SEGMENTS):
+        self.index_dir = index_dir
+        self.cache_size = cache_size
+        self.max_segments = max_segments
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[str, Dict[str, Any], List[Dict[str, Any]]]] = []
+        self._cache: "OrderedDict[Tuple[Tuple[str, ...], int], List[SearchResult]]" = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        os.makedirs(index_dir, exist_ok=True)
+        self._manifest = self._load_manifest()
+        self._segments = [_Segment(os.path.join(index_dir, name)) for name in self._manifest["segments"]]
+        self._deleted = self._expand_deleted()
+
+    # -- manifest --
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        path = os.path.join(self.index_dir, "manifest.json")
+        if not os.path.exists(path):
+            return {"segments": [], "next_segment": 1, "sources": {}, "deleted": {}}
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest: Dict[str, Any]):
+        path = os.path.join(self.index_dir, "manifest.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def _expand_deleted(self) -> Dict[str, Set[int]]:
+        return {segment: {number for start, count in ranges for number in range(start, start + count)}
+                for segment, ranges in self._manifest["deleted"].items()}
+
+    # -- indexing --
+
+    def add_source(self, source: str, documents: Iterable[Dict[str, Any]], **source_info):
+        """Queue a source's documents (dicts with text and optional id, title, url) for the next commit."""
+        docs = [{"id": str(document.get("id", f"{source}#{number}")), "title": document.get("title", ""),
+                 "url": document.get("url"), "text": document.get("text", ""), "source": source}
+                for number, document in enumerate(documents)]
+        with self._lock:
+            self._pending.append((source, source_info, docs))
+
+    def remove_source(self, source: str):
+        """Queue removal of a source's documents."""
+        with self._lock:
+            self._pending.append((source, {}, []))
+
+    def commit(self) -> int:
+        """Write queued sources as one new segment and publish it; returns documents indexed."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            manifest = json.loads(json.dumps(self._manifest))
+            documents: List[Dict[str, Any]] = []
+            name = f"seg_{manifest['next_segment']:06d}"
+            for source, info, docs in pending:
+                self._tombstone(manifest, source)
+                if docs:
+                    manifest["sources"][source] = dict(info, segment=name, start=len(documents), count=len(docs))
+                    documents.extend(docs)
+            if documents:
+                with get_tracer().span("search.index", documents=len(documents)):
+                    _write_segment(os.path.join(self.index_dir, name), documents)
+                manifest["segments"].append(name)
+                manifest["next_segment"] += 1
+            # Segments whose documents have all been replaced or removed are dropped outright
+            live = {info["segment"] for info in manifest["sources"].values()}
+            dropped = [segment for segment in manifest["segments"] if segment not in live]
+            manifest["segments"] = [segment for segment in manifest["segments"] if segment in live]
+            for segment in dropped:
+                manifest["deleted"].pop(segment, None)
+            self._publish(manifest)
+            self._remove_segments(dropped)
+            if len(manifest["segments"]) > self.max_segments:
+                self._merge()
+        return len(documents)
+
+    @staticmethod
+    def _tombstone(manifest: Dict[str, Any], source: str):
+        old = manifest["sources"].pop(source, None)
+        if old is not None:
+            manifest["deleted"].setdefault(old["segment"], []).append([old["start"], old["count"]])
+
+    def _publish(self, manifest: Dict[str, Any]):
+        # Called with the lock held: persist, then swap in the new segment list.
+        self._save_manifest(manifest)
+        known = {segment.name: segment for segment in self._segments}
+        self._segments = [known.get(name) or _Segment(os.path.join(self.index_dir, name))
+                          for name in manifest["segments"]]
+        self._manifest = manifest
+        self._deleted = self._expand_deleted()
+        self._cache.clear()
+
+    def _merge(self):
+        """Rewrite all live documents as one segment, dropping tombstones (lock held)."""
+        manifest = json.loads(json.dumps(self._manifest))
+        segments = {segment.name: segment for segment in self._segments}
+        name = f"seg_{manifest['next_segment']:06d}"
+        documents: List[Dict[str, Any]] = []
+        for source, info in manifest["sources"].items():
+            segment = segments[info["segment"]]
+            start = len(documents)
+            documents.extend(segment.document(number) for number in range(info["start"], info["start"] + info["count"]))
+            info.update(segment=name, start=start)
+        old_names = manifest["segments"]
+        with get_tracer().span("search.merge", documents=len(documents), segments=len(old_names)):
+            _write_segment(os.path.join(self.index_dir, name), documents)
+        manifest.update(segments=[name], next_segment=manifest["next_segment"] + 1, deleted={})
+        self._publish(manifest)
+        self._remove_segments(old_names)
+
+    def _remove_segments(self, names: List[str]):
+        # Searches already running may still read these segments; their maps are released
+        # when the last reference goes, and unlinking mapped files is fine meanwhile.
+        for name in names:
+            shutil.rmtree(os.path.join(self.index_dir, name), ignore_errors=True)
+
+    def index_corpus(self, corpus_dir: str = DEFAULT_CORPUS_DIR) -> int:
+        """Index new and changed corpus files and drop removed ones; returns documents indexed."""
+        seen: Set[str] = set()
+        with self._lock:
+            known = dict(self._manifest["sources"])
+        for root, _, files in os.walk(corpus_dir):
+            for filename in sorted(files):
+                if not filename.endswith(CORPUS_EXTENSIONS):
+                    continue
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                seen.add(path)
+                info = known.get(path)
+                if info and info.get("mtime") == stat.st_mtime and info.get("size") == stat.st_size:
+                    continue
+                self.add_source(path, _read_corpus_file(path), mtime=stat.st_mtime, size=stat.st_size)
+        for path, info in known.items():
+            if "mtime" in info and path not in seen:
+                self.remove_source(path)
+        return self.commit()
+
+    # -- search --
+
+    def search(self, query: str, limit: int = 3) -> List[SearchResult]:
+        terms = tuple(sorted(set(tokenize(query))))
+        if not terms:
+            return []
+        key = (terms, limit)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached
+            self.cache_misses += 1
+            segments, deleted = self._segments, self._deleted
+        with get_tracer().span("search", terms=len(terms)) as span:
+            results = self._rank(terms, limit, segments, deleted)
+            span.set(results=len(results))
+        with self._lock:
+            if segments is self._segments:  # no commit in between
+                self._cache[key] = results
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return results
+
+    def _rank(self, terms: Tuple[str, ...], limit: int, segments: List[_Segment],
+              deleted: Dict[str, Set[int]]) -> List[SearchResult]:
+        total_docs = sum(segment.docs for segment in segments) - sum(len(numbers) for numbers in deleted.values())
+        if total_docs <= 0:
+            return []
+        average_length = max(1.0, sum(segment.total_length for segment in segments) /
+                             max(1, sum(segment.docs for segment in segments)))
+        found = [(term, index, segment.postings(term)) for term in terms for index, segment in enumerate(segments)]
+        document_frequency: Dict[str, int] = {}
+        for term, _, postings in found:
+            if postings is not None:
+                document_frequency[term] = document_frequency.get(term, 0) + len(postings[0])
+        # BM25: idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / average_length))
+        length_base = BM25_K1 * (1 - BM25_B)
+        length_scale = BM25_K1 * BM25_B / average_length
+        scores: Dict[Tuple[int, int], float] = {}
+        for term, index, postings in found:
+            if postings is None:
+                continue
+            df = document_frequency[term]
+            weight = math.log(1 + (total_docs - df + 0.5) / (df + 0.5)) * (BM25_K1 + 1)
+            lengths = segments[index].doc_lengths
+            skip = deleted.get(segments[index].name, ())
+            for number, frequency in zip(*postings):
+                if number in skip:
+                    continue
+                key = (index, number)
+                scores[key] = scores.get(key, 0.0) + weight * frequency / (
+                    frequency + length_base + length_scale * lengths[number])
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        term_set = set(terms)
+        results = []
+        for (segment_index, number), score in best:
+            document = segments[segment_index].document(number)
+            results.append(SearchResult(document["id"], document["title"], _snippet(document["text"], term_set),
+                                        score, document.get("url")))
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            deleted = sum(len(numbers) for numbers in self._deleted.values())
+            return {"segments": len(self._segments), "documents": sum(s.docs for s in self._segments) - deleted,
+                    "deleted": deleted, "terms": sum(s.term_count for s in self._segments),
+                    "sources": len(self._manifest["sources"]), "cache_hits": self.cache_hits,
+                    "cache_misses": self.cache_misses}
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
+            self._segments = []
+
+
+_backend: Optional[SearchBackend] = None
+_backend_lock = threading.Lock()
+
+
+def _default_backend() -> Optional[SearchBackend]:
+    if not os.path.isdir(DEFAULT_CORPUS_DIR) and not os.path.exists(os.path.join(DEFAULT_INDEX_DIR, "manifest.json")):
+        return None
+    engine = LocalSearchEngine(DEFAULT_INDEX_DIR)
+    if os.path.isdir(DEFAULT_CORPUS_DIR):
+        indexed = engine.index_corpus(DEFAULT_CORPUS_DIR)
+        if indexed:
+            logger.info("Search-chan indexed %d documents from %s", indexed, DEFAULT_CORPUS_DIR)
+    return engine
+
+
+def get_search_backend() -> Optional[SearchBackend]:
+    """
+    Process-wide backend, created on first use: the local engine over LUNA_SEARCH_INDEX, brought
+    up to date with LUNA_SEARCH_CORPUS. None when there is neither a corpus nor an index.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _default_backend()
+    return _backend
+
+
+def set_search_backend(backend: Optional[SearchBackend]):
+    """Install a backend; None resets to the default (created again on next use)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def synthetic_corpus(documents: int, seed: int = 7, vocabulary: int = 50_000, length: int = 120):
+    """Zipf-distributed random documents, for benchmarks."""
+    import random
+
+    rng = random.Random(seed)
+    words = [f"w{index}" for index in range(vocabulary)]
+    weights = [1.0 / (rank + 1) for rank in range(vocabulary)]
+    for number in range(documents):
+        text = " ".join(rng.choices(words, weights, k=length))
+        yield {"id": f"doc-{number}", "title": f"Document {number}", "text": text}
+
+
+def run_benchmark(documents: int = 100_000, batch: int = 10_000, queries: int = 500):
+    """Indexing throughput, index open time and query latency (cold and cached) on a synthetic corpus."""
+    import random
+    import tempfile
+    from luna_bench import percentiles
+
+    rng = random.Random(11)
+    corpus = list(synthetic_corpus(documents))
+    with tempfile.TemporaryDirectory() as directory:
+        engine = LocalSearchEngine(directory)
+        start = time.perf_counter()
+        for offset in range(0, documents, batch):
+            engine.add_source(f"batch-{offset // batch}", corpus[offset:offset + batch])
+            engine.commit()
+        index_s = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+        print(f"indexed {documents:,} documents in {index_s:.1f} s ({documents / index_s:,.0f} docs/s), "
+              f"{engine.stats()['segments']} segments, {size / 1e6:.0f} MB on disk")
+
+        start = time.perf_counter()
+        engine.add_source("batch-0", corpus[:1000])  # re-index one source: 1k docs replace 10k
+        engine.commit()
+        print(f"incremental re-index of one source: {1000 * (time.perf_counter() - start):.0f} ms")
+        engine.close()
+
+        start = time.perf_counter()
+        engine = LocalSearchEngine(directory)
+        print(f"open index: {1000 * (time.perf_counter() - start):.1f} ms ({engine.stats()['documents']:,} documents)")
+
+        # Two- and three-word queries over mid-frequency terms, then the same queries again
+        query_texts = [" ".join(f"w{rng.randint(50, 20_000)}" for _ in range(rng.choice((2, 3))))
+                       for _ in range(queries)]
+        for label in ("cold", "cached"):
+            latencies = []
+            for query in query_texts:
+                start = time.perf_counter()
+                engine.search(query, 5)
+                latencies.append(time.perf_counter() - start)
+            summary = percentiles(latencies)
+            print(f"query {label:>6}: p50 {summary['p50_ms']:.3f} ms, p95 {summary['p95_ms']:.3f} ms, "
+                  f"p99 {summary['p99_ms']:.3f} ms")
+        engine.close()
+
+
+if __name__ == "__main__":
+    run_benchmark()
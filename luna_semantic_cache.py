@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Luna's semantic response cache.
+Sits in front of the ReAct agent: each question is embedded locally as a hashed character
+n-gram vector, and a paraphrase of a question the agent already answered (cosine similarity
+above a threshold) gets the stored answer back without any LLM call. Vectors live in one
+NumPy matrix, so a lookup is a single matrix-vector product. Capacity is bounded with LRU or
+LFU eviction, and answers from time-sensitive tools or questions, or to questions about the
+asker, are never stored.
+"""
+
+import os
+import re
+import time
+import zlib
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from luna_search import STOPWORDS
+
+DEFAULT_CAPACITY = int(os.getenv("LUNA_SEMANTIC_CACHE_SIZE", "10000"))
+DEFAULT_THRESHOLD = float(os.getenv("LUNA_SEMANTIC_CACHE_THRESHOLD", "0.75"))
+DEFAULT_TTL = float(os.getenv("LUNA_SEMANTIC_CACHE_TTL", str(24 * 3600)))
+DEFAULT_DIM = 256
+NGRAM_SIZES = (3, 4, 5)
+WORD_WEIGHT = 2.0  # whole words on top of their n-grams, so "austria" and "australia" stay apart
+
+# Answers that depend on when (or for whom) they were given are never reused.
+EXCLUDED_TOOLS = {"reminder_planner"}
+for _tool_name in filter(None, os.getenv("LUNA_SEMANTIC_CACHE_SKIP_TOOLS", "").split(",")):
+    EXCLUDED_TOOLS.add(_tool_name.strip())
+TIME_SENSITIVE = re.compile(
+    r"\b(?:today|tonight|tomorrow|yesterday|now|right now|current(?:ly)?|latest|news|this (?:week|month|year)|"
+    r"remind(?:er)?s?|schedule|time is it|weather)\b",
+    re.IGNORECASE,
+)
+# Follow-ups ("why is that?", "tell me more") only make sense against the conversation so far.
+REFERS_BACK = re.compile(r"\b(?:it|its|that|this|those|these|they|them|he|she|him|her|again|more|else)\b",
+                         re.IGNORECASE)
+# Questions about the asker ("what is my name?") have a different answer for every user.
+PERSONAL = re.compile(r"\b(?:i|im|me|my|mine|myself|we|us|our|ours|ourselves)\b", re.IGNORECASE)
+# ... but not in the way a question is asked ("tell me about", "I wonder")
+ASKING = re.compile(r"\b(?:(?:tell|give|show|teach|explain to|help)\s+me|i\s+(?:wonder|want to know|would like to know)|"
+                    r"can\s+i\s+ask)\b", re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+_numpy = None
+
+
+def _load_numpy():
+    """NumPy, imported on first use so importing Luna stays fast."""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+# How a question is phrased, as opposed to what it asks
+FILLER_WORDS = STOPWORDS | {
+    "tell", "me", "know", "can", "could", "would", "please", "so", "something", "about", "do", "does",
+    "explain", "give", "some", "luna", "hey", "s",
+}
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase content words, so case, punctuation and filler ("can you tell me") don't count."""
+    words = re.findall(r"\w+", text.lower())
+    return " ".join(word for word in words if word not in FILLER_WORDS) or " ".join(words)
+
+
+def embed(text: str, dim: int = DEFAULT_DIM, ngram_sizes=NGRAM_SIZES):
+    """
+    Unit-length float32 vector of signed, hashed character n-grams (word boundaries included)
+    plus whole words of the normalized text; stable across processes.
+    """
+    np = _load_numpy()
+    normalized = normalize_query(text)
+    padded = f" {normalized} "
+    codes = [zlib.crc32(padded[i:i + n].encode("utf-8")) for n in ngram_sizes for i in range(len(padded) - n + 1)]
+    word_codes = [zlib.crc32(f"w:{word}".encode("utf-8")) for word in normalized.split()]
+    vector = np.zeros(dim, dtype=np.float32)
+    if codes or word_codes:
+        hashes = np.array(codes + word_codes, dtype=np.uint32)
+        weights = np.ones(len(hashes), dtype=np.float32)
+        weights[len(codes):] = WORD_WEIGHT
+        weights[(hashes & 0x80000000) != 0] *= -1
+        np.add.at(vector, (hashes % dim).astype(np.intp), weights)
+        norm = float(np.linalg.norm(vector))
+        if norm:
+            vector /= norm
+    return vector
+
+
+class SemanticCache:
+    """
+    Bounded store of (question vector, answer) pairs with cosine-similarity lookup.
+
+    Rows of a preallocated (capacity, dim) matrix hold unit vectors, so similarity is a dot
+    product. `policy` is "lru" (evict the least recently used) or "lfu" (the least hit, then
+    least recently used). Entries older than `ttl` seconds are neither returned nor kept.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, threshold: float = DEFAULT_THRESHOLD,
+                 policy: str = "lru", ttl: Optional[float] = DEFAULT_TTL, dim: int = DEFAULT_DIM,
+                 excluded_tools: Iterable[str] = EXCLUDED_TOOLS):
+        np = _load_numpy()
+        if np is None:
+            raise RuntimeError("the semantic cache needs NumPy")
+        if policy not in ("lru", "lfu"):
+            raise ValueError("policy must be 'lru' or 'lfu'")
+        self.capacity = capacity
+        self.threshold = threshold
+        self.policy = policy
+        self.ttl = ttl
+        self.dim = dim
+        self.excluded_tools = set(excluded_tools)
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._created = np.zeros(capacity, dtype=np.float64)
+        self._hits = np.zeros(capacity, dtype=np.int64)
+        self._answers: List[Optional[str]] = [None] * capacity
+        self._questions: List[Optional[str]] = [None] * capacity
+        self._size = 0  # rows in use are [0, _size); freed rows are zeroed and reused by eviction
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.stores = 0
+        self.skipped = 0
+        self.evictions = 0
+        self.lookup_seconds = 0.0
+
+    def _best(self, vector, now: float):
+        # Called with the lock held: (row, similarity) of the closest live entry, or (None, 0).
+        if not self._size:
+            return None, 0.0
+        np = _numpy
+        similarities = self._vectors[:self._size] @ vector
+        if self.ttl is not None:
+            similarities[self._created[:self._size] < now - self.ttl] = -1.0
+        row = int(np.argmax(similarities))
+        return row, float(similarities[row])
+
+    def lookup(self, question: str) -> Optional[str]:
+        """The stored answer of the most similar question at or above the threshold, else None."""
+        start = time.perf_counter()
+        if not self.cacheable(question):
+            return None
+        vector = embed(question, self.dim)
+        now = time.time()
+        with self._lock:
+            row, similarity = self._best(vector, now)
+            self.lookups += 1
+            hit = row is not None and similarity >= self.threshold and self._answers[row] is not None
+            if hit:
+                self.hits += 1
+                self._hits[row] += 1
+                self._last_used[row] = now
+                answer = self._answers[row]
+            self.lookup_seconds += time.perf_counter() - start
+        return answer if hit else None
+
+    def cacheable(self, question: str, tools_used: Iterable[str] = ()) -> bool:
+        """False for time-sensitive, personal and follow-up questions, and turns that used an excluded tool."""
+        return (not TIME_SENSITIVE.search(question) and not REFERS_BACK.search(question)
+                and not PERSONAL.search(ASKING.sub(" ", question)) and not self.excluded_tools.intersection(tools_used))
+
+    def store(self, question: str, answer: str, tools_used: Iterable[str] = ()) -> bool:
+        """Remember the agent's answer; returns False if the turn may not be reused."""
+        if not answer or not normalize_query(question) or not self.cacheable(question, tools_used):
+            with self._lock:
+                self.skipped += 1
+            return False
+        vector = embed(question, self.dim)
+        now = time.time()
+        with self._lock:
+            row, similarity = self._best(vector, now)
+            if row is None or similarity < self.threshold:
+                row = self._free_row(now)
+                self._hits[row] = 0
+            self._vectors[row] = vector
+            self._answers[row] = answer
+            self._questions[row] = question
+            self._created[row] = now
+            self._last_used[row] = now
+            self.stores += 1
+        return True
+
+    def _free_row(self, now: float) -> int:
+        # Called with the lock held.
+        np = _numpy
+        if self._size < self.capacity:
+            self._size += 1
+            return self._size - 1
+        if self.ttl is not None:
+            expired = np.flatnonzero(self._created < now - self.ttl)
+            if expired.size:
+                self.evictions += 1
+                return int(expired[0])
+        if self.policy == "lfu":
+            candidates = np.flatnonzero(self._hits == self._hits.min())
+            row = int(candidates[np.argmin(self._last_used[candidates])])
+        else:
+            row = int(np.argmin(self._last_used))
+        self.evictions += 1
+        return row
+
+    def clear(self):
+        with self._lock:
+            self._vectors[:] = 0
+            self._answers = [None] * self.capacity
+            self._questions = [None] * self.capacity
+            self._hits[:] = 0
+            self._size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": self._size,
+                "capacity": self.capacity,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "stores": self.stores,
+                "skipped": self.skipped,
+                "evictions": self.evictions,
+                "mean_lookup_ms": 1000 * self.lookup_seconds / self.lookups if self.lookups else 0.0,
+            }
+
+
+_cache: Optional[SemanticCache] = None
+_cache_lock = threading.Lock()
+_disabled = False
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """Process-wide cache; None when LUNA_SEMANTIC_CACHE=0 or NumPy is missing."""
+    global _cache, _disabled
+    if _cache is None and not _disabled:
+        with _cache_lock:
+            if _cache is None and not _disabled:
+                if os.getenv("LUNA_SEMANTIC_CACHE", "1") == "0":
+                    _disabled = True
+                elif _load_numpy() is None:
+                    logger.warning("NumPy is not installed; the semantic response cache is off")
+                    _disabled = True
+                else:
+                    _cache = SemanticCache()
+    return _cache
+
+
+def set_semantic_cache(cache: Optional[SemanticCache]):
+    """Install a cache; None resets to the environment-configured default."""
+    global _cache, _disabled
+    with _cache_lock:
+        _cache = cache
+        _disabled = False
+
+
+# Benchmark questions: each with paraphrases that should hit, and a close question that must not
+_QUESTIONS = [
+    ("how many hearts does an octopus have",
+     ["how many hearts do octopuses have?", "How many hearts does an octopus have??", "octopus hearts, how many?"],
+     "how many legs does an octopus have"),
+    ("why is the sky blue", ["Why is the sky blue?", "why's the sky blue", "what makes the sky blue"],
+     "why is the sea blue"),
+    ("what is the capital of australia",
+     ["What's the capital of Australia?", "capital of australia?", "which city is the capital of australia"],
+     "what is the capital of austria"),
+    ("who painted the mona lisa",
+     ["Who painted the Mona Lisa?", "who was the painter of the mona lisa", "mona lisa painter?"],
+     "who painted the starry night"),
+    ("how far is the moon from earth",
+     ["How far away is the moon from the earth?", "distance from earth to the moon", "how far is the moon"],
+     "how far is the sun from earth"),
+    ("tell me about cherry blossoms",
+     ["Can you tell me about cherry blossoms?", "what do you know about cherry blossoms",
+      "tell me something about cherry blossom trees"],
+     "tell me about sunflowers"),
+    ("how do volcanoes form", ["How are volcanoes formed?", "how do volcanos form", "what causes volcanoes to form"],
+     "how do earthquakes form"),
+    ("what do pandas eat", ["What do pandas eat?", "what does a panda eat", "what food do pandas eat"],
+     "what do koalas eat"),
+    ("how does photosynthesis work",
+     ["How does photosynthesis work?", "explain how photosynthesis works", "how photosynthesis works"],
+     "how does respiration work"),
+    ("what is the tallest mountain in the world",
+     ["What's the tallest mountain in the world?", "which mountain is the tallest in the world",
+      "tallest mountain on earth?"],
+     "what is the longest river in the world"),
+]
+
+
+def run_benchmark(entries: int = 100_000, lookups: int = 1_000):
+    """Paraphrase hit rate, false hits on unrelated questions, and lookup latency at `entries` cached answers."""
+    import random
+    from luna_bench import percentiles
+
+    rng = random.Random(3)
+    np = _load_numpy()
+    cache = SemanticCache(capacity=len(_QUESTIONS), ttl=None)
+    for question, _, _ in _QUESTIONS:
+        cache.store(question, f"answer to {question}")
+    paraphrases = [(question, paraphrase) for question, variants, _ in _QUESTIONS for paraphrase in variants]
+    hits = sum(cache.lookup(paraphrase) == f"answer to {question}" for question, paraphrase in paraphrases)
+    false_hits = sum(cache.lookup(negative) is not None for _, _, negative in _QUESTIONS)
+    print(f"paraphrases answered from cache: {hits}/{len(paraphrases)}; close but different questions "
+          f"wrongly answered: {false_hits}/{len(_QUESTIONS)} (threshold {cache.threshold})")
+
+    cache = SemanticCache(capacity=entries, ttl=None)
+    filler = rng.sample(range(10 * entries), entries)
+    start = time.perf_counter()
+    rows = np.stack([embed(f"question number {n} about topic {n % 977} and thing {n % 131}") for n in filler])
+    embed_s = time.perf_counter() - start
+    with cache._lock:  # bulk-load the benchmark rows directly
+        cache._vectors[:entries] = rows
+        cache._answers[:entries] = [f"answer {n}" for n in filler]
+        cache._created[:entries] = time.time()
+        cache._size = entries
+    probes = [f"question number {rng.choice(filler)} about topic" for _ in range(lookups)]
+    latencies = []
+    for probe in probes:
+        start = time.perf_counter()
+        cache.lookup(probe)
+        latencies.append(time.perf_counter() - start)
+    summary = percentiles(latencies)
+    print(f"embed: {1e6 * embed_s / entries:.0f} us/question; lookup at {entries:,} entries "
+          f"({cache._vectors.nbytes / 1e6:.0f} MB matrix): p50 {summary['p50_ms']:.2f} ms, "
+          f"p95 {summary['p95_ms']:.2f} ms, p99 {summary['p99_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Luna's headless HTTP service.
+A plain ASGI app exposing the AIML -> agent -> emotion -> TTS pipeline as JSON and
+NDJSON-streaming endpoints, with bounded worker concurrency, a bounded wait queue that
+pushes back with 503 + Retry-After, per-session state and a health endpoint.
+
+Run it with any ASGI server, e.g. `uvicorn luna_server:app`, or `python luna_server.py`.
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from luna_pipeline import LunaPipeline
+from luna_trace import get_tracer
+from luna_reminders import get_reminder_scheduler, set_current_session
+
+DEFAULT_MAX_WORKERS = int(os.getenv("LUNA_MAX_WORKERS", "8"))
+DEFAULT_MAX_QUEUE = int(os.getenv("LUNA_MAX_QUEUE", "64"))
+DEFAULT_QUEUE_TIMEOUT = float(os.getenv("LUNA_QUEUE_TIMEOUT", "30"))
+DEFAULT_MAX_SESSIONS = int(os.getenv("LUNA_MAX_SESSIONS", "10000"))
+MAX_BODY_BYTES = 64 * 1024
+
+
+class Overloaded(Exception):
+    """The service is at capacity; the client should retry later."""
+
+
+class AdmissionController:
+    """At most `max_workers` turns run at once; up to `max_queue` more wait; the rest are rejected."""
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS, max_queue: int = DEFAULT_MAX_QUEUE,
+                 queue_timeout: float = DEFAULT_QUEUE_TIMEOUT):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_workers)
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self.completed = 0
+
+    async def __aenter__(self):
+        if self.queued >= self.max_queue and self._slots.locked():
+            self.rejected += 1
+            raise Overloaded("queue is full")
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded("timed out waiting for a worker") from None
+        finally:
+            self.queued -= 1
+        self.active += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.active -= 1
+        self.completed += 1
+        self._slots.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {"active": self.active, "queued": self.queued, "rejected": self.rejected,
+                "completed": self.completed, "max_workers": self.max_workers, "max_queue": self.max_queue}
+
+
+class SessionState:
+    """Per-session conversation state; turns within one session run one at a time."""
+
+    def __init__(self, session_id: str, max_history: int = 100):
+        self.session_id = session_id
+        self.history: Deque[Dict[str, Any]] = deque(maxlen=max_history)
+        self.lock = asyncio.Lock()
+        self.last_seen = time.time()
+        self.turns = 0
+        self.memory: Optional[Any] = None  # ConversationMemory, created on the session's first turn
+
+
+class SessionStore:
+    """Bounded LRU of sessions."""
+
+    def __init__(self, max_sessions: int = DEFAULT_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+
+    def get(self, session_id: Optional[str], create: bool = True) -> Optional[SessionState]:
+        if session_id and session_id in self._sessions:
+            self._sessions.move_to_end(session_id)
+            session = self._sessions[session_id]
+            session.last_seen = time.time()
+            return session
+        if not create:
+            return None
+        session = SessionState(session_id or uuid.uuid4().hex)
+        self._sessions[session.session_id] = session
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+async def _send_json(send: Send, status: int, payload: Any, headers: Optional[List[Tuple[bytes, bytes]]] = None):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode())] + (headers or [])})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_line(send: Send, event: Dict[str, Any]):
+    """One NDJSON event of a streaming response."""
+    line = json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n"
+    await send({"type": "http.response.body", "body": line, "more_body": True})
+
+
+async def _read_json(receive) -> Dict[str, Any]:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            raise ValueError("request body too large")
+        if not message.get("more_body"):
+            break
+    data = json.loads(body or b"{}")
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    return data
+
+
+class LunaService:
+    """
+    ASGI application.
+
+    GET    /health                 -> status, admission and session counters
+    GET    /metrics                -> stage latency histograms and counters (Prometheus text)
+    POST   /chat                   -> {"session_id", "message"} => full turn result as JSON
+    POST   /chat/stream            -> same input, NDJSON events: started, text, emotion, audio, done
+    GET    /sessions/{id}          -> session history
+    DELETE /sessions/{id}          -> forget a session
+    GET    /sessions/{id}/reminders       -> pending reminders, plus any fired since the last call
+    DELETE /sessions/{id}/reminders/{rid} -> cancel a pending reminder
+    """
+
+    def __init__(self, pipeline_factory: Callable[[], LunaPipeline], max_workers: int = DEFAULT_MAX_WORKERS,
+                 max_queue: int = DEFAULT_MAX_QUEUE, queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+                 max_sessions: int = DEFAULT_MAX_SESSIONS, memory_factory: Optional[Callable[[], Any]] = None):
+        self.pipeline_factory = pipeline_factory
+        self.memory_factory = memory_factory
+        self.pipeline: Optional[LunaPipeline] = None
+        self.admission_options = (max_workers, max_queue, queue_timeout)
+        self.admission: Optional[AdmissionController] = None
+        self.sessions = SessionStore(max_sessions)
+        self.started_at = time.time()
+
+    def _ensure_started(self):
+        # Built on first use so the semaphore belongs to the server's event loop.
+        if self.pipeline is None:
+            self.pipeline = self.pipeline_factory()
+        if self.admission is None:
+            self.admission = AdmissionController(*self.admission_options)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    self._ensure_started()
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    if self.pipeline is not None:
+                        self.pipeline.close()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+        self._ensure_started()
+        method, path = scope["method"], scope["path"].rstrip("/") or "/"
+        try:
+            if method == "GET" and path == "/health":
+                await self._health(send)
+            elif method == "GET" and path == "/metrics":
+                await self._metrics(send)
+            elif method == "POST" and path in ("/chat", "/chat/stream"):
+                await self._chat(receive, send, stream=path.endswith("/stream"))
+            elif path.startswith("/sessions/") and "/reminders" in path and method in ("GET", "DELETE"):
+                await self._reminders(method, path.split("/")[2:], send)
+            elif path.startswith("/sessions/") and method in ("GET", "DELETE"):
+                await self._session(method, path.split("/", 2)[2], send)
+            else:
+                await _send_json(send, 404, {"error": "not found"})
+        except ValueError as e:
+            await _send_json(send, 400, {"error": str(e)})
+
+    async def _health(self, send: Send):
+        await _send_json(send, 200, {
+            "status": "ok",
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "sessions": len(self.sessions),
+            "admission": self.admission.stats(),
+        })
+
+    async def _metrics(self, send: Send):
+        body = get_tracer().prometheus_text().encode("utf-8")
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/plain; version=0.0.4"),
+                                (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _session(self, method: str, session_id: str, send: Send):
+        if method == "DELETE":
+            await _send_json(send, 200 if self.sessions.delete(session_id) else 404, {"session_id": session_id})
+            return
+        session = self.sessions.get(session_id, create=False)
+        if session is None:
+            await _send_json(send, 404, {"error": "unknown session"})
+            return
+        await _send_json(send, 200, {"session_id": session_id, "turns": session.turns,
+                                     "history": list(session.history)})
+
+    async def _reminders(self, method: str, parts: List[str], send: Send):
+        # parts: [session_id, "reminders"] or [session_id, "reminders", reminder_id]
+        if len(parts) not in (2, 3) or parts[1] != "reminders":
+            await _send_json(send, 404, {"error": "not found"})
+            return
+        scheduler = get_reminder_scheduler()
+        session_id = parts[0]
+        if method == "GET" and len(parts) == 2:
+            await _send_json(send, 200, {
+                "session_id": session_id,
+                "pending": [reminder.as_dict() for reminder in scheduler.list(session_id)],
+                "fired": [reminder.as_dict() for reminder in scheduler.drain(session_id)],
+            })
+        elif method == "DELETE" and len(parts) == 3:
+            try:
+                reminder_id = int(parts[2])
+            except ValueError:
+                raise ValueError("reminder id must be an integer") from None
+            cancelled = scheduler.cancel(reminder_id, session_id)
+            await _send_json(send, 200 if cancelled else 404, {"session_id": session_id, "id": reminder_id,
+                                                                  "cancelled": cancelled})
+        else:
+            await _send_json(send, 404, {"error": "not found"})
+
+    async def _chat(self, receive, send: Send, stream: bool):
+        data = await _read_json(receive)
+        message = str(data.get("message", "")).strip()
+        if not message:
+            raise ValueError("'message' is required")
+        session = self.sessions.get(data.get("session_id"))
+        if session.memory is None and self.memory_factory is not None:
+            session.memory = self.memory_factory()
+        set_current_session(session.session_id)  # reminders made during the turn belong to this session
+
+        # Wait for the session's previous turn before asking for a worker, so a queued turn
+        # never holds a slot; nothing is sent until a worker is granted, so overload is a 503.
+        try:
+            try:
+                await asyncio.wait_for(session.lock.acquire(), self.admission.queue_timeout)
+            except asyncio.TimeoutError:
+                raise Overloaded("timed out waiting for the session's previous turn") from None
+            try:
+                async with self.admission:
+                    result = await (self._stream_turn(session, message, send) if stream
+                                    else self.pipeline.respond(message, memory=session.memory))
+                    session.turns += 1
+                    session.history.append({"sender": "User", "text": message})
+                    session.history.append({"sender": "Luna", "text": result.text, "emotion": result.emotion,
+                                            "audio_url": result.audio_path})
+            finally:
+                session.lock.release()
+        except Overloaded as e:
+            await _send_json(send, 503, {"error": f"overloaded: {e}"}, [(b"retry-after", b"1")])
+            return
+
+        payload = dict(result.as_dict(), session_id=session.session_id)
+        if stream:
+            await _send_line(send, dict(payload, type="done"))
+            await send({"type": "http.response.body", "body": b""})
+        else:
+            await _send_json(send, 200, payload)
+
+    async def _stream_turn(self, session: SessionState, message: str, send: Send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/x-ndjson"), (b"cache-control", b"no-cache")]})
+        await _send_line(send, {"type": "started", "session_id": session.session_id})
+        events: "asyncio.Queue" = asyncio.Queue()
+        turn = asyncio.ensure_future(self.pipeline.respond(
+            message, on_event=lambda name, value: events.put_nowait({"type": name, name: value}),
+            memory=session.memory))
+        turn.add_done_callback(lambda _: events.put_nowait(None))
+        while (event := await events.get()) is not None:
+            await _send_line(send, event)
+        return turn.result()
+
+
+def default_pipeline() -> LunaPipeline:
+    """Real pipeline: Gemini agent plus ElevenLabs TTS when ELEVENLABS_API_KEY is set."""
+    from luna_agent import create_luna_pipeline
+    from luna_emotion import infer_emotion_from_text
+    from luna_tts import AudioStore, create_tts_client, synthesize_audio_guarded
+
+    tts_client = create_tts_client()
+    tts = None
+    if tts_client is not None:
+        store = AudioStore()
+        tts = lambda text: synthesize_audio_guarded(tts_client, text, store)  # text-only while ElevenLabs is down
+    return create_luna_pipeline(tts=tts, emotion_fn=infer_emotion_from_text)
+
+
+def default_memory():
+    """Per-session conversation memory summarized by Gemini."""
+    from luna_agent import create_conversation_memory
+
+    return create_conversation_memory()
+
+
+def fake_pipeline(llm_latency: float = 0.2, tts_latency: float = 0.3) -> LunaPipeline:
+    """Offline pipeline on luna_fakes stand-ins, for local load tests."""
+    import tempfile
+    from luna_emotion import infer_emotion_from_text
+    from luna_fakes import FakeAgent, FakeChatModel, FakeTTSClient
+    from luna_rules import CompiledRuleEngine
+    from luna_tts import AudioStore, synthesize_audio
+
+    store = AudioStore(tempfile.mkdtemp(prefix="luna_audio_"))
+    tts_client = FakeTTSClient(latency=tts_latency)
+    agent = FakeAgent(FakeChatModel(lambda prompt: f"Ooh! Luna thought about '{prompt}'! ✨", latency=llm_latency))
+    return LunaPipeline(CompiledRuleEngine.from_file(), agent, emotion_fn=infer_emotion_from_text,
+                        tts=lambda text: synthesize_audio(tts_client, text, store))
+
+
+app = LunaService(default_pipeline, memory_factory=default_memory)
+
+
+async def _call_app(service: LunaService, method: str, path: str, payload: Optional[dict] = None):
+    """Drive the ASGI app in-process; returns (status, body bytes)."""
+    body = json.dumps(payload or {}).encode()
+    sent = {"body": b"", "status": None}
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            sent["status"] = message["status"]
+        else:
+            sent["body"] += message.get("body", b"")
+
+    await service({"type": "http", "method": method, "path": path, "headers": []}, receive, send)
+    return sent["status"], sent["body"]
+
+
+def run_load_test(clients: int = 200, requests_per_client: int = 5, max_workers: int = 32, max_queue: int = 64):
+    """In-process load test against fake backends: throughput, latency percentiles and rejections."""
+    service = LunaService(fake_pipeline, max_workers=max_workers, max_queue=max_queue)
+
+    async def client(index: int, latencies: List[float], statuses: Dict[int, int]):
+        for turn in range(requests_per_client):
+            start = time.perf_counter()
+            status, _ = await _call_app(service, "POST", "/chat",
+                                        {"session_id": f"client-{index}", "message": f"tell me fact {turn}"})
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                await asyncio.sleep(0.05)
+
+    async def main():
+        latencies: List[float] = []
+        statuses: Dict[int, int] = {}
+        start = time.perf_counter()
+        await asyncio.gather(*(client(i, latencies, statuses) for i in range(clients)))
+        elapsed = time.perf_counter() - start
+        _, health = await _call_app(service, "GET", "/health")
+        return latencies, statuses, elapsed, json.loads(health)
+
+    latencies, statuses, elapsed, health = asyncio.run(main())
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+    print(f"clients={clients} workers={max_workers} queue={max_queue}")
+    print(f"statuses: {statuses}  throughput: {statuses.get(200, 0) / elapsed:.1f} turns/s")
+    print(f"latency ms: p50={pct(0.50):.0f} p95={pct(0.95):.0f} p99={pct(0.99):.0f}")
+    print(f"health: {health['admission']}  sessions={health['sessions']}")
+    service.pipeline.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Luna's headless HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--fake", action="store_true", help="serve with fake LLM/TTS backends")
+    parser.add_argument("--load-test", action="store_true", help="run the in-process load test and exit")
+    args = parser.parse_args()
+
+    if args.load_test:
+        run_load_test()
+    else:
+        import uvicorn
+        uvicorn.run(LunaService(fake_pipeline) if args.fake else app, host=args.host, port=args.port)
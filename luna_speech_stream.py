@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Luna's sentence-streamed speech pipeline.
+Splits a reply into sentences as its text arrives, synthesizes them in order on a
+background worker, and hands each audio chunk to the player as soon as it is ready,
+so the first sentence plays while later ones are still being synthesized.
+"""
+
+import re
+import time
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+from luna_tts import (
+    TTS_MODEL_ID, TTS_OUTPUT_FORMAT, TTS_VOICE_ID, AudioStore, audio_key, clean_tts_text, strip_id3_tag,
+    synthesize_audio
+)
+from luna_trace import get_tracer
+
+# End of sentence: terminal punctuation (optionally repeated or followed by ~ or quotes) then whitespace.
+_SENTENCE_END = re.compile(r'([.!?~]+["\')\]]*)(\s+)')
+
+
+class SentenceSplitter:
+    """
+    Incremental sentence splitter.
+    feed() returns the sentences completed by the new text; flush() returns the remainder.
+    Very short fragments ("Hehe!") are merged into the next sentence to avoid tiny TTS calls.
+    """
+
+    def __init__(self, min_chars: int = 12):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            candidate = self._buffer[start:match.end(1)].strip()
+            if len(candidate) >= self.min_chars:
+                sentences.append(candidate)
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        remainder, self._buffer = self._buffer.strip(), ""
+        return [remainder] if remainder else []
+
+
+def split_sentences(text: str, min_chars: int = 12) -> List[str]:
+    """Split a complete text into sentences with the same rules as the streaming splitter."""
+    splitter = SentenceSplitter(min_chars)
+    return splitter.feed(text) + splitter.flush()
+
+
+class SpeechChunk:
+    """One synthesized sentence, in reply order."""
+
+    __slots__ = ("index", "text", "audio_path", "ready_at")
+
+    def __init__(self, index: int, text: str, audio_path: Optional[str], ready_at: float):
+        self.index = index
+        self.text = text
+        self.audio_path = audio_path
+        self.ready_at = ready_at
+
+
+class StreamingSpeechPipeline:
+    """
+    Producer/consumer TTS pipeline.
+
+    Text goes in through feed()/close() (or speak() for an iterable of text pieces);
+    a worker thread synthesizes each completed sentence in order, and chunks() yields
+    SpeechChunk objects as soon as each one is ready. Each sentence goes through the
+    audio store, so repeated sentences are free.
+    """
+
+    _DONE = object()
+
+    def __init__(self, client: Any, store: AudioStore, voice_id: str = TTS_VOICE_ID,
+                 model_id: str = TTS_MODEL_ID, output_format: str = TTS_OUTPUT_FORMAT,
+                 min_chars: int = 12, on_chunk: Optional[Callable[[SpeechChunk], None]] = None):
+        self.client = client
+        self.store = store
+        self.voice_settings = {"voice_id": voice_id, "model_id": model_id, "output_format": output_format}
+        self.on_chunk = on_chunk
+        self._splitter = SentenceSplitter(min_chars)
+        self._pending: "queue.Queue" = queue.Queue()
+        self._ready: "queue.Queue" = queue.Queue()
+        self._started_at = time.perf_counter()
+        self._count = 0
+        self.first_audio_at: Optional[float] = None
+        self.errors: List[Exception] = []
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def feed(self, text: str):
+        for sentence in self._splitter.feed(text):
+            self._submit(sentence)
+
+    def close(self):
+        for sentence in self._splitter.flush():
+            self._submit(sentence)
+        self._pending.put(self._DONE)
+
+    def _submit(self, sentence: str):
+        if clean_tts_text(sentence):
+            self._pending.put((self._count, sentence))
+            self._count += 1
+
+    def _run(self):
+        while True:
+            item = self._pending.get()
+            if item is self._DONE:
+                self._ready.put(self._DONE)
+                return
+            index, sentence = item
+            try:
+                audio_path = synthesize_audio(self.client, sentence, self.store, **self.voice_settings)
+            except Exception as e:
+                self.errors.append(e)
+                audio_path = None
+            ready_at = time.perf_counter() - self._started_at
+            if audio_path and self.first_audio_at is None:
+                self.first_audio_at = ready_at
+            chunk = SpeechChunk(index, sentence, audio_path, ready_at)
+            if self.on_chunk:
+                self.on_chunk(chunk)
+            self._ready.put(chunk)
+
+    def chunks(self) -> Iterator[SpeechChunk]:
+        """Yield synthesized chunks in order until the pipeline is closed and drained."""
+        while True:
+            chunk = self._ready.get()
+            if chunk is self._DONE:
+                return
+            yield chunk
+
+    def speak(self, pieces: Iterable[str]) -> Iterator[SpeechChunk]:
+        """Feed text pieces (e.g. streamed LLM tokens) from a helper thread and yield chunks."""
+        def pump():
+            try:
+                for piece in pieces:
+                    self.feed(piece)
+            finally:
+                self.close()
+        threading.Thread(target=pump, daemon=True).start()
+        return self.chunks()
+
+
+def synthesize_audio_streamed(client: Any, text: str, store: AudioStore,
+                              on_chunk: Optional[Callable[[SpeechChunk], None]] = None,
+                              **voice_settings) -> Optional[str]:
+    """
+    Synthesize text sentence by sentence, calling on_chunk as each clip becomes playable,
+    then store the stitched clip under the full text's content address.
+    MP3 frames concatenate cleanly, so stitching needs no re-encoding; only the first clip
+    keeps its ID3 tag. Without on_chunk nobody hears the early sentences, and this is just
+    a slower synthesize_audio.
+    """
+    clean_text = clean_tts_text(text)
+    if not clean_text:
+        return None
+    with get_tracer().span("tts.streamed", characters=len(clean_text)) as span:
+        key = audio_key(clean_text, **voice_settings)
+        cached_path = store.get(key)
+        if cached_path:
+            span.set(cached=True)
+            return cached_path
+        pipeline = StreamingSpeechPipeline(client, store, on_chunk=on_chunk, **voice_settings)
+        pipeline.feed(text)
+        pipeline.close()
+        paths = [chunk.audio_path for chunk in pipeline.chunks()]
+        if pipeline.errors:
+            raise pipeline.errors[0]
+        if pipeline.first_audio_at is not None:
+            span.set(cached=False, sentences=len(paths), first_audio_ms=round(1000 * pipeline.first_audio_at, 1))
+
+        def clip_bytes():
+            for number, path in enumerate(filter(None, paths)):
+                with open(path, 'rb') as clip:
+                    data = clip.read()
+                yield data if number == 0 else strip_id3_tag(data)
+
+        return store.put(key, clip_bytes())
+
+
+def run_benchmark(sentence_latency: float = 0.3, per_char_latency: float = 0.002):
+    """Compare time-to-first-audio of whole-reply synthesis vs the sentence pipeline on a fake TTS."""
+    import tempfile
+    from luna_fakes import FakeTTSClient
+
+    reply = (
+        "Kyaa~! That's such a fun question, Master! "
+        "Luna looked into it with Search-chan and found lots of sparkly facts. "
+        "The moon is slowly drifting away from the Earth, about four centimeters every year! "
+        "Isn't that amazing? Hehe! Luna will keep watching the sky with you every night!"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        client = FakeTTSClient(latency=sentence_latency, per_char_latency=per_char_latency)
+
+        start = time.perf_counter()
+        synthesize_audio(client, reply, AudioStore(directory + "/whole"))
+        whole = time.perf_counter() - start
+
+        pipeline = StreamingSpeechPipeline(client, AudioStore(directory + "/stream"))
+        tokens = [word + " " for word in reply.split(" ")]
+        chunk_times = [chunk.ready_at for chunk in pipeline.speak(tokens)]
+
+    print(f"whole-reply synthesis:   first audio after {whole * 1000:.0f} ms")
+    print(f"sentence pipeline:       first audio after {pipeline.first_audio_at * 1000:.0f} ms "
+          f"({len(chunk_times)} chunks, last at {chunk_times[-1] * 1000:.0f} ms)")
+
+
+if __name__ == "__main__":
+    run_benchmark()
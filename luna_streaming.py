@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Luna's token streaming helpers.
+Pulls the Final Answer out of a streamed ReAct generation token by token, and keeps
+an emotion estimate up to date as the reply grows, so UIs can render Luna's words
+(and mood) before the agent loop has finished.
+"""
+
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from luna_emotion import EmotionScorer, get_emotion_scorer
+
+FINAL_ANSWER_MARKER = "Final Answer:"
+
+
+class FinalAnswerStreamer:
+    """
+    Incremental extractor for the text after "Final Answer:" in a ReAct generation.
+    The marker may be split across tokens; text before it (Thought/Action) is swallowed.
+    Call reset() at the start of every LLM generation.
+    """
+
+    def __init__(self, marker: str = FINAL_ANSWER_MARKER, on_text: Optional[Callable[[str], None]] = None):
+        self.marker = marker
+        self.on_text = on_text
+        self.reset()
+
+    def reset(self):
+        self._pending = ""
+        self._in_answer = False
+        self._leading = True
+
+    @property
+    def in_answer(self) -> bool:
+        return self._in_answer
+
+    def feed(self, token: str) -> str:
+        """Consume a token; return (and forward to on_text) any answer text it completes."""
+        if self._in_answer:
+            emitted = token
+        else:
+            self._pending += token
+            index = self._pending.find(self.marker)
+            if index < 0:
+                # Keep only a tail that could still be the start of the marker.
+                self._pending = self._pending[-(len(self.marker) - 1):]
+                return ""
+            self._in_answer = True
+            emitted = self._pending[index + len(self.marker):]
+            self._pending = ""
+        if self._leading:
+            emitted = emitted.lstrip()
+            if not emitted:
+                return ""
+            self._leading = False
+        if self.on_text:
+            self.on_text(emitted)
+        return emitted
+
+
+class IncrementalEmotionTracker:
+    """
+    Tracks which emotion category a growing reply falls into.
+
+    Scores with the same EmotionScorer as infer_emotion_from_text, so the category after
+    the last feed() is the one the whole reply gets. Each feed() only scans the new text
+    plus a small overlap, so updating per token stays cheap.
+    """
+
+    def __init__(self, scorer: Optional[EmotionScorer] = None):
+        self.scorer = scorer or get_emotion_scorer()
+        self._overlap = max(self.scorer.longest_keyword - 1, 0)
+        self._tail = ""
+        self._found: Set[str] = set()
+        self._scores: Dict[str, float] = {}
+        self.emotion: Optional[str] = None
+
+    def feed(self, text: str) -> Optional[str]:
+        """Add text; return the current best category (None until any keyword is seen)."""
+        window = self._tail + text.lower()
+        self.scorer.add_scores(self._scores, window, self._found)
+        self._tail = window[-self._overlap:] if self._overlap else ""
+        self.emotion = self.scorer.best(self._scores)
+        return self.emotion
+
+
+def stream_final_answer(tokens: Iterable[str]) -> Iterable[str]:
+    """Yield only the Final Answer text from a stream of ReAct tokens."""
+    streamer = FinalAnswerStreamer()
+    for token in tokens:
+        emitted = streamer.feed(token)
+        if emitted:
+            yield emitted
+
+
+if __name__ == "__main__":
+    from luna_fakes import FakeChatModel
+
+    fake = FakeChatModel([
+        "Thought: The user wants a fun fact. I now know the final answer\n"
+        "Final Answer: Ooh! Did you know octopuses have three hearts? Kyaa~! Luna loves that! ✨"
+    ])
+    tracker = IncrementalEmotionTracker()
+    for piece in stream_final_answer(chunk.content for chunk in fake.stream("fun fact please")):
+        print(f"{piece!r:<20} emotion={tracker.feed(piece)}")
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Luna's tracing and metrics.
+Spans for each turn and its stages (AIML match, agent iterations, LLM calls, tool calls,
+emotion inference, TTS) carry token/byte counts, feed per-stage latency histograms that
+render as Prometheus text, and can be written out as JSON lines.
+
+Off unless LUNA_TRACE=1 (or a tracer is installed with set_tracer); when off, span()
+hands back a shared no-op object, so instrumented code pays one attribute check.
+"""
+
+import os
+import json
+import time
+import random
+import threading
+import contextvars
+from typing import Any, Dict, IO, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Numeric span attributes that are summed into per-span counters.
+COUNTED_ATTRIBUTES = ("input_tokens", "output_tokens", "characters", "bytes")
+
+_current_span: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("luna_span", default=None)
+
+
+class _NoopSpan:
+    """What span() returns while tracing is off."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        return self
+
+    def end(self, error: Optional[BaseException] = None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """One timed unit of work. Use as a context manager, or call end() for callback-driven spans."""
+
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "attributes", "start",
+                 "duration", "status", "_t0", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.status = "ok"
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is not None:
+            _current_span.reset(self._token)
+            self._token = None
+        self.end(exc)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def end(self, error: Optional[BaseException] = None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._t0
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{type(error).__name__}: {error}"
+        self.tracer._finish(self)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name, "trace_id": self.trace_id, "span_id": self.span_id,
+            "parent_id": self.parent_id, "start": self.start, "duration_ms": round(1000 * self.duration, 3),
+            "status": self.status, "attributes": self.attributes,
+        }
+
+
+class JSONLinesExporter:
+    """Appends every finished span as one JSON object per line to a file or stream."""
+
+    def __init__(self, target):
+        self._own_file = isinstance(target, str)
+        self._stream: IO[str] = open(target, "a", encoding="utf-8") if self._own_file else target
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.as_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._stream.write(line + "\n")
+            self._stream.flush()
+
+    def close(self):
+        if self._own_file:
+            self._stream.close()
+
+
+class Tracer:
+    """
+    Creates spans and aggregates them into metrics.
+
+    `exporters` get every finished span (anything with export(span)). Latency histograms and
+    counters are kept per span name regardless, for prometheus_text() and snapshot().
+    """
+
+    def __init__(self, enabled: bool = True, exporters: Optional[List[Any]] = None,
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.enabled = enabled
+        self.exporters = list(exporters or [])
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, List[float]] = {}  # name -> bucket counts + [sum, count]
+        self._counters: Dict[Tuple[str, str], float] = {}
+        self._errors: Dict[str, int] = {}
+
+    def span(self, name: str, **attributes):
+        """Span as a child of the current one; a no-op when tracing is off."""
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, _current_span.get(), attributes)
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes):
+        """Span that is not made current; the caller ends it with end()."""
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, parent or _current_span.get(), attributes)
+
+    def _finish(self, span: Span):
+        with self._lock:
+            histogram = self._histograms.get(span.name)
+            if histogram is None:
+                histogram = self._histograms[span.name] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if span.duration <= bound:
+                    histogram[index] += 1
+            histogram[-2] += span.duration
+            histogram[-1] += 1
+            for attribute in COUNTED_ATTRIBUTES:
+                value = span.attributes.get(attribute)
+                if isinstance(value, (int, float)):
+                    key = (attribute, span.name)
+                    self._counters[key] = self._counters.get(key, 0) + value
+            if span.status == "error":
+                self._errors[span.name] = self._errors.get(span.name, 0) + 1
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception:
+                pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Per-span count, total/mean seconds, errors and counted attributes."""
+        with self._lock:
+            spans = {}
+            for name, histogram in self._histograms.items():
+                total, count = histogram[-2], histogram[-1]
+                spans[name] = {"count": count, "total_s": round(total, 6),
+                               "mean_ms": round(1000 * total / count, 3) if count else 0.0,
+                               "errors": self._errors.get(name, 0)}
+            for (attribute, name), value in self._counters.items():
+                spans.setdefault(name, {})[attribute] = value
+            return spans
+
+    def prometheus_text(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        lines = ["# HELP luna_span_duration_seconds Time spent in each Luna stage.",
+                 "# TYPE luna_span_duration_seconds histogram"]
+        with self._lock:
+            for name, histogram in sorted(self._histograms.items()):
+                for index, bound in enumerate(self.buckets):
+                    lines.append(f'luna_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {histogram[index]}')
+                lines.append(f'luna_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {histogram[-1]}')
+                lines.append(f'luna_span_duration_seconds_sum{{span="{name}"}} {histogram[-2]:.6f}')
+                lines.append(f'luna_span_duration_seconds_count{{span="{name}"}} {histogram[-1]}')
+            lines.append("# HELP luna_span_errors_total Spans that ended with an exception.")
+            lines.append("# TYPE luna_span_errors_total counter")
+            for name, errors in sorted(self._errors.items()):
+                lines.append(f'luna_span_errors_total{{span="{name}"}} {errors}')
+            for attribute in COUNTED_ATTRIBUTES:
+                values = sorted((name, value) for (attr, name), value in self._counters.items() if attr == attribute)
+                if not values:
+                    continue
+                lines.append(f"# TYPE luna_{attribute}_total counter")
+                for name, value in values:
+                    lines.append(f'luna_{attribute}_total{{span="{name}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._errors.clear()
+
+    def close(self):
+        for exporter in self.exporters:
+            close = getattr(exporter, "close", None)
+            if close:
+                close()
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def count_tokens(text: str) -> int:
+    """Rough token count (whitespace-separated words) for spans without provider usage data."""
+    return len(text.split()) if text else 0
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def _default_tracer() -> Tracer:
+    enabled = os.getenv("LUNA_TRACE", "").lower() in ("1", "true", "yes")
+    trace_file = os.getenv("LUNA_TRACE_FILE")
+    exporters = [JSONLinesExporter(trace_file)] if enabled and trace_file else []
+    return Tracer(enabled=enabled, exporters=exporters)
+
+
+def get_tracer() -> Tracer:
+    """Process-wide tracer: enabled by LUNA_TRACE=1, spans written to LUNA_TRACE_FILE if set."""
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = _default_tracer()
+    return _tracer
+
+
+def set_tracer(tracer: Optional[Tracer]):
+    """Install a tracer; None resets to the environment-configured default."""
+    global _tracer
+    with _tracer_lock:
+        _tracer = tracer
+
+
+def run_benchmark(iterations: int = 200_000):
+    """Per-span overhead with tracing off and on, against an empty `with` block."""
+    class Empty:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            return False
+
+    empty = Empty()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with empty:
+            pass
+    print(f"no tracing : {1e9 * (time.perf_counter() - start) / iterations:8.0f} ns/span")
+    for enabled in (False, True):
+        tracer = Tracer(enabled=enabled)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            with tracer.span("bench", bytes=1):
+                pass
+        elapsed = time.perf_counter() - start
+        print(f"tracing {'on ' if enabled else 'off'}: {1e9 * elapsed / iterations:8.0f} ns/span")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Luna's batch translation (Translate-kun, in bulk).
+Many segments into many target languages in as few LLM calls as the prompt budget allows:
+identical segments are translated once, every (segment, language) pair is cached on its own,
+and the rest are packed into numbered JSON requests whose answers are matched back by number.
+Anything the model drops or garbles is retried in smaller batches, down to one segment per call;
+a call that fails outright (network, quota, open circuit) is not retried here.
+"""
+
+import os
+import re
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from luna_cache import CACHE_POLICIES, CachePolicy, ResponseCache, get_response_cache, make_cache_key
+from luna_trace import count_tokens, get_tracer
+
+DEFAULT_BATCH_TOKENS = int(os.getenv("LUNA_TRANSLATE_BATCH_TOKENS", "3000"))
+DEFAULT_BATCH_ITEMS = int(os.getenv("LUNA_TRANSLATE_BATCH_ITEMS", "60"))
+OUTPUT_EXPANSION = 1.5  # translations run longer than their source; budget the answer too
+_PROMPT_OVERHEAD = 120  # tokens of instructions around the items
+
+logger = logging.getLogger(__name__)
+
+
+class TranslationError(RuntimeError):
+    """A translation call failed, or a segment could not be translated even on its own."""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate that doesn't undercount unspaced scripts (CJK, Thai)."""
+    return max(count_tokens(text), len(text) // 4, 1)
+
+
+def _normalize(segment: str) -> str:
+    return " ".join(segment.split())
+
+
+def _extract_json_object(text: str) -> Dict[str, Any]:
+    """The JSON object in a model answer, tolerating code fences and chatter around it."""
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        raise ValueError("no JSON object in the answer")
+    value = json.loads(text[start:end + 1])
+    if not isinstance(value, dict):
+        raise ValueError("answer is not a JSON object")
+    return value
+
+
+class _Item:
+    __slots__ = ("number", "text", "source", "target", "tokens")
+
+    def __init__(self, number: int, text: str, source: str, target: str):
+        self.number = number
+        self.text = text
+        self.source = source
+        self.target = target
+        self.tokens = estimate_tokens(text)
+
+
+class BatchTranslator:
+    """
+    Packs translation requests into few LLM calls.
+
+    `max_batch_tokens` bounds one call's prompt plus its expected answer; `max_batch_items`
+    bounds how many numbered items a call carries. Results are cached per (segment, source,
+    target) in the response cache, under the language_translator cache policy.
+    """
+
+    def __init__(self, llm: Any, cache: Optional[ResponseCache] = None,
+                 max_batch_tokens: int = DEFAULT_BATCH_TOKENS, max_batch_items: int = DEFAULT_BATCH_ITEMS):
+        self.llm = llm
+        self.cache = cache
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self._lock = threading.Lock()
+        self.segments = 0
+        self.unique = 0
+        self.cache_hits = 0
+        self.llm_calls = 0
+        self.retried_items = 0
+        self.naive_calls = 0
+
+    def _cache_key(self, text: str, source: str, target: str) -> str:
+        model = getattr(self.llm, "model", None) or getattr(self.llm, "model_name", None) or type(self.llm).__name__
+        return make_cache_key(f"translate\x00{source}\x00{target}\x00{text}", model, getattr(self.llm, "temperature", None))
+
+    def _cacheable(self) -> bool:
+        policy = CACHE_POLICIES.get("language_translator", CachePolicy())
+        return policy.allows(getattr(self.llm, "temperature", None))
+
+    def translate(self, segments: Sequence[str], target_languages: Sequence[str],
+                  source_language: str = "English") -> Dict[str, List[str]]:
+        """
+        Translations of every segment into every target language, as {language: [translation
+        per segment, in input order]}. Blank segments come back unchanged. Raises
+        TranslationError if an LLM call fails or some segment could not be translated at all.
+        """
+        cache = self.cache or get_response_cache()
+        cacheable = self._cacheable()
+        results: Dict[str, List[Optional[str]]] = {language: [None] * len(segments) for language in target_languages}
+        wanted: Dict[Tuple[str, str], List[int]] = {}  # (normalized text, target) -> input positions
+        for position, segment in enumerate(segments):
+            text = _normalize(segment)
+            for language in target_languages:
+                if not text:
+                    results[language][position] = segment
+                else:
+                    wanted.setdefault((text, language), []).append(position)
+
+        pending: List[_Item] = []
+        hits = 0
+        for (text, language), positions in wanted.items():
+            cached = cache.get(self._cache_key(text, source_language, language)) if cacheable else None
+            if cached is not None:
+                hits += 1
+                for position in positions:
+                    results[language][position] = cached
+            else:
+                pending.append(_Item(len(pending) + 1, text, source_language, language))
+
+        calls_before = self.llm_calls
+        with get_tracer().span("translate.batch", segments=len(segments), languages=len(target_languages),
+                               items=len(pending)) as span:
+            for item, translation in self._run(pending):
+                if cacheable:
+                    cache.put(self._cache_key(item.text, item.source, item.target), translation)
+                for position in wanted[(item.text, item.target)]:
+                    results[item.target][position] = translation
+            span.set(llm_calls=self.llm_calls - calls_before, cache_hits=hits)
+
+        with self._lock:
+            self.segments += len(segments) * len(target_languages)
+            self.unique += len(wanted)
+            self.cache_hits += hits
+            self.naive_calls += sum(1 for segment in segments if _normalize(segment)) * len(target_languages)
+        return results  # type: ignore[return-value]
+
+    def _batches(self, items: List[_Item]) -> List[List[_Item]]:
+        """Greedy packing in input order (keeps a conversation's context together)."""
+        batches: List[List[_Item]] = []
+        current: List[_Item] = []
+        used = _PROMPT_OVERHEAD
+        for item in items:
+            cost = int(item.tokens * (1 + OUTPUT_EXPANSION)) + 8  # + the item's number and JSON quoting
+            if current and (used + cost > self.max_batch_tokens or len(current) >= self.max_batch_items):
+                batches.append(current)
+                current, used = [], _PROMPT_OVERHEAD
+            current.append(item)
+            used += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    def _run(self, items: List[_Item]):
+        queue = self._batches(items)
+        while queue:
+            batch = queue.pop(0)
+            answered = self._call(batch)
+            missing = [item for item in batch if item.number not in answered]
+            for item in batch:
+                if item.number in answered:
+                    yield item, answered[item.number]
+            if not missing:
+                continue
+            with self._lock:
+                self.retried_items += len(missing)
+            if len(batch) == 1:
+                raise TranslationError(f"could not translate {missing[0].text[:40]!r} into {missing[0].target}")
+            # Split what was lost into two smaller batches, so one bad item is soon isolated
+            middle = max(1, len(missing) // 2)
+            queue[:0] = [part for part in (missing[:middle], missing[middle:]) if part]
+
+    def _call(self, batch: List[_Item]) -> Dict[int, str]:
+        with self._lock:
+            self.llm_calls += 1
+        if len(batch) == 1:
+            item = batch[0]
+            prompt = f"""You are Luna's translation tool, Translate-kun! Please translate the following text:
+
+Source Language: {item.source}
+Target Language: {item.target}
+Text to translate: {item.text}
+
+Provide only the translation without additional explanation."""
+            response = self._invoke(prompt, batch)
+            content = response.content if hasattr(response, 'content') else str(response)
+            return {item.number: content.strip()} if content.strip() else {}
+
+        lines = "\n".join(json.dumps({"id": item.number, "from": item.source, "to": item.target,
+                                      "text": item.text}, ensure_ascii=False) for item in batch)
+        prompt = f"""You are Luna's translation tool, Translate-kun, translating in bulk.
+Each line below is a JSON item with an id, a source language, a target language and a text.
+Translate every text into its target language. Keep each item separate, even if texts repeat or look related.
+Reply with one JSON object mapping each id (as a string) to its translation and nothing else, e.g. {{"1": "...", "2": "..."}}.
+
+Items:
+{lines}"""
+        response = self._invoke(prompt, batch)
+        content = response.content if hasattr(response, 'content') else str(response)
+        try:
+            answer = _extract_json_object(content)
+        except ValueError as e:
+            logger.warning("Unreadable batch translation answer (%d items): %s", len(batch), e)
+            return {}
+        numbers = {item.number for item in batch}
+        answered: Dict[int, str] = {}
+        for key, value in answer.items():
+            try:
+                number = int(key)
+            except (TypeError, ValueError):
+                continue
+            if number in numbers and isinstance(value, str) and value.strip():
+                answered[number] = value.strip()
+        return answered
+
+    def _invoke(self, prompt: str, batch: List[_Item]) -> Any:
+        # Only an answer with items missing is worth splitting; when the call itself fails,
+        # smaller calls would fail the same way, about 2n of them before giving up.
+        try:
+            return self.llm.invoke(prompt)
+        except Exception as e:
+            raise TranslationError(f"translation call failed ({len(batch)} items): {e}") from e
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "segments": self.segments,
+                "unique": self.unique,
+                "cache_hits": self.cache_hits,
+                "llm_calls": self.llm_calls,
+                "retried_items": self.retried_items,
+                "naive_calls": self.naive_calls,
+                "calls_saved": self.naive_calls - self.llm_calls,
+            }
+
+
+def fake_translation_responder(drop_every: int = 0):
+    """
+    Responder for luna_fakes.FakeChatModel that answers batch and single translation prompts
+    with "[<language>] <text>", dropping every `drop_every`-th batch item to exercise retries.
+    """
+    dropped = [0]
+
+    def respond(prompt: str) -> str:
+        if "translating in bulk" in prompt:
+            answer = {}
+            for line in prompt.split("Items:\n", 1)[1].splitlines():
+                item = json.loads(line)
+                dropped[0] += 1
+                if drop_every and dropped[0] % drop_every == 0:
+                    continue
+                answer[str(item["id"])] = f"[{item['to']}] {item['text']}"
+            return "```json\n" + json.dumps(answer, ensure_ascii=False) + "\n```"
+        target = re.search(r"Target Language: (.+)", prompt).group(1)
+        text = re.search(r"Text to translate: (.+)", prompt).group(1)
+        return f"[{target}] {text}"
+
+    return respond
+
+
+def run_benchmark(languages: Sequence[str] = ("French", "Spanish", "Japanese"), latency: float = 0.05):
+    """LLM calls and wall time for a conversation plus UI strings: one call per text vs. batched."""
+    import time
+    from luna_fakes import FakeChatModel
+
+    conversation = [f"Turn {i % 20}: Luna thinks topic {i % 20} is super fun, Master!" for i in range(40)]
+    ui_strings = ["Send", "Load older messages", "Luna is thinking...", "Send", "Settings", "Background music"]
+    segments = conversation + ui_strings
+
+    llm = FakeChatModel(fake_translation_responder(), latency=latency, temperature=0.2)
+    start = time.perf_counter()
+    for segment in segments:
+        for language in languages:
+            llm.invoke(f"You are Luna's translation tool, Translate-kun! Please translate the following text:\n\n"
+                       f"Source Language: English\nTarget Language: {language}\nText to translate: {segment}\n")
+    naive_s = time.perf_counter() - start
+
+    for drop_every in (0, 7):
+        llm = FakeChatModel(fake_translation_responder(drop_every), latency=latency, temperature=0.2)
+        translator = BatchTranslator(llm, cache=ResponseCache(db_path=None))
+        start = time.perf_counter()
+        results = translator.translate(segments, languages)
+        batch_s = time.perf_counter() - start
+        assert all(results[language][index] == f"[{language}] {_normalize(segment)}"
+                   for language in languages for index, segment in enumerate(segments)), "misaligned output"
+        translator.translate(segments, languages)  # all from the per-segment cache now
+        stats = translator.stats()
+        label = f"batched (model drops 1 in {drop_every})" if drop_every else "batched"
+        print(f"{label:<30}: {stats['llm_calls']:>3} LLM calls, {batch_s * 1000:6.0f} ms, "
+              f"{stats['retried_items']} items retried; repeat run {stats['cache_hits']} cache hits, no calls")
+    print(f"{'one call per text':<30}: {len(segments) * len(languages):>3} LLM calls, {naive_s * 1000:6.0f} ms")
+    print(f"calls saved: {stats['calls_saved']} of {stats['naive_calls']} "
+          f"({len(segments)} segments, {stats['unique'] // 2} unique pairs, {len(languages)} languages)")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Luna's text-to-speech helpers.
+Synthesized clips live in a content-addressed audio store keyed by a hash of the cleaned
+text and the voice settings, so canned lines and the greeting are synthesized once and
+replayed from disk. The store evicts by total size and by age.
+Long replies (stories, poems) can be synthesized in chunks: split at paragraph and sentence
+boundaries, synthesized concurrently, and stitched back together in order.
+"""
+
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+
+from luna_resilience import CircuitOpenError, DeadlineExceeded, ResiliencePolicy, get_policy
+from luna_trace import get_tracer
+
+TTS_VOICE_ID = "piTKgcLEGmPE4e6mEKli"  # This is the ID for the voice "Rachel"
+TTS_MODEL_ID = "eleven_multilingual_v2"
+TTS_OUTPUT_FORMAT = "mp3_44100_128"
+
+DEFAULT_AUDIO_DIR = 'temp_audio_luna/'
+DEFAULT_MAX_BYTES = int(os.getenv("LUNA_AUDIO_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+DEFAULT_MAX_AGE = float(os.getenv("LUNA_AUDIO_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+DEFAULT_CHUNK_CHARS = int(os.getenv("LUNA_TTS_CHUNK_CHARS", "600"))
+DEFAULT_TTS_WORKERS = int(os.getenv("LUNA_TTS_WORKERS", "4"))  # stay under ElevenLabs' concurrency limit
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?;:])["\')]*\s+')
+
+logger = logging.getLogger(__name__)
+
+
+def clean_tts_text(text: str) -> str:
+    """Strip emojis and markup the voice shouldn't read out."""
+    return re.sub(r'[^\w\s\.,!?;:\-\'"()]', '', text).strip()
+
+
+def audio_key(clean_text: str, voice_id: str = TTS_VOICE_ID, model_id: str = TTS_MODEL_ID,
+              output_format: str = TTS_OUTPUT_FORMAT) -> str:
+    """Content address of a clip: same text and voice settings -> same file."""
+    raw = "\x00".join([clean_text, voice_id, model_id, output_format])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AudioStore:
+    """
+    Directory of content-addressed MP3 clips with size- and age-based eviction.
+    A hit refreshes the file's mtime, so eviction drops the least recently played clips first.
+    """
+
+    def __init__(self, directory: str = DEFAULT_AUDIO_DIR, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_age: Optional[float] = DEFAULT_MAX_AGE, evict_every: int = 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.evicted_files = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.evict()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"luna_{key[:32]}.mp3")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.path_for(key)
+        try:
+            if os.path.getsize(path) > 0:
+                os.utime(path, None)
+                with self._lock:
+                    self.hits += 1
+                return path
+        except OSError:
+            pass
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, chunks: Iterable[bytes]) -> Optional[str]:
+        """Write chunks atomically under the key's path; returns None if nothing was written."""
+        path = self.path_for(key)
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+        written = 0
+        with open(tmp_path, 'wb') as audio_file:
+            for chunk in chunks:
+                if chunk:
+                    audio_file.write(chunk)
+                    written += len(chunk)
+        if not written:
+            os.remove(tmp_path)
+            return None
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._puts += 1
+            should_evict = self._puts % self.evict_every == 0
+        if should_evict:
+            self.evict()
+        return path
+
+    def evict(self) -> int:
+        """Delete expired clips, then the oldest ones until the store fits in max_bytes."""
+        now = time.time()
+        entries = []
+        removed = 0
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if not name.endswith(".mp3"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if self.max_age is not None and now - stat.st_mtime > self.max_age:
+                    removed += self._remove(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                removed += self._remove(path)
+                total -= size
+            self.evicted_files += removed
+        return removed
+
+    @staticmethod
+    def _remove(path: str) -> int:
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evicted_files": self.evicted_files}
+
+
+def create_tts_client(api_key: Optional[str] = None) -> Optional[Any]:
+    """ElevenLabs client for ELEVENLABS_API_KEY, or None when no key is configured."""
+    api_key = api_key or os.getenv("ELEVENLABS_API_KEY")
+    if not api_key:
+        return None
+    from elevenlabs.client import ElevenLabs
+
+    return ElevenLabs(api_key=api_key)
+
+
+class TTSHealthCheck:
+    """
+    Cached background check that the TTS account works (voices.get_all() for ElevenLabs).
+    status() never blocks: it returns the last result and starts a refresh in a daemon
+    thread once the result is older than `ttl`. States: unknown, ok, invalid_key, unreachable,
+    and disabled when there is no client to check.
+    """
+
+    def __init__(self, client: Any, ttl: float = 600.0):
+        self.client = client
+        self.ttl = ttl
+        self.state = "unknown" if client is not None else "disabled"
+        self.detail = ""
+        self.checked_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def _check(self):
+        try:
+            voices_response = self.client.voices.get_all()
+            if hasattr(voices_response, 'voices'): voice_count = len(voices_response.voices)
+            else: voice_count = len(voices_response) if isinstance(voices_response, list) else "unknown number of"
+            state, detail = "ok", f"{voice_count} voices"
+        except Exception as e:
+            error_msg = str(e)
+            if "invalid_api_key" in error_msg.lower() or "401" in error_msg:
+                state, detail = "invalid_key", error_msg
+            else:
+                state, detail = "unreachable", error_msg
+        log = logger.info if state == "ok" else logger.warning
+        log("TTS health check: %s (%s)", state, detail)
+        with self._lock:
+            self.state, self.detail, self.checked_at = state, detail, time.time()
+            self._worker = None
+
+    def refresh(self) -> threading.Thread:
+        """Start a check unless one is already running; returns its thread."""
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._check, name="luna-tts-health", daemon=True)
+                self._worker.start()
+            return self._worker
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            stale = self.checked_at is None or time.time() - self.checked_at > self.ttl
+        if stale and self.client is not None:
+            self.refresh()
+        with self._lock:
+            return {"state": self.state, "detail": self.detail, "checked_at": self.checked_at}
+
+    @property
+    def usable(self) -> bool:
+        """False only once the key is known to be rejected; unknown and unreachable still try."""
+        return self.status()["state"] != "invalid_key"
+
+
+def synthesize_audio(client: Any, text: str, store: AudioStore, voice_id: str = TTS_VOICE_ID,
+                     model_id: str = TTS_MODEL_ID, output_format: str = TTS_OUTPUT_FORMAT) -> Optional[str]:
+    """
+    Return the path of an MP3 for text, calling the TTS client only on a store miss.
+    Errors from the client propagate so callers can surface them.
+    """
+    clean_text = clean_tts_text(text)
+    if not clean_text:
+        return None
+    tracer = get_tracer()
+    with tracer.span("tts", characters=len(clean_text)) as span:
+        key = audio_key(clean_text, voice_id, model_id, output_format)
+        cached_path = store.get(key)
+        if cached_path:
+            span.set(cached=True)
+            return cached_path
+        audio_generator = client.text_to_speech.convert(
+            text=clean_text,
+            voice_id=voice_id,
+            model_id=model_id,
+            output_format=output_format
+        )
+        path = store.put(key, audio_generator)
+        if tracer.enabled and path:
+            span.set(cached=False, bytes=os.path.getsize(path))
+        return path
+
+
+def split_tts_chunks(clean_text: str, max_chars: int = DEFAULT_CHUNK_CHARS) -> List[str]:
+    """
+    Cleaned text as chunks of at most max_chars, packed greedily in order. Paragraphs and
+    sentences are kept whole where they fit, so each chunk still reads naturally; only a
+    sentence longer than max_chars is cut, between words.
+    """
+    pieces: List[str] = []
+    for paragraph in _PARAGRAPH_BREAK.split(clean_text):
+        paragraph = " ".join(paragraph.split())
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in _SENTENCE_BREAK.split(paragraph):
+            while len(sentence) > max_chars:
+                cut = sentence.rfind(" ", 0, max_chars + 1)
+                cut = cut if cut > 0 else max_chars
+                pieces.append(sentence[:cut])
+                sentence = sentence[cut:].lstrip()
+            pieces.append(sentence)
+
+    chunks: List[str] = []
+    for piece in filter(None, pieces):
+        if chunks and len(chunks[-1]) + 1 + len(piece) <= max_chars:
+            chunks[-1] += " " + piece
+        else:
+            chunks.append(piece)
+    return chunks
+
+
+def strip_id3_tag(data: bytes) -> bytes:
+    """MP3 bytes without a leading ID3v2 tag, so stitched clips carry only their audio frames."""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return data
+    size = (data[6] & 0x7f) << 21 | (data[7] & 0x7f) << 14 | (data[8] & 0x7f) << 7 | (data[9] & 0x7f)
+    footer = 10 if data[5] & 0x10 else 0
+    return data[10 + size + footer:]
+
+
+def _convert_chunk(client: Any, clean_text: str, voice_id: str = TTS_VOICE_ID, model_id: str = TTS_MODEL_ID,
+                   output_format: str = TTS_OUTPUT_FORMAT) -> bytes:
+    """One chunk of a long clip, synthesized into memory rather than the audio store."""
+    with get_tracer().span("tts", characters=len(clean_text), chunk=True):
+        return b"".join(client.text_to_speech.convert(
+            text=clean_text,
+            voice_id=voice_id,
+            model_id=model_id,
+            output_format=output_format
+        ))
+
+
+def synthesize_audio_chunked(client: Any, text: str, store: AudioStore, max_chars: int = DEFAULT_CHUNK_CHARS,
+                             workers: int = DEFAULT_TTS_WORKERS, policy: Optional[ResiliencePolicy] = None,
+                             **voice_settings) -> Optional[str]:
+    """
+    Long-form synthesize_audio: the cleaned text is split with split_tts_chunks, the chunks are
+    synthesized on up to `workers` threads, and the clips are stitched in order under the full
+    text's content address. MP3 frames concatenate cleanly, so stitching needs no re-encoding.
+
+    Each chunk is one call under `policy` (the "tts" policy by default), so the timeout bounds
+    a chunk rather than the whole clip and a failed chunk is retried without redoing the rest.
+    Chunks are kept in memory until the stitched clip is written; only that clip goes in the
+    store. If a chunk still fails, its error propagates. Text that fits in one chunk goes
+    straight to synthesize_audio under the policy.
+    """
+    clean_text = clean_tts_text(text)
+    if not clean_text:
+        return None
+    policy = policy or get_policy("tts")
+    chunks = split_tts_chunks(clean_text, max_chars)
+    if len(chunks) <= 1:
+        return policy.call(synthesize_audio, client, clean_text, store, **voice_settings)
+    with get_tracer().span("tts.chunked", characters=len(clean_text), chunks=len(chunks)) as span:
+        key = audio_key(clean_text, **voice_settings)
+        cached_path = store.get(key)
+        if cached_path:
+            span.set(cached=True)
+            return cached_path
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks))),
+                                thread_name_prefix="luna-tts-chunk") as pool:
+            futures = [pool.submit(contextvars.copy_context().run, policy.call, _convert_chunk,
+                                   client, chunk, **voice_settings) for chunk in chunks]
+            try:
+                clips = [future.result() for future in futures]
+            except Exception as e:
+                for future in futures:
+                    future.cancel()
+                span.set(failed=type(e).__name__)
+                logger.warning("Chunked TTS failed after %d chunks: %s", len(chunks), e)
+                raise
+        path = store.put(key, (clip if number == 0 else strip_id3_tag(clip) for number, clip in enumerate(clips)))
+        span.set(cached=False)
+        return path
+
+
+def synthesize_audio_guarded(client: Any, text: str, store: AudioStore, chunked: bool = False,
+                             **voice_settings) -> Optional[str]:
+    """
+    synthesize_audio(client, text, store, **voice_settings) under the "tts" resilience policy,
+    or with `chunked`, synthesize_audio_chunked, which applies the policy to each chunk.
+    Returns None, i.e. a text-only reply, while ElevenLabs' circuit is open or the turn has no
+    time left for audio; other errors propagate after the retries.
+    """
+    try:
+        if chunked:
+            return synthesize_audio_chunked(client, text, store, **voice_settings)
+        return get_policy("tts").call(synthesize_audio, client, text, store, **voice_settings)
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        logger.info("Replying without audio: %s", e)
+        return None
+
+
+def warm_up_audio(client: Any, texts: Iterable[str], store: AudioStore, **voice_settings) -> int:
+    """Pre-synthesize texts into the store; returns how many clips were newly synthesized."""
+    synthesized = 0
+    for text in dict.fromkeys(texts):
+        clean_text = clean_tts_text(text)
+        if not clean_text or store.get(audio_key(clean_text, **voice_settings)):
+            continue
+        try:
+            if synthesize_audio(client, text, store, **voice_settings):
+                synthesized += 1
+        except Exception as e:
+            logger.warning("Warm-up synthesis failed for \"%s...\": %s", clean_text[:30], e)
+    return synthesized
+
+
+def canned_responses(aiml_engine: Any) -> List[str]:
+    """Every fixed response line of an AIML engine (its `patterns` tuples)."""
+    return [response for _, responses in aiml_engine.patterns for response in responses]
+
+
+def run_benchmark(per_char_latency: float = 0.002, latency: float = 0.3, failure_rate: float = 0.15):
+    """Wall time of a long story as one convert call vs chunked, on a fake TTS, with and without failures."""
+    import tempfile
+    from luna_fakes import FakeTTSClient
+
+    sentences = [f"Once upon a time, in village number {i}, a little fox asked Luna for a story about the stars."
+                 for i in range(32)]
+    story = "\n\n".join(" ".join(sentences[i:i + 4]) for i in range(0, len(sentences), 4))
+    chunks = split_tts_chunks(clean_tts_text(story))
+    print(f"story: {len(story)} characters, {len(chunks)} chunks of up to {DEFAULT_CHUNK_CHARS}, "
+          f"{DEFAULT_TTS_WORKERS} workers")
+
+    for rate, runs in ((0.0, 1), (failure_rate, 5)):
+        totals = {"single_s": 0.0, "single_chars": 0, "chunked_s": 0.0, "chunked_chars": 0}
+        for seed in range(runs):
+            with tempfile.TemporaryDirectory() as directory:
+                # The single-call path has to redo the whole clip after a failure
+                client = FakeTTSClient(latency=latency, per_char_latency=per_char_latency, failure_rate=rate, seed=seed)
+                policy = ResiliencePolicy("tts-bench", timeout=None, attempts=6, base_delay=0.01)
+                start = time.perf_counter()
+                policy.call(synthesize_audio, client, story, AudioStore(directory + "/single"))
+                totals["single_s"] += time.perf_counter() - start
+                totals["single_chars"] += client.characters
+
+                client = FakeTTSClient(latency=latency, per_char_latency=per_char_latency, failure_rate=rate, seed=seed)
+                start = time.perf_counter()
+                policy = ResiliencePolicy("tts-bench", timeout=None, attempts=6, base_delay=0.01)
+                path = synthesize_audio_chunked(client, story, AudioStore(directory + "/chunked"), policy=policy)
+                totals["chunked_s"] += time.perf_counter() - start
+                totals["chunked_chars"] += client.characters
+                assert path and os.path.getsize(path) > 0, "no stitched clip"
+        label = f"failure rate {rate:.0%}"
+        print(f"{label:<18} single call: {totals['single_s'] * 1000 / runs:6.0f} ms, "
+              f"{totals['single_chars'] // runs:>5} chars sent | chunked: {totals['chunked_s'] * 1000 / runs:6.0f} ms, "
+              f"{totals['chunked_chars'] // runs:>5} chars sent (mean of {runs})")
+
+
+if __name__ == "__main__":
+    run_benchmark()
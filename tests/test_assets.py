@@ -0,0 +1,67 @@
+import base64
+import logging
+import os
+import urllib.request
+
+from luna_assets import AvatarCache, StaticAssetServer, data_uri, is_local_url
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_servers_get_their_own_free_port(caplog):
+    with caplog.at_level(logging.WARNING, logger="luna_assets"):
+        first, second = StaticAssetServer(), StaticAssetServer().start()
+    try:
+        assert first.base_url != second.base_url
+        assert first.base_url.startswith("http://localhost:")
+        assert first.is_local and second.is_local
+        assert "LUNA_ASSET_BASE_URL" in caplog.text
+    finally:
+        first.stop()
+        second.stop()
+
+
+def test_a_public_base_url_is_used_without_warning(caplog):
+    with caplog.at_level(logging.WARNING, logger="luna_assets"):
+        server = StaticAssetServer(base_url="https://luna.example.com/static/").start()
+    try:
+        assert server.base_url == "https://luna.example.com/static"
+        assert not server.is_local
+        assert caplog.text == ""
+        url = server.url_for_asset(server.registry.publish_bytes(b"luna", "avatar.png"))
+        assert url.startswith("https://luna.example.com/static/assets/avatar.")
+    finally:
+        server.stop()
+
+
+def test_published_bytes_are_served_with_ranges():
+    server = StaticAssetServer().start()
+    try:
+        url = server.url_for_asset(server.registry.publish_bytes(b"kyaa~! luna", "hello.txt"))
+        with urllib.request.urlopen(url) as response:
+            assert response.read() == b"kyaa~! luna"
+            assert "immutable" in response.headers["Cache-Control"]
+        request = urllib.request.Request(url, headers={"Range": "bytes=7-"})
+        with urllib.request.urlopen(request) as response:
+            assert response.status == 206 and response.read() == b"luna"
+    finally:
+        server.stop()
+
+
+def test_local_urls():
+    assert is_local_url("http://localhost:8765") and is_local_url("http://127.0.0.1:1234/x")
+    assert not is_local_url("https://luna.example.com") and not is_local_url("http://192.168.1.20:8765")
+
+
+def test_without_a_server_avatars_come_from_memory():
+    avatars = AvatarCache({"idle": "luna_idle.jpg", "happy": "luna_happy.jpg", "sad": "missing.jpg"},
+                          os.path.join(ROOT, "avatars"), "idle", max_size=64).load()
+    assert avatars.url_for("happy") is None
+    assert avatars.get("happy")[:2] == b"\xff\xd8"  # a JPEG, downscaled in memory
+    assert avatars.get("sad") == avatars.get("idle")
+
+
+def test_data_uri(tmp_path):
+    music = tmp_path / "theme.mp3"
+    music.write_bytes(b"ID3 luna")
+    assert data_uri(str(music)) == "data:audio/mpeg;base64," + base64.b64encode(b"ID3 luna").decode()
@@ -0,0 +1,71 @@
+import random
+import time
+
+import pytest
+
+from luna_calc import CalcError, CalcLimits, _random_expression, evaluate, evaluate_batch
+
+# Generous for a loaded CI box; an unbounded 9**9**9 takes minutes
+WORST_CASE_SECONDS = 0.05
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("12*7", 84), ("(3+4)*5/2", 17.5), ("2^10 - 1", 1023), ("100 // 7 % 3", 2), ("-(2 ** 3)", -8),
+    ("2 ** -1", 0.5), ("  1.5e3 + .5 ", 1500.5),
+])
+def test_arithmetic(expression, expected):
+    assert evaluate(expression) == expected
+
+
+@pytest.mark.parametrize("expression", [
+    "9**9**9", "9^9^9", "2**10**10", "(10**1000)*(10**1000)", "10.0**400", "2**4097", "7**(1/0)",
+    "1" * 600, "+".join(["1"] * 300),
+])
+def test_costly_inputs_are_rejected_quickly(expression):
+    start = time.perf_counter()
+    with pytest.raises(CalcError):
+        evaluate(expression)
+    assert time.perf_counter() - start < WORST_CASE_SECONDS
+
+
+@pytest.mark.parametrize("expression", [
+    "__import__('os').system('true')", "abs(-1)", "x + 1", "[1, 2][0]", "'a' * 3", "1 if 1 else 2", "(1).real",
+    "(-8) ** 0.5",
+])
+def test_anything_but_arithmetic_is_refused(expression):
+    with pytest.raises(CalcError):
+        evaluate(expression)
+
+
+def test_fuzzed_expressions_stay_within_the_bounds():
+    limits = CalcLimits()
+    rng = random.Random(7)
+    worst = 0.0
+    for _ in range(2000):
+        expression = _random_expression(rng)
+        start = time.perf_counter()
+        try:
+            result = evaluate(expression, limits)
+        except CalcError:
+            continue
+        finally:
+            worst = max(worst, time.perf_counter() - start)
+        if isinstance(result, int):
+            assert result.bit_length() <= limits.max_result_bits
+        else:
+            assert abs(result) <= limits.max_float
+    assert worst < WORST_CASE_SECONDS
+
+
+def test_batch_matches_one_by_one():
+    rng = random.Random(3)
+    expressions = ([f"{rng.randint(1, 999)} * {rng.randint(1, 999)} + {rng.randint(0, 9)}" for _ in range(50)]
+                   + [f"{rng.randint(1, 99)} / {rng.randint(0, 3)}" for _ in range(20)] + ["9**9**9", "oops"])
+    batch = evaluate_batch(expressions, min_vector_size=2)
+    for expression, result in zip(expressions, batch):
+        try:
+            expected = evaluate(expression)
+        except CalcError:
+            assert isinstance(result, CalcError)
+        else:
+            assert result == expected and type(result) is type(expected)
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from luna_emotion import EmotionScorer, get_emotion_scorer, infer_emotions
+from luna_streaming import IncrementalEmotionTracker
+
+REPLIES = [
+    "Ooh! Did you know octopuses have three hearts? Kyaa~! Luna loves that! ✨",
+    "Hehe! Luna knows a little mystery about octopuses~ they have three hearts! Ooh!",
+    "Aww... I'm sorry, Master, Luna couldn't find that one. Waaah!",
+    "Eeeek! A tiny problem occurred, oops! Luna is so confused right now... Waaah!",
+    "Hehe! Teasing you is Luna's favourite mischievous hobby! Yay!",
+    "The answer is 42. Here's how Luna worked it out step by step, nice and tidy for you.",
+]
+
+
+def pieces(text, rng):
+    """Split text at random points, the way an LLM stream hands out tokens."""
+    cuts = sorted(rng.sample(range(1, len(text)), k=min(len(text) - 1, len(text) // 3)))
+    return [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+
+
+@pytest.mark.parametrize("reply", REPLIES)
+def test_streamed_category_matches_the_final_classification(reply):
+    scorer = get_emotion_scorer()
+    rng = random.Random(reply)
+    for _ in range(20):
+        tracker = IncrementalEmotionTracker()
+        for piece in pieces(reply, rng):
+            tracker.feed(piece)
+        assert tracker.emotion == scorer.classify(reply)
+
+
+def test_keywords_split_across_tokens_are_found():
+    tracker = IncrementalEmotionTracker()
+    assert tracker.feed("Hehe") is None
+    assert tracker.feed("! Wa") == "mischievous"
+    assert tracker.feed("aah! so") == "mischievous"  # a tie goes to the category listed first
+    assert tracker.feed("rry") == "sad"
+    assert tracker.emotion == get_emotion_scorer().classify("Hehe! Waaah! sorry")
+
+
+def test_weighted_scores_and_tie_break():
+    scorer = EmotionScorer()
+    assert scorer.score("Hehe! What a mystery! Ooh!") == {"mischievous": 2.0, "curious": 3.0}
+    assert scorer.classify("Hehe! What a mystery! Ooh!") == "curious"
+    # Equal scores go to the category listed first
+    assert scorer.classify("Ooh! Hehe!") == "mischievous"
+    assert scorer.classify("nothing to see here") is None
+    assert scorer.classify("") is None
+
+
+def test_tracker_uses_a_custom_scorer():
+    scorer = EmotionScorer([("sleepy", ["yawn"]), ("happy", ["yay!"])], weights={"yawn": 3.0})
+    tracker = IncrementalEmotionTracker(scorer)
+    for piece in ["Yay! ", "ya", "wn..."]:
+        tracker.feed(piece)
+    assert tracker.emotion == "sleepy"
+
+
+def test_batch_matches_single_replies():
+    scorer = get_emotion_scorer()
+    assert scorer.classify_batch(REPLIES) == [scorer.classify(reply) for reply in REPLIES]
+    assert infer_emotions(REPLIES)[-1] == "speaking"
@@ -0,0 +1,64 @@
+import os
+import time
+
+import pytest
+
+from luna_history import ChatHistory, prune_history_files
+
+
+def message(i):
+    return {"sender": "User" if i % 2 == 0 else "Luna", "text": f"Message {i} ✨", "audio_url": None}
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = ChatHistory(str(tmp_path), session_id="test", hot_size=5)
+    for i in range(12):
+        history.append(message(i))
+    return history
+
+
+def test_messages_past_the_window_spill_to_disk(history):
+    assert len(history) == 12
+    assert history.stats() == {"messages": 12, "in_memory": 5, "spilled": 7,
+                               "spill_bytes": os.path.getsize(history.path)}
+    with open(history.path, encoding="utf-8") as spill:
+        assert len(spill.readlines()) == 7
+    assert history.latest(3) == [message(i) for i in range(9, 12)]
+
+
+@pytest.mark.parametrize("start, stop", [(0, 12), (0, 7), (5, 9), (6, 8), (7, 12), (3, 4), (11, None), (-4, 99)])
+def test_slices_across_the_spill_boundary_match_the_conversation(history, start, stop):
+    expected = [message(i) for i in range(12)][max(0, start):stop]
+    assert history.slice(start, stop) == expected
+
+
+def test_pages_and_indexing_read_back_spilled_messages(history):
+    assert history.page(history.spilled, size=4) == [message(i) for i in range(3, 7)]
+    assert history.page(2, size=4) == [message(0), message(1)]
+    assert history[0] == message(0) and history[-1] == message(11)
+    with pytest.raises(IndexError):
+        history[12]
+
+
+def test_clear_drops_the_spill_file(history):
+    history.clear()
+    assert len(history) == 0 and history.slice(0) == []
+    assert not os.path.exists(history.path)
+    history.append(message(0))
+    assert history.latest(5) == [message(0)]
+
+
+def test_prune_removes_only_old_spill_files(tmp_path):
+    old = ChatHistory(str(tmp_path), session_id="old", hot_size=1)
+    recent = ChatHistory(str(tmp_path), session_id="recent", hot_size=1)
+    for i in range(3):
+        old.append(message(i))
+        recent.append(message(i))
+    (tmp_path / "notes.txt").write_text("not a spill file")
+    week_ago = time.time() - 8 * 24 * 3600
+    os.utime(old.path, (week_ago, week_ago))
+    os.utime(tmp_path / "notes.txt", (week_ago, week_ago))
+    assert prune_history_files(str(tmp_path)) == 1
+    assert sorted(os.listdir(tmp_path)) == ["history_recent.jsonl", "notes.txt"]
+    assert prune_history_files(str(tmp_path / "missing")) == 0
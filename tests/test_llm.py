@@ -0,0 +1,59 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from luna_llm import LLMProvider
+
+
+class SlowFactory:
+    def __init__(self, delay=0.0, slow_model=None):
+        self.delay = delay
+        self.slow_model = slow_model
+        self.built = []
+        self._lock = threading.Lock()
+
+    def __call__(self, model, temperature):
+        if self.slow_model in (None, model):
+            time.sleep(self.delay)
+        with self._lock:
+            self.built.append((model, temperature))
+            return object()
+
+
+def test_concurrent_callers_share_a_bounded_pool():
+    factory = SlowFactory(delay=0.05)
+    provider = LLMProvider(factory, pool_size=2)
+    with ThreadPoolExecutor(16) as pool:
+        clients = list(pool.map(lambda _: provider.get("gemini", 0.7), range(64)))
+    assert len(factory.built) == 2
+    assert len({id(client) for client in clients}) == 2
+    assert provider.stats() == {"pools": 1, "clients_created": 2, "checkouts": 64, "reuses": 62}
+
+
+def test_a_slow_build_does_not_block_other_models():
+    provider = LLMProvider(SlowFactory(delay=0.5, slow_model="slow"))
+    slow = threading.Thread(target=provider.get, args=("slow", 0.7))
+    slow.start()
+    time.sleep(0.05)
+    start = time.perf_counter()
+    provider.get("fast", 0.7)
+    assert time.perf_counter() - start < 0.2
+    slow.join()
+
+
+def test_a_failed_build_frees_its_slot():
+    calls = []
+
+    def factory(model, temperature):
+        calls.append(model)
+        if len(calls) == 1:
+            raise ValueError("Please set GOOGLE_API_KEY in your .env file!")
+        return object()
+
+    provider = LLMProvider(factory)
+    with pytest.raises(ValueError):
+        provider.get("gemini", 0.7)
+    assert provider.get("gemini", 0.7) is provider.get("gemini", 0.7)
+    assert provider.stats()["clients_created"] == 1
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import pytest
+
+from luna_fakes import FakeAgent, FakeChatModel
+from luna_pipeline import AGENT_TIMEOUT_REPLY, LunaPipeline
+from luna_rules import CompiledRuleEngine
+
+
+def make_pipeline(llm_latency=0.1, tts_latency=0.1, **options):
+    def tts(text):
+        time.sleep(tts_latency)
+        return f"/audio/{len(text)}.mp3"
+
+    agent = FakeAgent(FakeChatModel(lambda prompt: f"Ooh! Luna thought about: {prompt}", latency=llm_latency))
+    return LunaPipeline(CompiledRuleEngine.from_file(), agent, tts=tts, emotion_fn=lambda text: "happy", **options)
+
+
+def test_throughput_scales_with_simultaneous_sessions():
+    pipeline = make_pipeline()
+    sessions, turns = 40, 2
+
+    async def session(n):
+        for turn in range(turns):
+            result = await pipeline.respond(f"session {n} asks question number {turn}")
+            assert result.source == "agent" and result.audio_path
+
+    async def run_all():
+        await asyncio.gather(*(session(n) for n in range(sessions)))
+
+    start = time.perf_counter()
+    asyncio.run(run_all())
+    elapsed = time.perf_counter() - start
+    pipeline.close()
+    serial = sessions * turns * 0.2
+    assert elapsed < serial / 10, f"{elapsed:.2f}s for what takes {serial:.1f}s one turn at a time"
+
+
+def test_emotion_is_known_before_audio_finishes():
+    events = []
+    pipeline = make_pipeline(llm_latency=0.0, tts_latency=0.2)
+    result = asyncio.run(pipeline.respond("tell me a story", on_event=lambda name, value: events.append(name)))
+    pipeline.close()
+    assert events == ["text", "emotion", "audio"]
+    assert result.timings["emotion"] < result.timings["tts"]
+
+
+def test_slow_agent_times_out_into_a_fallback_reply():
+    pipeline = make_pipeline(llm_latency=1.0, timeouts={"agent": 0.1})
+    start = time.perf_counter()
+    result = asyncio.run(pipeline.respond("a question that stalls"))
+    pipeline.close()
+    assert result.text == AGENT_TIMEOUT_REPLY and result.source == "fallback"
+    assert time.perf_counter() - start < 0.8
+
+
+def test_cancelling_a_turn_cancels_the_stage_in_flight():
+    pipeline = make_pipeline(llm_latency=0.0, tts_latency=0.0)
+    pipeline.agent = type("SlowAgent", (), {"ainvoke": lambda self, inputs: asyncio.sleep(5)})()
+
+    async def run():
+        task = asyncio.ensure_future(pipeline.respond("a question"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    pipeline.close()
+    assert time.perf_counter() - start < 1.0
+
+
+def test_tool_calls_from_one_model_turn_run_concurrently_under_ainvoke():
+    pytest.importorskip("langchain")
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    from luna_agent import create_luna_agent
+    from luna_bench import scripted_responder
+    from luna_cache import ResponseCache, set_response_cache
+    from luna_dispatch import LLMDispatcher, set_dispatcher
+    from luna_fakes import as_langchain_chat_model
+    from luna_llm import LLMProvider, set_llm_provider
+
+    question = "Write a haiku about rain and a limerick about cats"
+    corpus = [{"input": question, "tools": [{"tool": "creative_writer", "tool_input": "a haiku about rain"},
+                                            {"tool": "creative_writer", "tool_input": "a limerick about cats"}]}]
+    respond = scripted_responder(corpus)
+
+    def slow_tools(prompt):
+        if prompt.startswith("You are Luna's creative writing tool"):
+            time.sleep(0.3)
+        return respond(prompt)
+
+    class ToolTimes(BaseCallbackHandler):
+        def __init__(self):
+            self.starts, self.ends = [], []
+
+        def on_tool_start(self, serialized, input_str, **kwargs):
+            self.starts.append(time.monotonic())
+
+        def on_tool_end(self, output, **kwargs):
+            self.ends.append(time.monotonic())
+
+    chat_model = as_langchain_chat_model(FakeChatModel(slow_tools))
+    set_llm_provider(LLMProvider(factory=lambda model, temperature: chat_model))
+    set_response_cache(ResponseCache(db_path=None))
+    set_dispatcher(LLMDispatcher(requests_per_minute=0, tokens_per_minute=0))
+    try:
+        agent = create_luna_agent(mode="tools")
+        times = ToolTimes()
+        response = asyncio.run(agent.ainvoke({"input": question}, config={"callbacks": [times]}))
+    finally:
+        set_llm_provider(None)
+        set_response_cache(None)
+        set_dispatcher(None)
+    assert question in response["output"]
+    assert len(times.starts) == 2
+    assert max(times.starts) < min(times.ends), "the second tool waited for the first"
@@ -0,0 +1,63 @@
+from datetime import datetime
+
+import pytest
+
+from luna_reminders import ReminderParseError, parse_when
+
+NOW = datetime(2026, 10, 15, 14, 0).timestamp()  # a Thursday, 2 pm
+
+
+def at(*args):
+    return datetime(*args).timestamp()
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("in 20 minutes", NOW + 20 * 60),
+    ("in an hour", NOW + 3600),
+    ("after two days", NOW + 2 * 86400),
+    ("in 2 hours and 30 minutes", NOW + 2.5 * 3600),
+    ("in 1 hour 15 minutes from now", NOW + 75 * 60),
+    ("in a few minutes", NOW + 3 * 60),
+    ("now", NOW),
+])
+def test_relative_offsets(expression, expected):
+    assert parse_when(expression, NOW) == expected
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("tonight at 8", at(2026, 10, 15, 20, 0)),
+    ("at 8 tonight", at(2026, 10, 15, 20, 0)),
+    ("this evening at 7:30", at(2026, 10, 15, 19, 30)),
+    ("tomorrow afternoon at 3", at(2026, 10, 16, 15, 0)),
+    ("tomorrow night at 11", at(2026, 10, 16, 23, 0)),
+    ("tonight at 7am", at(2026, 10, 15, 7, 0)),  # an explicit a.m. wins
+    ("tomorrow morning at 9", at(2026, 10, 16, 9, 0)),
+    ("tonight", at(2026, 10, 15, 20, 0)),
+])
+def test_parts_of_the_day_make_a_bare_hour_pm(expression, expected):
+    assert parse_when(expression, NOW) == expected
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("at 5pm", at(2026, 10, 15, 17, 0)),
+    ("17:30", at(2026, 10, 15, 17, 30)),
+    ("at 9am", at(2026, 10, 16, 9, 0)),  # already passed today
+    ("tomorrow at 9am", at(2026, 10, 16, 9, 0)),
+    ("friday", at(2026, 10, 16, 9, 0)),
+    ("next thursday at 10", at(2026, 10, 22, 10, 0)),
+    ("next week", at(2026, 10, 22, 9, 0)),
+    ("on 2026-12-24 at 18:00", at(2026, 12, 24, 18, 0)),
+])
+def test_days_and_clock_times(expression, expected):
+    assert parse_when(expression, NOW) == expected
+
+
+def test_tonight_does_not_roll_over_to_tomorrow():
+    late = datetime(2026, 10, 15, 21, 0).timestamp()
+    assert parse_when("tonight at 8", late) == at(2026, 10, 15, 20, 0)
+
+
+@pytest.mark.parametrize("expression", ["", "whenever", "at 25:00", "at 13pm", "in zillions minutes", "on 2026-02-30"])
+def test_nonsense_is_rejected(expression):
+    with pytest.raises(ReminderParseError):
+        parse_when(expression, NOW)
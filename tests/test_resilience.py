@@ -0,0 +1,153 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from luna_dispatch import LLMDispatcher
+from luna_fakes import FakeChatModel, FakeTTSClient
+from luna_resilience import (
+    CircuitBreaker, CircuitOpenError, DeadlineExceeded, ResiliencePolicy, current_deadline, deadline_scope,
+    set_policy
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_policies():
+    yield
+    set_policy("llm", None)
+
+
+def test_breaker_opens_after_threshold_and_closes_after_trial():
+    breaker = CircuitBreaker("tts", failure_threshold=3, reset_timeout=0.1)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.12)
+    assert breaker.allow()  # the half-open trial
+    assert not breaker.allow()  # only one at a time
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_failed_trial_opens_the_breaker_again():
+    breaker = CircuitBreaker("tts", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.trips == 2
+
+
+def test_policy_fails_fast_once_the_upstream_is_down():
+    client = FakeTTSClient(failure_rate=1.0)
+    policy = ResiliencePolicy("tts", timeout=1.0, attempts=2, base_delay=0.0, failure_threshold=3)
+    for _ in range(2):
+        with pytest.raises(Exception):
+            policy.call(client.text_to_speech.convert, "hello")
+    with pytest.raises(CircuitOpenError):
+        policy.call(client.text_to_speech.convert, "hello")
+    assert client.calls == 3
+
+
+def test_retries_recover_from_transient_failures():
+    failures = iter([RuntimeError("503 unavailable")])
+
+    def flaky():
+        error = next(failures, None)
+        if error:
+            raise error
+        return "ok"
+
+    policy = ResiliencePolicy("llm", timeout=1.0, attempts=2, base_delay=0.0)
+    assert policy.call(flaky) == "ok"
+    assert policy.stats()["retries"] == 1
+    assert policy.breaker.state == "closed"
+
+
+def test_permanent_errors_are_not_retried():
+    calls = []
+
+    def rejected():
+        calls.append(1)
+        raise RuntimeError("401 invalid_api_key")
+
+    policy = ResiliencePolicy("llm", timeout=1.0, attempts=3, base_delay=0.0)
+    with pytest.raises(RuntimeError):
+        policy.call(rejected)
+    assert len(calls) == 1
+
+
+def test_deadline_cuts_a_stalled_call_short():
+    llm = FakeChatModel(["too late"], latency=2.0)
+    policy = ResiliencePolicy("llm", timeout=30.0)
+    start = time.monotonic()
+    with deadline_scope(0.2):
+        with pytest.raises(DeadlineExceeded):
+            policy.call(llm.invoke, "a question that stalls")
+    assert time.monotonic() - start < 1.0
+
+
+def test_deadline_propagates_to_attempt_threads_and_nested_scopes():
+    policy = ResiliencePolicy("llm", timeout=1.0)
+    with deadline_scope(5.0) as outer:
+        assert policy.call(current_deadline) is outer
+        with deadline_scope(60.0) as inner:
+            assert inner is outer  # a nested scope never extends the turn
+    assert current_deadline() is None
+
+
+def test_time_queued_in_the_dispatcher_does_not_count_against_the_attempt_timeout():
+    # ~0.6 s between calls at this rate; each attempt may only run for 0.3 s.
+    policy = ResiliencePolicy("llm", timeout=0.3, attempts=1, failure_threshold=2)
+    set_policy("llm", policy)
+    dispatcher = LLMDispatcher(requests_per_minute=2, tokens_per_minute=0, workers=1, period=1.0)
+    llm = FakeChatModel(["ok"], latency=0.05)
+    errors = []
+
+    def one(n):
+        try:
+            dispatcher.invoke(llm, f"question {n}")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=one, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    dispatcher.close()
+    assert errors == []
+    assert policy.stats()["timeouts"] == 0
+    assert policy.breaker.state == "closed"
+    assert max(policy.latencies._samples) < 0.3  # queued time stays out of the hedging percentile
+
+
+class LateCancelFuture(Future):
+    """Cancelled by its caller just after the dispatcher looked: cancelled() still says no."""
+
+    def cancelled(self):
+        return False
+
+
+def test_a_job_cancelled_as_it_is_picked_up_is_skipped():
+    dispatcher = LLMDispatcher(requests_per_minute=600, tokens_per_minute=0, workers=1)
+    llm = FakeChatModel(lambda prompt: f"answer to {prompt}", latency=0.1)
+    busy = dispatcher.submit(llm, "keeps the worker busy")
+    while not busy.running():
+        time.sleep(0.01)
+    dispatcher.submit(llm, "given up on")
+    with dispatcher._cond:
+        job = dispatcher._heap[0][2]
+        job.future = LateCancelFuture()
+        job.future.cancel()
+    assert busy.result(timeout=1).content == "answer to keeps the worker busy"
+    # The worker survived the cancelled job, which was neither charged nor left to be joined
+    assert dispatcher.submit(llm, "given up on").result(timeout=1).content == "answer to given up on"
+    assert dispatcher.calls == 2 and llm.prompts == ["keeps the worker busy", "given up on"]
+    dispatcher.close()
@@ -0,0 +1,36 @@
+import pytest
+
+from luna_agent import create_intent_router
+from luna_reminders import ReminderScheduler, ReminderStore, set_reminder_scheduler
+from luna_router import DEFAULT_CONFIDENCE_THRESHOLD, _detect_calculator
+
+
+@pytest.fixture
+def router():
+    scheduler = ReminderScheduler(ReminderStore(":memory:"))
+    set_reminder_scheduler(scheduler)
+    yield create_intent_router()
+    set_reminder_scheduler(None)
+    scheduler.stop()
+
+
+@pytest.mark.parametrize("message", ["What is 12 * (7 + 3)?", "calculate 2 ** 10 / 4", "7 * 6 =",
+                                     "what's 5 plus 3"])
+def test_arithmetic_questions_are_routed(router, message):
+    assert "Calc-kun computed it" in router.route(message)
+
+
+@pytest.mark.parametrize("message", ["555-1234", "2024/10/17", "10-17", "3 + 4"])
+def test_numbers_without_an_arithmetic_cue_stay_below_the_threshold(router, message):
+    decision = _detect_calculator(message)
+    assert decision is None or decision.confidence < DEFAULT_CONFIDENCE_THRESHOLD
+    assert router.route(message) is None
+
+
+def test_tool_failures_fall_back_to_the_agent_and_are_not_counted(router):
+    assert router.route("what is 1 / 0") is None
+    assert router.route("remind me to water the plants at 25:00") is None
+    assert router.route("remind me to water the plants in 10 minutes") is not None
+    stats = router.stats()
+    assert stats["routed"] == 1 and stats["fallbacks"] == 2
+    assert stats["llm_calls_saved"] == 2
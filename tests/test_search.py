@@ -0,0 +1,132 @@
+import json
+import os
+
+import pytest
+
+from luna_search import LocalSearchEngine
+
+CORPUS = {
+    "octopus.md": "# Octopuses\nAn octopus has three hearts and blue blood.",
+    "moon.md": "# The Moon\nThe moon drifts away from the Earth by about four centimeters a year.",
+    "bees.txt": "Bees\nHoney bees dance to tell each other where the flowers are.",
+}
+FACTS = [
+    {"id": "fact-1", "title": "Sloths", "text": "Sloths can hold their breath longer than dolphins."},
+    {"id": "fact-2", "title": "Hearts",
+     "text": "A blue whale's heart is as big as a small car; the octopus beats it on count."},
+]
+
+
+def write(path, text, bump=0):
+    path.write_text(text, encoding="utf-8")
+    if bump:
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + bump))  # a visible change even within one mtime tick
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    directory = tmp_path / "corpus"
+    directory.mkdir()
+    for name, text in CORPUS.items():
+        write(directory / name, text)
+    (directory / "facts.jsonl").write_text("\n".join(json.dumps(fact) for fact in FACTS), encoding="utf-8")
+    return directory
+
+
+@pytest.fixture
+def engine(tmp_path, corpus):
+    engine = LocalSearchEngine(str(tmp_path / "index"))
+    assert engine.index_corpus(str(corpus)) == 5
+    yield engine
+    engine.close()
+
+
+def ids(results):
+    return [result.doc_id for result in results]
+
+
+def test_corpus_is_ranked_by_bm25(engine, corpus):
+    results = engine.search("how many hearts does an octopus have?", limit=3)
+    assert ids(results) == [str(corpus / "octopus.md"), "fact-2"]
+    assert results[0].title == "Octopuses" and "three hearts" in results[0].snippet
+    assert results[0].score > results[1].score
+    assert engine.search("the of and") == [] and engine.search("zebras") == []
+
+
+def test_only_changed_files_are_indexed_again(engine, corpus):
+    assert engine.index_corpus(str(corpus)) == 0
+    write(corpus / "moon.md", "# The Moon\nThe moon has moonquakes that last for hours.", bump=5)
+    assert engine.index_corpus(str(corpus)) == 1
+    assert ids(engine.search("moonquakes")) == [str(corpus / "moon.md")]
+    assert engine.search("centimeters") == []
+    assert engine.stats()["documents"] == 5 and engine.stats()["deleted"] == 1
+
+
+def test_deleted_files_stay_deleted(engine, corpus, tmp_path):
+    (corpus / "bees.txt").unlink()
+    assert engine.index_corpus(str(corpus)) == 0
+    assert engine.search("honey bees") == []
+    engine.close()
+    reopened = LocalSearchEngine(str(tmp_path / "index"))
+    assert reopened.search("honey bees") == []
+    assert reopened.index_corpus(str(corpus)) == 0
+    assert reopened.stats()["documents"] == 4
+    reopened.close()
+
+
+def test_replaced_sources_are_tombstoned_and_removed_sources_dropped(tmp_path):
+    engine = LocalSearchEngine(str(tmp_path / "index"))
+    engine.add_source("stars", [{"text": "Stars twinkle because of the air."}])
+    engine.add_source("planets", [{"text": "Jupiter is the biggest planet."}, {"text": "Mars is red."}])
+    assert engine.commit() == 3
+    engine.add_source("stars", [{"text": "The sun is a star."}])
+    assert engine.commit() == 1
+    assert ids(engine.search("twinkle")) == []
+    assert ids(engine.search("star")) == ["stars#0"]
+    assert engine.stats()["deleted"] == 1 and engine.stats()["segments"] == 2
+
+    engine.remove_source("planets")
+    assert engine.commit() == 0
+    assert engine.search("jupiter") == []
+    # The first segment had nothing live left, so it went with its tombstones
+    assert engine.stats()["segments"] == 1 and engine.stats()["deleted"] == 0
+    assert sorted(name for name in os.listdir(tmp_path / "index") if name.startswith("seg_")) == ["seg_000002"]
+    engine.close()
+
+
+def test_too_many_segments_are_merged_without_tombstones(tmp_path):
+    engine = LocalSearchEngine(str(tmp_path / "index"), max_segments=2)
+    for number in range(3):
+        engine.add_source(f"s{number}", [{"text": f"Story number {number} about a fox."}])
+        if number:
+            engine.commit()
+    assert engine.stats()["segments"] == 2
+    # A third segment, and a tombstone in the first one: over the limit, so all are merged
+    engine.add_source("s0", [{"text": "Story zero is now about an owl."}])
+    engine.commit()
+    stats = engine.stats()
+    assert stats["segments"] == 1 and stats["deleted"] == 0 and stats["documents"] == 3
+    assert sorted(ids(engine.search("fox"))) == ["s1#0", "s2#0"]
+    assert ids(engine.search("owl")) == ["s0#0"]
+    assert len([name for name in os.listdir(tmp_path / "index") if name.startswith("seg_")]) == 1
+    engine.close()
+
+
+def test_a_new_instance_reads_the_index_through_mmap(engine, corpus, tmp_path):
+    expected = [(result.doc_id, result.score) for result in engine.search("blue hearts", limit=5)]
+    assert len(expected) == 2
+    reopened = LocalSearchEngine(str(tmp_path / "index"))
+    assert [(result.doc_id, result.score) for result in reopened.search("blue hearts", limit=5)] == expected
+    assert reopened.stats()["documents"] == 5 and reopened.stats()["segments"] == 1
+    reopened.close()
+
+
+def test_query_cache_is_cleared_by_a_commit(engine):
+    engine.search("octopus")
+    engine.search("octopus")
+    assert engine.stats()["cache_hits"] == 1
+    engine.add_source("extra", [{"text": "Another octopus fact: they taste with their arms."}])
+    engine.commit()
+    assert "extra#0" in ids(engine.search("octopus", limit=5))
+    assert engine.stats()["cache_hits"] == 1
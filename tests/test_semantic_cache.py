@@ -0,0 +1,50 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from luna_agent import stream_luna_response
+from luna_fakes import FakeAgent, FakeChatModel
+from luna_memory import ConversationMemory
+from luna_semantic_cache import SemanticCache, set_semantic_cache
+
+
+@pytest.fixture
+def cache():
+    cache = SemanticCache(capacity=32)
+    set_semantic_cache(cache)
+    yield cache
+    set_semantic_cache(None)
+
+
+def test_paraphrase_is_served_from_the_cache(cache):
+    assert cache.store("tell me about cherry blossoms", "They bloom in spring, Master!")
+    assert cache.lookup("Can you tell me about cherry blossoms?") == "They bloom in spring, Master!"
+    assert cache.lookup("tell me about sunflowers") is None
+
+
+@pytest.mark.parametrize("question", ["what is my name?", "Tell me my name", "What do I like?",
+                                      "what did we talk about", "why is that?", "what is the weather today"])
+def test_personal_follow_up_and_time_sensitive_questions_are_not_shared(cache, question):
+    assert not cache.store(question, "Your name is Alice, silly!")
+    assert cache.lookup(question) is None
+
+
+def test_asking_phrases_do_not_make_a_question_personal(cache):
+    assert cache.cacheable("tell me about octopuses")
+    assert cache.cacheable("I wonder why the sky is blue")
+
+
+def test_excluded_tools_keep_the_answer_out(cache):
+    assert not cache.store("set a timer for tea", "Done!", tools_used=["reminder_planner"])
+
+
+def test_conversations_with_history_bypass_the_cache(cache):
+    agent = FakeAgent(FakeChatModel(["Octopuses have three hearts!"]))
+    assert not stream_luna_response(agent, "Tell me a fun fact about octopuses")["cached"]
+    assert stream_luna_response(agent, "tell me a fun fact about octopuses")["cached"]
+
+    memory = ConversationMemory()
+    memory.add_turn("I am Alice", "Nice to meet you, Alice!")
+    response = stream_luna_response(agent, "tell me a fun fact about octopuses", memory=memory)
+    assert not response["cached"]
+    assert agent.llm.calls == 2
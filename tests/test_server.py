@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+
+from luna_fakes import FakeAgent, FakeChatModel
+from luna_pipeline import LunaPipeline
+from luna_router import IntentRouter
+from luna_rules import CompiledRuleEngine
+from luna_semantic_cache import SemanticCache
+from luna_server import LunaService, _call_app
+
+TURN = 0.2
+
+
+def make_service(**options):
+    agent = FakeAgent(FakeChatModel(lambda prompt: f"Ooh! Luna thought about '{prompt}'! ✨", latency=TURN))
+    return LunaService(lambda: LunaPipeline(CompiledRuleEngine.from_file(), agent), **options)
+
+
+def chat(service, session_id, message, path="/chat"):
+    return _call_app(service, "POST", path, {"session_id": session_id, "message": message})
+
+
+def test_a_turn_waiting_on_its_session_does_not_hold_a_worker():
+    service = make_service(max_workers=2)
+
+    async def timed(coro):
+        start = time.perf_counter()
+        status, _ = await coro
+        return status, time.perf_counter() - start
+
+    async def main():
+        first = asyncio.ensure_future(timed(chat(service, "a", "first question")))
+        second = asyncio.ensure_future(timed(chat(service, "a", "second question")))
+        await asyncio.sleep(0.01)
+        other = await timed(chat(service, "b", "another question"))
+        return await first, await second, other
+
+    first, second, other = asyncio.run(main())
+    assert [first[0], second[0], other[0]] == [200, 200, 200]
+    # Session "a"'s second turn waits for its first, but session "b" gets the free worker at once
+    assert second[1] >= 2 * TURN
+    assert other[1] < 1.5 * TURN
+    service.pipeline.close()
+
+
+def test_an_overloaded_stream_gets_a_503_before_any_event():
+    service = make_service(max_workers=1, max_queue=0)
+
+    async def main():
+        busy = asyncio.ensure_future(chat(service, "a", "a slow question"))
+        await asyncio.sleep(0.01)
+        rejected = await chat(service, "b", "anyone there?", path="/chat/stream")
+        return await busy, rejected
+
+    (busy_status, _), (status, body) = asyncio.run(main())
+    assert busy_status == 200
+    assert status == 503
+    assert json.loads(body)["error"].startswith("overloaded")
+    service.pipeline.close()
+
+
+def test_a_stream_starts_once_a_worker_is_granted():
+    service = make_service()
+    status, body = asyncio.run(chat(service, "a", "tell me a fun fact", path="/chat/stream"))
+    events = [json.loads(line) for line in body.decode().splitlines()]
+    assert status == 200
+    assert [event["type"] for event in events] == ["started", "text", "emotion", "done"]
+    assert events[-1]["source"] == "agent"
+    service.pipeline.close()
+
+
+def test_pipeline_takes_the_router_and_semantic_cache_fast_paths():
+    calls = []
+
+    def answer(prompt):
+        calls.append(prompt)
+        return "Ooh! Octopuses have three hearts! ✨"
+
+    router = IntentRouter({"calculator": lambda expression: f"{expression} = {eval(expression)}"})
+    pipeline = LunaPipeline(CompiledRuleEngine.from_file(), FakeAgent(FakeChatModel(answer)),
+                            router=router, semantic_cache=SemanticCache(capacity=16))
+
+    async def main():
+        return [await pipeline.respond(message) for message in
+                ["What is 6 * 7?", "How many hearts does an octopus have?", "how many hearts do octopuses have"]]
+
+    routed, answered, cached = asyncio.run(main())
+    pipeline.close()
+    assert routed.source == "router" and "6 * 7 = 42" in routed.text
+    assert answered.source == "agent"
+    assert cached.source == "cache" and cached.text == answered.text
+    assert len(calls) == 1
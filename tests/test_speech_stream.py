@@ -0,0 +1,61 @@
+import random
+import time
+
+import pytest
+
+from luna_fakes import FakeTTSClient
+from luna_speech_stream import SentenceSplitter, StreamingSpeechPipeline, split_sentences, synthesize_audio_streamed
+from luna_tts import AudioStore, clean_tts_text
+
+ID3_TAG = b"ID3\x04\x00\x00\x00\x00\x00\x04TAG!"
+
+REPLY = ("Kyaa~! That's such a fun question, Master! Hehe! "
+         "The moon is slowly drifting away from the Earth, about four centimeters every year! "
+         "Isn't that amazing? Luna will keep watching the sky with you every night!")
+
+
+class TaggedTTSClient(FakeTTSClient):
+    """Fake ElevenLabs whose clips start with an ID3 tag and take a random time per sentence."""
+
+    def __init__(self):
+        super().__init__()
+        self._jitter = random.Random(4)
+
+    def convert(self, text, **kwargs):
+        time.sleep(self._jitter.uniform(0.0, 0.03))
+        chunks = super().convert(text, **kwargs)
+        return iter([ID3_TAG] + list(chunks))
+
+
+def test_splitter_merges_short_fragments_and_keeps_the_remainder():
+    splitter = SentenceSplitter(min_chars=12)
+    assert splitter.feed("Hehe! Luna is here for you. And") == ["Hehe! Luna is here for you."]
+    assert splitter.flush() == ["And"]
+    assert split_sentences("One. Two.") == ["One. Two."]
+
+
+def test_chunks_come_out_in_reply_order_from_streamed_tokens(tmp_path):
+    pipeline = StreamingSpeechPipeline(TaggedTTSClient(), AudioStore(str(tmp_path)))
+    tokens = [word + " " for word in REPLY.split(" ")]
+    chunks = list(pipeline.speak(tokens))
+    assert [chunk.index for chunk in chunks] == list(range(len(chunks)))
+    assert [chunk.text for chunk in chunks] == split_sentences(REPLY)
+    assert all(chunk.audio_path for chunk in chunks)
+    assert [chunk.ready_at for chunk in chunks] == sorted(chunk.ready_at for chunk in chunks)
+    assert pipeline.first_audio_at < chunks[-1].ready_at
+
+
+def test_stitched_clip_keeps_sentence_order_and_one_id3_tag(tmp_path):
+    store = AudioStore(str(tmp_path))
+    played = []
+    path = synthesize_audio_streamed(TaggedTTSClient(), REPLY, store, on_chunk=lambda chunk: played.append(chunk.index))
+    data = open(path, "rb").read()
+    assert data.startswith(ID3_TAG) and data.count(b"ID3") == 1
+    positions = [data.index(clean_tts_text(sentence).encode()[:20]) for sentence in split_sentences(REPLY)]
+    assert positions == sorted(positions)
+    assert played == list(range(len(positions)))
+
+
+def test_a_failed_sentence_fails_the_clip(tmp_path):
+    with pytest.raises(RuntimeError):
+        synthesize_audio_streamed(FakeTTSClient(failure_rate=1.0), REPLY, AudioStore(str(tmp_path)))
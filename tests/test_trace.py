@@ -0,0 +1,130 @@
+import asyncio
+import contextvars
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from luna_resilience import ResiliencePolicy
+from luna_trace import NOOP_SPAN, JSONLinesExporter, Tracer, current_span
+
+
+class Collector:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+@pytest.fixture
+def collector():
+    return Collector()
+
+
+@pytest.fixture
+def tracer(collector):
+    return Tracer(exporters=[collector], buckets=(0.1, 1.0))
+
+
+def test_children_share_the_trace_and_point_at_their_parent(tracer, collector):
+    with tracer.span("turn") as turn:
+        with tracer.span("llm") as llm:
+            assert current_span() is llm
+        assert current_span() is turn
+        with tracer.span("tts"):
+            pass
+    assert current_span() is None
+    llm_span, tts_span, turn_span = collector.spans
+    assert turn_span.parent_id is None
+    assert llm_span.parent_id == tts_span.parent_id == turn_span.span_id
+    assert {span.trace_id for span in collector.spans} == {turn_span.trace_id}
+    assert len({span.span_id for span in collector.spans}) == 3
+    with tracer.span("next turn") as other:
+        pass
+    assert other.trace_id != turn_span.trace_id
+
+
+def test_start_span_is_not_made_current(tracer, collector):
+    with tracer.span("turn") as turn:
+        callback = tracer.start_span("agent")
+        assert current_span() is turn
+        callback.set(output_tokens=3).end()
+        callback.end()  # a second end() is ignored
+    assert [span.name for span in collector.spans] == ["agent", "turn"]
+    assert collector.spans[0].parent_id == turn.span_id
+
+
+def test_context_follows_work_handed_to_threads_and_executors(tracer, collector):
+    def work(name):
+        with tracer.span(name):
+            pass
+
+    with tracer.span("turn") as turn:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            pool.submit(contextvars.copy_context().run, work, "copied").result()
+            pool.submit(work, "bare").result()  # executors don't copy the context by themselves
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(work, "thread"))
+        thread.start()
+        thread.join()
+        ResiliencePolicy("test", timeout=1.0).call(work, "upstream")
+
+        async def main():
+            await asyncio.to_thread(work, "to_thread")
+        asyncio.run(main())
+
+    parents = {span.name: span.parent_id for span in collector.spans}
+    assert parents["copied"] == parents["thread"] == parents["upstream"] == parents["to_thread"] == turn.span_id
+    assert parents["bare"] is None
+
+
+def test_errors_are_recorded_on_the_span(tracer, collector):
+    with pytest.raises(ValueError):
+        with tracer.span("tts"):
+            raise ValueError("no voice")
+    assert collector.spans[0].status == "error"
+    assert collector.spans[0].attributes["error"] == "ValueError: no voice"
+    assert tracer.snapshot()["tts"]["errors"] == 1
+
+
+def test_prometheus_text(tracer):
+    for duration in (0.05, 0.5, 2.0):
+        span = tracer.start_span("llm", input_tokens=10, output_tokens=4)
+        span._t0 -= duration
+        span.end()
+    tracer.start_span("tts", characters=42).end(RuntimeError("boom"))
+    lines = tracer.prometheus_text().splitlines()
+    assert lines[:2] == ["# HELP luna_span_duration_seconds Time spent in each Luna stage.",
+                         "# TYPE luna_span_duration_seconds histogram"]
+    for expected in ['luna_span_duration_seconds_bucket{span="llm",le="0.1"} 1',
+                     'luna_span_duration_seconds_bucket{span="llm",le="1.0"} 2',
+                     'luna_span_duration_seconds_bucket{span="llm",le="+Inf"} 3',
+                     'luna_span_duration_seconds_count{span="llm"} 3',
+                     'luna_span_errors_total{span="tts"} 1',
+                     "# TYPE luna_input_tokens_total counter",
+                     'luna_input_tokens_total{span="llm"} 30',
+                     'luna_output_tokens_total{span="llm"} 12',
+                     'luna_characters_total{span="tts"} 42']:
+        assert expected in lines
+    total = next(line for line in lines if line.startswith('luna_span_duration_seconds_sum{span="llm"}'))
+    assert float(total.split()[-1]) == pytest.approx(2.55, abs=0.01)
+    assert "luna_bytes_total" not in "\n".join(lines)
+    tracer.reset()
+    assert 'span="llm"' not in tracer.prometheus_text()
+
+
+def test_json_lines_exporter_and_disabled_tracer():
+    stream = io.StringIO()
+    tracer = Tracer(exporters=[JSONLinesExporter(stream)])
+    with tracer.span("turn", characters=5):
+        pass
+    record = json.loads(stream.getvalue())
+    assert record["name"] == "turn" and record["parent_id"] is None and record["attributes"] == {"characters": 5}
+
+    off = Tracer(enabled=False)
+    assert off.span("turn") is NOOP_SPAN and off.start_span("turn") is NOOP_SPAN
+    with off.span("turn"):
+        assert current_span() is None
+    assert off.prometheus_text().count("\n") == 4  # only the HELP/TYPE headers
@@ -0,0 +1,48 @@
+import pytest
+
+from luna_cache import ResponseCache
+from luna_fakes import FakeChatModel
+from luna_translate import BatchTranslator, TranslationError, fake_translation_responder
+
+SEGMENTS = [f"Luna thinks topic {i} is super fun, Master!" for i in range(30)]
+LANGUAGES = ["French", "Japanese"]
+
+
+def make_translator(llm, **options):
+    return BatchTranslator(llm, cache=ResponseCache(db_path=None), **options)
+
+
+def test_batches_are_matched_back_in_order():
+    llm = FakeChatModel(fake_translation_responder(), temperature=0.2)
+    results = make_translator(llm).translate(SEGMENTS + [""], LANGUAGES)
+    for language in LANGUAGES:
+        assert results[language] == [f"[{language}] {segment}" for segment in SEGMENTS] + [""]
+    assert llm.calls == 1
+
+
+def test_items_the_model_leaves_out_are_retried_in_smaller_batches():
+    llm = FakeChatModel(fake_translation_responder(drop_every=7), temperature=0.2)
+    translator = make_translator(llm)
+    results = translator.translate(SEGMENTS, LANGUAGES)
+    assert results["French"][6] == f"[French] {SEGMENTS[6]}"
+    assert translator.stats()["retried_items"] > 0
+    assert 1 < llm.calls < len(SEGMENTS) * len(LANGUAGES)
+
+
+def test_a_failing_call_is_not_split_and_retried():
+    llm = FakeChatModel(fake_translation_responder(), failure_rate=1.0, temperature=0.2)
+    translator = make_translator(llm, max_batch_items=10)
+    with pytest.raises(TranslationError, match="fake LLM failure"):
+        translator.translate(SEGMENTS, LANGUAGES)
+    assert llm.calls == 1
+    assert translator.stats()["retried_items"] == 0
+
+
+def test_an_unreadable_answer_is_split_down_to_single_items():
+    def respond(prompt):
+        return "Kyaa~! Luna forgot the JSON!" if "translating in bulk" in prompt else ""
+
+    llm = FakeChatModel(respond, temperature=0.2)
+    with pytest.raises(TranslationError, match="could not translate"):
+        make_translator(llm).translate(SEGMENTS[:4], ["French"])
+    assert llm.calls > 1
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+
+import pytest
+
+from luna_fakes import FakeTTSClient
+from luna_resilience import ResiliencePolicy, UpstreamTimeout
+from luna_tts import AudioStore, split_tts_chunks, synthesize_audio_chunked
+
+ID3_TAG = b"ID3\x04\x00\x00\x00\x00\x00\x04TAG!"
+
+STORY = "\n\n".join(f"Once upon a time, in village number {i}, a little fox asked Luna for a story about the stars."
+                    for i in range(6))
+
+
+class ScriptedTTSClient(FakeTTSClient):
+    """Fake ElevenLabs whose clips start with an ID3 tag; `stall` makes the first call for a chunk hang."""
+
+    def __init__(self, stall=None, fail=None, stall_latency=1.0):
+        super().__init__()
+        self.stall = stall
+        self.fail = fail
+        self.stall_latency = stall_latency
+        self.texts = []
+        self._seen = threading.Lock()
+
+    def convert(self, text, **kwargs):
+        with self._seen:
+            first = text not in self.texts
+            self.texts.append(text)
+        if self.stall and self.stall in text and first:
+            time.sleep(self.stall_latency)
+        if self.fail and self.fail in text:
+            raise RuntimeError("fake TTS failure (scripted)")
+        return iter([ID3_TAG] + list(super().convert(text, **kwargs)))
+
+
+def test_chunks_are_stitched_from_memory_into_one_stored_clip(tmp_path):
+    chunks = split_tts_chunks(STORY, 200)
+    expected = ID3_TAG + b"".join(b"".join(FakeTTSClient().convert(chunk)) for chunk in chunks)
+    # Room for the stitched clip only: per-chunk clips in the store would evict each other first
+    store = AudioStore(str(tmp_path), max_bytes=len(expected), evict_every=1)
+    client = ScriptedTTSClient()
+    path = synthesize_audio_chunked(client, STORY, store, max_chars=200, workers=3,
+                                    policy=ResiliencePolicy("tts-test", timeout=1.0, attempts=1))
+    assert len(chunks) > 1 and client.calls == len(chunks)
+    with open(path, "rb") as clip:
+        assert clip.read() == expected
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+
+
+def test_a_stalled_chunk_is_retried_on_its_own(tmp_path):
+    client = ScriptedTTSClient(stall="village number 3", stall_latency=1.0)
+    policy = ResiliencePolicy("tts-test", timeout=0.3, attempts=2, base_delay=0.0)
+    start = time.perf_counter()
+    path = synthesize_audio_chunked(client, STORY, AudioStore(str(tmp_path)), max_chars=200, workers=3, policy=policy)
+    assert time.perf_counter() - start < 0.9
+    assert path and policy.stats()["timeouts"] == 1
+    assert len(client.texts) == len(split_tts_chunks(STORY, 200)) + 1
+
+
+def test_a_chunk_that_keeps_failing_stores_nothing(tmp_path):
+    client = ScriptedTTSClient(fail="village number 1")
+    policy = ResiliencePolicy("tts-test", timeout=1.0, attempts=2, base_delay=0.0)
+    with pytest.raises(RuntimeError, match="scripted"):
+        synthesize_audio_chunked(client, STORY, AudioStore(str(tmp_path)), max_chars=200, policy=policy)
+    assert policy.stats()["retries"] == 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_the_policy_timeout_bounds_each_chunk_not_the_clip(tmp_path):
+    client = FakeTTSClient(latency=0.2)
+    policy = ResiliencePolicy("tts-test", timeout=0.3, attempts=1)
+    path = synthesize_audio_chunked(client, STORY, AudioStore(str(tmp_path)), max_chars=120, workers=2, policy=policy)
+    assert path and client.calls > 2  # the clip takes well over 0.3 s in all
+    with pytest.raises(UpstreamTimeout):
+        synthesize_audio_chunked(FakeTTSClient(latency=0.5), STORY + " More.", AudioStore(str(tmp_path / "slow")),
+                                 max_chars=120, workers=2, policy=policy)